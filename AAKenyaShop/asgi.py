@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AAKenyaShop.settings')
+# Each request runs its sync code on a thread of its own; connections kept
+# open on those threads would pile up. Pool them instead (DB_POOL).
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
@@ -42,23 +42,27 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'AAShop',
     'rest_framework',
     'rest_framework_simplejwt',
     'drf_yasg',
+    'django_filters',
     'corsheaders',
 ]
 
 MIDDLEWARE = [
+    'AAShop.instrumentation.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'AAShop.routers.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    "whitenoise.middleware.WhiteNoiseMiddleware",  
+    "AAShop.middleware.AsyncWhiteNoiseMiddleware",
 ]
 
 ROOT_URLCONF = 'AAKenyaShop.urls'
@@ -95,7 +99,115 @@ DATABASES = {
     }
 }
 
-DATABASES["default"] = dj_database_url.parse(config("DATABASE_URL"))
+# Connections. DB_CONN_MAX_AGE is how many seconds a connection is kept for
+# later requests (0 opens one per request); a kept connection is checked
+# before reuse when DB_CONN_HEALTH_CHECKS is on. Under uvicorn requests run
+# on short-lived threads that would each keep one, so asgi.py defaults it
+# to 0: use DB_POOL there.
+# DB_POOL uses psycopg's connection pool instead (PostgreSQL only): each
+# process keeps DB_POOL_MIN_SIZE..DB_POOL_MAX_SIZE connections and a request
+# waits up to DB_POOL_TIMEOUT seconds for a free one.
+# DB_PGBOUNCER is for connecting through pgbouncer in transaction mode:
+# server-side cursors and prepared statements do not survive a switch of
+# server connection between transactions, so both are turned off.
+DB_CONN_MAX_AGE = config("DB_CONN_MAX_AGE", default=60, cast=int)
+DB_CONN_HEALTH_CHECKS = config("DB_CONN_HEALTH_CHECKS", default=True, cast=bool)
+DB_POOL = config("DB_POOL", default=False, cast=bool)
+DB_POOL_MIN_SIZE = config("DB_POOL_MIN_SIZE", default=2, cast=int)
+DB_POOL_MAX_SIZE = config("DB_POOL_MAX_SIZE", default=10, cast=int)
+DB_POOL_TIMEOUT = config("DB_POOL_TIMEOUT", default=10, cast=float)
+DB_PGBOUNCER = config("DB_PGBOUNCER", default=False, cast=bool)
+
+
+def database(url):
+    db = dj_database_url.parse(
+        url,
+        # Django closes pooled connections back into the pool; it refuses
+        # a CONN_MAX_AGE on top of one
+        conn_max_age=0 if DB_POOL else DB_CONN_MAX_AGE,
+        conn_health_checks=DB_CONN_HEALTH_CHECKS,
+        disable_server_side_cursors=DB_PGBOUNCER,
+    )
+    if db["ENGINE"] == "django.db.backends.postgresql":
+        options = db.setdefault("OPTIONS", {})
+        if DB_POOL:
+            # CONN_HEALTH_CHECKS becomes the pool's check on checkout
+            options["pool"] = {"min_size": DB_POOL_MIN_SIZE, "max_size": DB_POOL_MAX_SIZE, "timeout": DB_POOL_TIMEOUT}
+        if DB_PGBOUNCER:
+            options["prepare_threshold"] = None
+    return db
+
+
+DATABASES["default"] = database(config("DATABASE_URL"))
+
+# Read replicas: each DATABASE_URL_REPLICA_<NAME> variable adds a
+# "replica_<name>" alias. Catalog and reporting reads are spread over them
+# (see AAShop/routers.py); a user who has just written reads from the
+# primary for REPLICA_PIN_SECONDS, which should exceed the replication lag.
+# Run the test suite without them: a replica cannot see the uncommitted
+# rows TestCase works with (ReplicaRoutingTests sets up its own).
+DATABASE_REPLICAS = []
+for name, url in sorted(os.environ.items()):
+    if name.startswith("DATABASE_URL_REPLICA_"):
+        alias = "replica_" + name.removeprefix("DATABASE_URL_REPLICA_").lower()
+        # No test database of its own; under test it reads the default one
+        DATABASES[alias] = {**database(url), "TEST": {"MIRROR": "default"}}
+        DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["AAShop.routers.ReplicaRouter"]
+REPLICA_PIN_SECONDS = config("REPLICA_PIN_SECONDS", default=5, cast=int)
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Point CACHE_URL at Redis (e.g. redis://localhost:6379/1) in production;
+# without it each process falls back to a local-memory cache.
+
+CACHE_URL = config("CACHE_URL", default="")
+
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Seconds a cached catalog response lives; updates invalidate it earlier.
+CATALOG_CACHE_TIMEOUT = config("CATALOG_CACHE_TIMEOUT", default=300, cast=int)
+
+# Authenticated users are cached for AUTH_USER_CACHE_TTL seconds in the cache
+# above and, for AUTH_USER_LOCAL_TTL seconds, in each process (up to
+# AUTH_USER_LOCAL_SIZE users). A deactivation or password change reaches
+# other processes within AUTH_USER_LOCAL_TTL.
+AUTH_USER_CACHE_TTL = config("AUTH_USER_CACHE_TTL", default=300, cast=int)
+AUTH_USER_LOCAL_TTL = config("AUTH_USER_LOCAL_TTL", default=5, cast=float)
+AUTH_USER_LOCAL_SIZE = config("AUTH_USER_LOCAL_SIZE", default=10000, cast=int)
+
+# Share of requests (0..1) that get Server-Timing headers and feed the
+# latency histograms at /metrics/
+REQUEST_TIMING_SAMPLE_RATE = config("REQUEST_TIMING_SAMPLE_RATE", default=0.1, cast=float)
+
+# Where carts live: "db" (Cart/CartItem tables) or "redis" (a hash per cart,
+# written back to the tables every CART_WRITE_BEHIND_INTERVAL seconds and
+# before checkout). Idle Redis carts expire after CART_REDIS_TTL seconds.
+CART_BACKEND = config("CART_BACKEND", default="db")
+CART_REDIS_URL = config("CART_REDIS_URL", default="redis://localhost:6379/2")
+CART_REDIS_TTL = config("CART_REDIS_TTL", default=7 * 24 * 60 * 60, cast=int)
+CART_WRITE_BEHIND_INTERVAL = config("CART_WRITE_BEHIND_INTERVAL", default=30, cast=int)
+
+# Daily sales rollups behind /api/analytics/ are refreshed every
+# SALES_ROLLUP_INTERVAL seconds; each refresh looks SALES_ROLLUP_OVERLAP
+# seconds behind the last watermark for orders committed late.
+SALES_ROLLUP_INTERVAL = config("SALES_ROLLUP_INTERVAL", default=5 * 60, cast=int)
+SALES_ROLLUP_OVERLAP = config("SALES_ROLLUP_OVERLAP", default=10 * 60, cast=int)
+
 
 # Password validation
 # https://docs.dja  ngoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -149,7 +261,7 @@ AUTH_USER_MODEL = "AAShop.User"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "AAShop.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.IsAuthenticated",
@@ -177,6 +289,35 @@ CHAPA_SECRET_KEY = env("CHAPA_SECRET_KEY")
 CHAPA_PUBLIC_KEY = env("CHAPA_PUBLIC_KEY")
 CHAPA_ENCRYPTION_KEY = env("CHAPA_ENCRYPTION_KEY")
 CHAPA_BASE_URL = env("CHAPA_BASE_URL", default="https://api.chapa.co/v1")
+CHAPA_CALLBACK_URL = env("CHAPA_CALLBACK_URL", default="http://127.0.0.1:8000/api/payments/verify/")
+CHAPA_RETURN_URL = env("CHAPA_RETURN_URL", default="http://127.0.0.1:8000/payment/success/")
+
+# Gateway client: (connect, read) timeouts in seconds, retries with backoff
+# and the size of the pooled session's connection pool.
+CHAPA_CONNECT_TIMEOUT = env.float("CHAPA_CONNECT_TIMEOUT", default=3.05)
+CHAPA_READ_TIMEOUT = env.float("CHAPA_READ_TIMEOUT", default=10)
+CHAPA_MAX_RETRIES = env.int("CHAPA_MAX_RETRIES", default=2)
+CHAPA_BACKOFF_FACTOR = env.float("CHAPA_BACKOFF_FACTOR", default=0.5)
+CHAPA_POOL_SIZE = env.int("CHAPA_POOL_SIZE", default=10)
+# Connections of the httpx client behind the async views, per worker process
+CHAPA_ASYNC_POOL_SIZE = env.int("CHAPA_ASYNC_POOL_SIZE", default=1000)
+
+# Initialize payments in a Celery task and return the Payment right away;
+# clients poll payments/status/<tx_ref>/ for the checkout_url.
+CHAPA_ASYNC_INIT = env.bool("CHAPA_ASYNC_INIT", default=False)
+
+# Secret hash set on the Chapa dashboard; webhooks must be signed with it.
+# Left empty, webhooks are accepted unsigned with DEBUG on and rejected
+# with 401 otherwise.
+CHAPA_WEBHOOK_SECRET = env("CHAPA_WEBHOOK_SECRET", default="")
+
+# Reconciliation of pending payments: payments younger than MIN_AGE seconds
+# are left to the customer and the webhook; those still unresolved after
+# STALE_AFTER seconds are failed and their orders cancelled.
+PAYMENT_RECONCILE_BATCH_SIZE = env.int("PAYMENT_RECONCILE_BATCH_SIZE", default=500)
+PAYMENT_RECONCILE_CONCURRENCY = env.int("PAYMENT_RECONCILE_CONCURRENCY", default=CHAPA_POOL_SIZE)
+PAYMENT_RECONCILE_MIN_AGE = env.int("PAYMENT_RECONCILE_MIN_AGE", default=15 * 60)
+PAYMENT_STALE_AFTER = env.int("PAYMENT_STALE_AFTER", default=24 * 60 * 60)
 
 
 
@@ -188,3 +329,105 @@ SIMPLE_JWT = {
 
 CELERY_BROKER_URL = "redis://localhost:6379/0"
 CELERY_RESULT_BACKEND = "redis://localhost:6379/0"
+# Run tasks inline (no broker or worker), e.g. for local benchmarks
+CELERY_TASK_ALWAYS_EAGER = config("CELERY_TASK_ALWAYS_EAGER", default=False, cast=bool)
+
+# Payment-critical tasks (a customer or Chapa is waiting) get a queue of
+# their own, so a backlog of emails or a long reconciliation never sits in
+# front of them; each queue is served by its own worker profile below.
+# Priorities order tasks within a queue (0 first on Redis).
+CELERY_TASK_DEFAULT_QUEUE = "default"
+CELERY_TASK_DEFAULT_PRIORITY = 5
+CELERY_TASK_ROUTES = {
+    "AAShop.tasks.initialize_chapa_payment": {"queue": "payments", "priority": 0},
+    "AAShop.tasks.process_webhook_events": {"queue": "payments", "priority": 2},
+    "AAShop.tasks.send_outbox_emails": {"queue": "email"},
+    "AAShop.tasks.send_payment_confirmation_email": {"queue": "email"},
+    "AAShop.tasks.reconcile_payments": {"queue": "bulk"},
+    "AAShop.tasks.refresh_sales_rollups": {"queue": "bulk"},
+    "AAShop.tasks.flush_dirty_carts": {"queue": "bulk"},
+}
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "queue_order_strategy": "priority",
+    "priority_steps": list(range(10)),
+    "sep": ":",
+    # Late-acked tasks still running after this long are handed to another
+    # worker; keep it above the longest reconciliation or rollup rebuild.
+    "visibility_timeout": 2 * 60 * 60,
+}
+# A worker whose child process dies re-queues its late-acked task.
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+
+# Worker entrypoints: python manage.py run_worker <profile>. Payment
+# workers take one task per process at a time (prefetch 1) so a slow Chapa
+# call never holds others back; the bulk profile also serves "default".
+CELERY_WORKER_PROFILES = {
+    "payments": {
+        "queues": ["payments"],
+        "concurrency": config("CELERY_PAYMENTS_CONCURRENCY", default=8, cast=int),
+        "prefetch_multiplier": 1,
+    },
+    "email": {
+        "queues": ["email"],
+        "concurrency": config("CELERY_EMAIL_CONCURRENCY", default=2, cast=int),
+        "prefetch_multiplier": 1,
+    },
+    "bulk": {
+        "queues": ["bulk", "default"],
+        "concurrency": config("CELERY_BULK_CONCURRENCY", default=2, cast=int),
+        "prefetch_multiplier": 4,
+    },
+    # Everything in one worker, for development
+    "all": {
+        "queues": ["payments", "email", "bulk", "default"],
+        "concurrency": config("CELERY_ALL_CONCURRENCY", default=4, cast=int),
+        "prefetch_multiplier": 1,
+    },
+}
+
+CELERY_BEAT_SCHEDULE = {
+    # Safety net: the webhook view schedules a drain itself, beat catches
+    # anything left behind (e.g. after a worker restart).
+    "process-webhook-events": {
+        "task": "AAShop.tasks.process_webhook_events",
+        "schedule": 10.0,
+    },
+    "reconcile-payments": {
+        "task": "AAShop.tasks.reconcile_payments",
+        "schedule": 5 * 60.0,
+    },
+    "flush-carts": {
+        "task": "AAShop.tasks.flush_dirty_carts",
+        "schedule": float(CART_WRITE_BEHIND_INTERVAL),
+    },
+    "refresh-sales-rollups": {
+        "task": "AAShop.tasks.refresh_sales_rollups",
+        "schedule": float(SALES_ROLLUP_INTERVAL),
+    },
+    # Sends retries once they are due; new emails schedule a drain themselves
+    "send-outbox-emails": {
+        "task": "AAShop.tasks.send_outbox_emails",
+        "schedule": 30.0,
+    },
+}
+
+EMAIL_BACKEND = config("EMAIL_BACKEND", default="django.core.mail.backends.smtp.EmailBackend")
+DEFAULT_FROM_EMAIL = config("DEFAULT_FROM_EMAIL", default="no-reply@yourshop.com")
+
+# Transactional emails go through the EmailOutbox table and are sent in
+# batches of EMAIL_OUTBOX_BATCH_SIZE over one connection per provider, at
+# most RATE_LIMIT messages a second (0: no limit) across all workers; a
+# RATE_LIMIT needs CACHE_URL unless DEBUG is on. A failed send is retried
+# after EMAIL_OUTBOX_RETRY_DELAY seconds, doubling each time, up to
+# EMAIL_OUTBOX_MAX_ATTEMPTS attempts. A provider's BACKEND of None means
+# EMAIL_BACKEND.
+EMAIL_PROVIDERS = {
+    "default": {
+        "BACKEND": None,
+        "RATE_LIMIT": env.float("EMAIL_RATE_LIMIT", default=0),
+        "OPTIONS": {},
+    },
+}
+EMAIL_OUTBOX_BATCH_SIZE = env.int("EMAIL_OUTBOX_BATCH_SIZE", default=100)
+EMAIL_OUTBOX_MAX_ATTEMPTS = env.int("EMAIL_OUTBOX_MAX_ATTEMPTS", default=6)
+EMAIL_OUTBOX_RETRY_DELAY = env.int("EMAIL_OUTBOX_RETRY_DELAY", default=60)
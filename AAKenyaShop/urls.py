@@ -19,6 +19,7 @@ from django.urls import path, include, re_path
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from AAShop.views import metrics_view
 
 
 schema_view = get_schema_view(
@@ -36,6 +37,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('AAShop.urls')),
     path("api/auth/", include("AAShop.urls")), 
+    path("metrics/", metrics_view, name="metrics"),
 
 
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
@@ -0,0 +1,159 @@
+"""Daily sales rollups behind /api/analytics/.
+
+Reports read three summary tables (DailySales, DailyCategorySales and
+DailyProductSales) instead of aggregating Order/OrderItem, so a report
+over a year reads a few hundred rollup rows per series however many
+orders there are. Orders count once paid (PAID or SHIPPED), on the day
+they were placed.
+
+The tables are refreshed incrementally: each run finds the days of the
+orders changed since the last watermark (Order.updated_at, covered by
+order_updated_idx) and recomputes just those days from their lines.
+Recomputing whole days makes a refresh idempotent, so every run looks
+SALES_ROLLUP_OVERLAP seconds behind the watermark to catch transactions
+that committed after the previous run read past them. Deleting orders
+does not move the watermark; ``refresh_sales_rollups(full=True)`` (the
+refresh_sales_rollups command with --full) rebuilds everything.
+"""
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import metrics
+from .models import DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem, RefreshWatermark
+
+SOLD_STATUSES = ("PAID", "SHIPPED")
+WATERMARK = "sales_rollups"
+ROLLUPS = (DailySales, DailyCategorySales, DailyProductSales)
+
+
+def _start_of(day):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+
+def _sales(lines, *dimensions):
+    return lines.values("day", *dimensions).annotate(
+        revenue=Sum(F("quantity") * F("price"), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        units=Sum("quantity"),
+        orders=Count("order", distinct=True),
+    ).order_by()
+
+
+def rebuild_days(first, last):
+    """Recompute the rollups of the days ``first`` through ``last`` from their order lines."""
+    lines = OrderItem.objects.filter(
+        order__status__in=SOLD_STATUSES,
+        order__created_at__gte=_start_of(first),
+        order__created_at__lt=_start_of(last + timedelta(days=1)),
+    ).annotate(day=TruncDate("order__created_at"))
+    with transaction.atomic():
+        for model in ROLLUPS:
+            model.objects.filter(day__gte=first, day__lte=last).delete()
+        DailySales.objects.bulk_create(DailySales(**row) for row in _sales(lines))
+        DailyCategorySales.objects.bulk_create(
+            DailyCategorySales(category_id=row.pop("product__category"), **row)
+            for row in _sales(lines, "product__category")
+        )
+        DailyProductSales.objects.bulk_create(
+            DailyProductSales(product_id=row.pop("product"), **row) for row in _sales(lines, "product")
+        )
+
+
+def _spans(days, span):
+    """Group sorted ``days`` into runs of consecutive days at most ``span`` long."""
+    ranges = []
+    for day in days:
+        if ranges and (day - ranges[-1][1]).days == 1 and (day - ranges[-1][0]).days < span:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return ranges
+
+
+def refresh_sales_rollups(full=False, overlap=None, span=31):
+    """Bring the rollups up to date; return how many days were recomputed.
+
+    Runs are serialized on the watermark row. With ``full`` every rollup
+    is dropped and rebuilt from the first order on.
+    """
+    overlap = settings.SALES_ROLLUP_OVERLAP if overlap is None else overlap
+    start = time.perf_counter()
+    now = timezone.now()
+    with transaction.atomic():
+        watermark, created = RefreshWatermark.objects.select_for_update().get_or_create(
+            name=WATERMARK, defaults={"value": now}
+        )
+        if full or created:
+            for model in ROLLUPS:
+                model.objects.all().delete()
+            bounds = Order.objects.aggregate(first=Min("created_at"), last=Max("created_at"))
+            days = []
+            if bounds["first"]:
+                first, last = timezone.localdate(bounds["first"]), timezone.localdate(bounds["last"])
+                days = [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+        else:
+            days = sorted(
+                Order.objects.filter(
+                    updated_at__gt=watermark.value - timedelta(seconds=overlap), updated_at__lte=now
+                )
+                .annotate(day=TruncDate("created_at"))
+                .values_list("day", flat=True)
+                .distinct()
+            )
+        for first, last in _spans(days, span):
+            rebuild_days(first, last)
+        watermark.value = now
+        watermark.save(update_fields=["value"])
+
+    metrics.increment("sales_rollup_days_total", len(days))
+    metrics.observe("sales_rollup_refresh_seconds", time.perf_counter() - start, buckets=(0.1, 1, 10, 60, 300, 900))
+    return len(days)
+
+
+def report(start, end, group_by="day", category=None, product=None, limit=50):
+    """Sales between the dates ``start`` and ``end`` (inclusive), from the rollups only.
+
+    ``group_by="day"`` gives a daily series, for the whole shop or for one
+    ``category`` or ``product``; "category" and "product" give the top
+    ``limit`` of each by revenue over the period.
+    """
+    period = {"day__gte": start, "day__lte": end}
+    if group_by == "day":
+        if product:
+            rows = DailyProductSales.objects.filter(product_id=product, **period)
+        elif category:
+            rows = DailyCategorySales.objects.filter(category_id=category, **period)
+        else:
+            rows = DailySales.objects.filter(**period)
+        results = list(rows.order_by("day").values("day", "revenue", "units", "orders"))
+        totals = {
+            key: sum((row[key] for row in results), 0) for key in ("revenue", "units", "orders")
+        }
+    else:
+        if group_by == "category":
+            rows = DailyCategorySales.objects.filter(**period).values("category_id", name=F("category__name"))
+        else:
+            rows = DailyProductSales.objects.filter(**period)
+            if category:
+                rows = rows.filter(product__category_id=category)
+            rows = rows.values("product_id", name=F("product__name"))
+        ranked = rows.annotate(revenue=Sum("revenue"), units=Sum("units"), orders=Sum("orders"))
+        results = [
+            {"id": row.pop(f"{group_by}_id"), **row}
+            for row in ranked.order_by("-revenue", f"{group_by}_id")[:limit]
+        ]
+        totals = DailySales.objects.filter(**period).aggregate(
+            revenue=Sum("revenue"), units=Sum("units"), orders=Sum("orders")
+        )
+    return {
+        "start": start,
+        "end": end,
+        "group_by": group_by,
+        "totals": {key: value or 0 for key, value in totals.items()},
+        "results": results,
+    }
@@ -0,0 +1,171 @@
+"""Async variants of the payment and cart endpoints, served under async/.
+
+Under an ASGI server (uvicorn) these views await the Chapa gateway through
+AsyncChapaClient instead of blocking a thread on it, so one worker process
+can hold thousands of verifies and initializations in flight. Reads and
+inserts use the async ORM; payment transitions and cart writes need a
+transaction and run through sync_to_async.
+
+They answer like their DRF counterparts in views.py but are plain Django
+views: JWT authentication is checked here, and bodies are JSON.
+"""
+import json
+import uuid
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import carts, fieldsets, webhooks
+from .authentication import CachedJWTAuthentication
+from .chapa import ChapaError, ainitialize_payment, customer_details, get_async_client
+from .models import Order, Payment
+from .services import fail_payment
+from .serializers import CartItemSerializer, CartSerializer, CartSummarySerializer, PaymentSerializer
+from .tasks import initialize_chapa_payment, process_webhook_events
+from .views import settle_verified, with_customer
+
+_jwt = CachedJWTAuthentication()
+
+
+def _authenticate(request):
+    try:
+        result = _jwt.authenticate(request)
+    except AuthenticationFailed as exc:
+        return None, exc.detail
+    if result is None:
+        return None, "Authentication credentials were not provided."
+    return result[0], None
+
+
+def jwt_required(view):
+    """Let only requests with a valid JWT through, with ``request.user`` set."""
+    @csrf_exempt
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # Looking the user up may take a cache round trip or a query
+        user, error = await sync_to_async(_authenticate)(request)
+        if user is None:
+            return respond({"detail": error}, status=401)
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def respond(data, status=200):
+    # DRF's encoder, so decimals and dates come out as from the DRF views
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+def _json_body(request):
+    try:
+        return json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+
+
+@require_POST
+@jwt_required
+async def initiate_payment(request):
+    order = await Order.objects.filter(user=request.user, status="PENDING").alast()
+    if not order:
+        return respond({"error": "No pending order found"}, status=400)
+
+    payment = await Payment.objects.acreate(
+        order=order,
+        tx_ref=str(uuid.uuid4()),
+        amount=order.total_price,
+        currency="ETB",
+        status="pending",
+    )
+
+    customer = customer_details(request.user)
+    if settings.CHAPA_ASYNC_INIT:
+        await sync_to_async(initialize_chapa_payment.delay)(payment.id, customer)
+        chapa_data, status = None, 202
+    else:
+        try:
+            chapa_data, status = await ainitialize_payment(payment, customer), 201
+        except ChapaError:
+            await sync_to_async(fail_payment)(payment)
+            chapa_data, status = {"status": "failed", "message": "Payment gateway unavailable"}, 502
+
+    return respond({"chapa_response": chapa_data, "payment": PaymentSerializer(payment).data}, status=status)
+
+
+@require_GET
+@jwt_required
+async def verify_payment(request, tx_ref):
+    try:
+        payment = await Payment.objects.aget(tx_ref=tx_ref)
+    except Payment.DoesNotExist:
+        return respond({"error": "Payment not found"}, status=404)
+
+    try:
+        data = await get_async_client().verify(tx_ref)
+    except ChapaError:
+        return respond({"error": "Payment gateway unavailable"}, status=502)
+
+    await sync_to_async(settle_verified)(tx_ref, data)
+    await payment.arefresh_from_db()
+
+    return respond({
+        "chapa_response": with_customer(data, request.user),
+        "payment": PaymentSerializer(payment).data,
+    })
+
+
+@require_POST
+@csrf_exempt
+async def chapa_webhook(request):
+    if not webhooks.signature_is_valid(request.body, request.headers):
+        return respond({"error": "Invalid signature"}, status=401)
+    data = _json_body(request)
+    if not isinstance(data, dict) or not data.get("tx_ref"):
+        return respond({"error": "Missing tx_ref"}, status=400)
+
+    await webhooks.arecord_event(data)
+    if await cache.aadd("webhooks:drain-scheduled", 1, timeout=1):
+        await sync_to_async(process_webhook_events.apply_async)(countdown=1)
+
+    return respond({"message": "Webhook received"})
+
+
+@require_GET
+@jwt_required
+async def view_cart(request):
+    try:
+        names = fieldsets.CART_LINES.requested(request.GET)
+    except ValidationError as exc:
+        return respond(exc.detail, status=400)
+    cart = await carts.get_backend().aget_cart(request.user)
+    if names is not None:
+        return respond(fieldsets.flat_cart(cart, names))
+    return respond(CartSerializer(cart).data)
+
+
+@require_GET
+@jwt_required
+async def cart_summary(request):
+    summary = await carts.get_backend().asummary(request.user)
+    return respond(CartSummarySerializer(summary).data)
+
+
+@require_POST
+@jwt_required
+async def add_to_cart(request):
+    serializer = CartItemSerializer(data=_json_body(request))
+    # Validating product_id looks the product up
+    if not await sync_to_async(serializer.is_valid)():
+        return respond(serializer.errors, status=400)
+
+    item = await carts.get_backend().aadd(
+        request.user, serializer.validated_data["product"], serializer.validated_data.get("quantity", 1)
+    )
+    return respond(CartItemSerializer(item).data, status=201)
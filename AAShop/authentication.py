@@ -0,0 +1,138 @@
+"""JWT authentication that resolves the user without a query per request.
+
+simplejwt checks the token signature locally but then loads the user row on
+every call. CachedJWTAuthentication looks the user up in a small
+per-process LRU first (entries live AUTH_USER_LOCAL_TTL seconds), then in
+the shared cache (Redis when CACHE_URL is set), and only then in the
+database.
+
+Saving or deleting a user drops both cached copies in this process and the
+shared one (see signals.py); other processes keep theirs until it expires,
+so AUTH_USER_LOCAL_TTL bounds how long a deactivation or password change
+takes to reach them. Queryset updates skip the signals and must call
+``forget()`` themselves.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from . import metrics
+
+
+class LocalCache:
+    """A thread-safe LRU whose entries expire ``ttl`` seconds after being set."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_users = LocalCache(settings.AUTH_USER_LOCAL_SIZE, settings.AUTH_USER_LOCAL_TTL)
+
+
+def _key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def get_user(user_id):
+    """The user whose USER_ID_FIELD is ``user_id``, or None if there is none."""
+    key = _key(user_id)
+    user = local_users.get(key)
+    if user is not None:
+        metrics.increment("auth_user_cache_hits_total", tier="local")
+    else:
+        user = cache.get(key)
+        if user is not None:
+            metrics.increment("auth_user_cache_hits_total", tier="shared")
+        else:
+            metrics.increment("auth_user_cache_misses_total")
+            user_model = get_user_model()
+            try:
+                user = user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except user_model.DoesNotExist:
+                return None
+            cache.set(key, user, settings.AUTH_USER_CACHE_TTL)
+        local_users.set(key, user)
+    # Requests get their own copy, so one changing request.user does not
+    # change it for the others.
+    return copy.copy(user)
+
+
+def _drop(user_id):
+    key = _key(user_id)
+    local_users.delete(key)
+    cache.delete(key)
+
+
+def forget(user_id):
+    """Drop the cached copies of a user, now and when the transaction commits.
+
+    Dropping again on commit stops a request that read the old row before
+    the commit from caching it past it.
+    """
+    _drop(user_id)
+    transaction.on_commit(lambda: _drop(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication with the user read through ``get_user()``."""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        user = get_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
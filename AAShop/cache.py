@@ -0,0 +1,149 @@
+"""Versioned response caching for the catalog endpoints.
+
+Every cached response is keyed by the current version of each namespace it
+depends on ("product", "category"). Invalidating a namespace is a single
+INCR of its version key; entries under the old version are never read
+again and simply expire.
+
+Stock changes with every checkout, so it is not part of a cached response.
+Product responses are served with each product's current stock on top,
+read from a per-product key that reservations and releases drop
+(``forget_stock()``). Membership of the ``in_stock`` list filter can lag
+behind until the product namespace next changes.
+
+Cache misses read from the primary even when there are read replicas: a
+lagging replica's old rows would otherwise be cached under the new version
+for CATALOG_CACHE_TIMEOUT. Uncached catalog reads, such as search, still
+go to a replica.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from . import metrics, routers
+from .models import Product
+
+
+def _version_key(namespace):
+    return f"catalog:{namespace}:version"
+
+
+def _fresh_version():
+    # Not 1: if a version key is evicted, restarting from a counter could
+    # land on a number whose (stale) entries are still cached.
+    return time.time_ns()
+
+
+def get_versions(namespaces):
+    keys = [_version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _fresh_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _stock_key(product_id):
+    return f"catalog:stock:{product_id}"
+
+
+def forget_stock(product_ids):
+    """Drop the cached stock of ``product_ids``, now and when the transaction commits."""
+    keys = [_stock_key(product_id) for product_id in product_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def current_stock(product_ids):
+    """``{product_id: stock}``, from the cache or else the primary."""
+    keys = {product_id: _stock_key(product_id) for product_id in product_ids}
+    cached = cache.get_many(keys.values())
+    stock = {product_id: cached[key] for product_id, key in keys.items() if key in cached}
+    missing = [product_id for product_id in product_ids if product_id not in stock]
+    if missing:
+        with routers.primary():
+            fresh = dict(Product.objects.filter(pk__in=missing).values_list("pk", "stock"))
+        cache.set_many({keys[product_id]: value for product_id, value in fresh.items()}, settings.CATALOG_CACHE_TIMEOUT)
+        stock.update(fresh)
+    return stock
+
+
+def _rows(data):
+    # The products in a list page, a search page or a detail response
+    if isinstance(data, dict) and isinstance(data.get("results"), list):
+        return data["results"]
+    return data if isinstance(data, list) else [data]
+
+
+def _bump(namespace):
+    key = _version_key(namespace)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _fresh_version(), timeout=None)
+
+
+def invalidate(namespace):
+    """Drop every cached response that depends on ``namespace``.
+
+    The version is bumped immediately and again once the surrounding
+    transaction commits, so a response cached by a concurrent reader from
+    pre-commit data cannot outlive the commit.
+    """
+    _bump(namespace)
+    transaction.on_commit(lambda: _bump(namespace))
+
+
+class CachedCatalogMixin:
+    """Serve list/retrieve for a ModelViewSet from the cache.
+
+    ``cache_namespaces`` lists every namespace the serialized data depends
+    on, including nested objects. With ``live_stock`` the rows' "stock" is
+    replaced by the current stock whenever a response is served.
+    """
+
+    cache_namespaces = ()
+    live_stock = False
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        versions = get_versions(self.cache_namespaces)
+        url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        key = f"catalog:{self.basename}:{':'.join(map(str, versions))}:{url}"
+
+        data = cache.get(key)
+        if data is not None:
+            metrics.increment("catalog_cache_hits_total", view=self.basename)
+            if self.live_stock:
+                rows = [row for row in _rows(data) if "stock" in row]
+                stock = current_stock([row["id"] for row in rows])
+                for row in rows:
+                    row["stock"] = stock.get(row["id"], row["stock"])
+            return Response(data)
+
+        metrics.increment("catalog_cache_misses_total", view=self.basename)
+        with routers.primary():
+            response = handler(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        if self.live_stock:
+            rows = [row for row in _rows(response.data) if "stock" in row]
+            if any("id" not in row for row in rows):
+                # Stock that cannot be told apart by product is not cached
+                return response
+            # Just read from the primary, so as current as a re-read
+            cache.set_many(
+                {_stock_key(row["id"]): row["stock"] for row in rows}, settings.CATALOG_CACHE_TIMEOUT
+            )
+        cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+        return response
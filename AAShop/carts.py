@@ -0,0 +1,484 @@
+"""Cart storage backends, chosen with the CART_BACKEND setting.
+
+"db" keeps carts in the Cart/CartItem tables. "redis" keeps each cart in a
+Redis hash (product id -> quantity) so a click is one or two Redis round
+trips, and writes carts back to the tables behind the scenes: every few
+seconds for carts that changed (flush_dirty_carts), and right before an
+order is placed from one.
+
+Both return Cart and CartItem instances with the lines already attached,
+so CartSerializer and CartItemSerializer render either without queries of
+their own. Line ids are opaque: CartItem ids with "db", product ids with
+"redis"; clients only pass back the id they were given.
+
+Cart.item_count and Cart.total follow the lines: every change to a line
+moves them by the difference it made, a product's price change or deletion
+is fanned out to the carts holding it, and a cart written back from Redis
+is recomputed. Changes that bypass all this (queryset updates of prices,
+edits in the shell) are caught by the check_cart_totals command.
+
+The async views call the ``a``-prefixed methods. They hand the sync ones
+to a thread unless a backend has a native async path, as the "db" reads
+do through the async ORM; writes stay sync for their transactions.
+"""
+import time
+from decimal import Decimal
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+from django.utils.dateparse import parse_datetime
+
+from .models import Cart, CartItem, Product
+
+
+def _resolve_quantities(current, operations):
+    """Play bulk ``operations`` over ``{product_id: quantity}``.
+
+    Returns the lines that change, with 0 for lines to delete.
+    """
+    quantities = dict(current)
+    for operation in operations:
+        product_id, quantity = operation["product_id"], operation["quantity"]
+        if operation["action"] == "add":
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        elif operation["action"] == "set":
+            quantities[product_id] = quantity
+        else:
+            quantities[product_id] = 0
+    return {
+        product_id: quantity
+        for product_id, quantity in quantities.items()
+        if current.get(product_id, 0) != quantity
+    }
+
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def adjust_totals(cart_id, count, amount):
+    """Move a cart's item_count and total by what a change to its lines added."""
+    if count or amount:
+        Cart.objects.filter(pk=cart_id).update(item_count=F("item_count") + count, total=F("total") + amount)
+
+
+def _line_sums():
+    lines = CartItem.objects.filter(cart=OuterRef("pk")).order_by().values("cart")
+    count = lines.annotate(count=Sum("quantity")).values("count")
+    total = lines.annotate(total=Sum(F("quantity") * F("product__price"), output_field=MONEY)).values("total")
+    return Coalesce(Subquery(count), 0), Coalesce(Subquery(total), Value(Decimal("0")), output_field=MONEY)
+
+
+def recalculate_totals(carts):
+    """Recompute item_count and total of the ``carts`` queryset from its lines, in one UPDATE."""
+    count, total = _line_sums()
+    return carts.update(item_count=count, total=total)
+
+
+def drifted_carts():
+    """Carts whose stored item_count or total differs from their lines.
+
+    Annotated with ``actual_count`` and ``actual_total``. Totals are
+    compared rounded to cents, as SQLite sums prices in floating point.
+    """
+    count, total = _line_sums()
+    return (
+        Cart.objects.annotate(actual_count=count, actual_total=total)
+        .alias(stored_cents=Round("total", 2), actual_cents=Round("actual_total", 2))
+        .filter(~Q(item_count=F("actual_count")) | ~Q(stored_cents=F("actual_cents")))
+        .order_by("pk")
+    )
+
+
+def _fan_out(product_id, count_per_unit, amount_per_unit):
+    quantity = Subquery(
+        CartItem.objects.filter(cart=OuterRef("pk"), product_id=product_id).values("quantity")[:1]
+    )
+    changes = {"total": F("total") + ExpressionWrapper(quantity * Value(amount_per_unit), output_field=MONEY)}
+    if count_per_unit:
+        changes["item_count"] = F("item_count") + quantity * count_per_unit
+    return Cart.objects.filter(items__product_id=product_id).update(**changes)
+
+
+def reprice(product_id, old_price, new_price):
+    """Carry a product's price change into the total of every cart holding it."""
+    return _fan_out(product_id, 0, new_price - old_price)
+
+
+def drop_product(product_id, price):
+    """Take a product about to be deleted out of the totals of the carts holding it."""
+    return _fan_out(product_id, -1, -price)
+
+
+def _attach_items(cart, items):
+    # What prefetch_related("items") would leave behind, so cart.items.all()
+    # is served from memory.
+    cart._prefetched_objects_cache = {"items": items}
+    return cart
+
+
+class CartBackend:
+    async def aget_cart(self, user):
+        return await sync_to_async(self.get_cart)(user)
+
+    async def asummary(self, user):
+        return await sync_to_async(self.summary)(user)
+
+    async def aadd(self, user, product, quantity):
+        return await sync_to_async(self.add)(user, product, quantity)
+
+
+class DatabaseCartBackend(CartBackend):
+    def get_cart(self, user):
+        # The cart comes along with its lines in one joined query; only an
+        # empty cart needs a query of its own.
+        items = list(
+            CartItem.objects.filter(cart__user=user).select_related("cart", "product").order_by("pk")
+        )
+        if items:
+            cart = items[0].cart
+        else:
+            cart, _ = Cart.objects.get_or_create(user=user)
+        for item in items:
+            item.cart = cart
+        return _attach_items(cart, items)
+
+    def summary(self, user):
+        """Return the cart's item_count and total, read from the cart row alone."""
+        row = Cart.objects.filter(user=user).values("item_count", "total").first()
+        return row or {"item_count": 0, "total": Decimal("0")}
+
+    async def aget_cart(self, user):
+        items = [
+            item async for item in
+            CartItem.objects.filter(cart__user=user).select_related("cart", "product").order_by("pk")
+        ]
+        if items:
+            cart = items[0].cart
+        else:
+            cart, _ = await Cart.objects.aget_or_create(user=user)
+        for item in items:
+            item.cart = cart
+        return _attach_items(cart, items)
+
+    async def asummary(self, user):
+        row = await Cart.objects.filter(user=user).values("item_count", "total").afirst()
+        return row or {"item_count": 0, "total": Decimal("0")}
+
+    def get_item(self, user, item_id):
+        return CartItem.objects.select_related("product").filter(pk=item_id, cart__user=user).first()
+
+    def add(self, user, product, quantity):
+        cart, _ = Cart.objects.get_or_create(user=user)
+        with transaction.atomic():
+            item, created = CartItem.objects.get_or_create(
+                cart=cart, product=product, defaults={"quantity": quantity}
+            )
+            if not created:
+                # Increment in SQL so concurrent adds are not lost
+                CartItem.objects.filter(pk=item.pk).update(quantity=F("quantity") + quantity)
+                item.quantity += quantity
+            adjust_totals(cart.pk, quantity, quantity * product.price)
+        return item
+
+    def update(self, user, item, changes):
+        with transaction.atomic():
+            # The totals move by what the line held when locked, not by what
+            # ``item`` held when read: a concurrent update may have come between.
+            item = (
+                CartItem.objects.select_for_update(of=("self",))
+                .select_related("product")
+                .filter(pk=item.pk)
+                .first()
+            )
+            if item is None:
+                return None
+            count, amount = item.quantity, item.subtotal
+            for field, value in changes.items():
+                setattr(item, field, value)
+            item.save()
+            adjust_totals(item.cart_id, item.quantity - count, item.subtotal - amount)
+        return item
+
+    def remove(self, user, item_id):
+        with transaction.atomic():
+            item = (
+                CartItem.objects.select_for_update(of=("self",))
+                .select_related("product")
+                .filter(pk=item_id, cart__user=user)
+                .first()
+            )
+            if item is None:
+                return False
+            item.delete()
+            adjust_totals(item.cart_id, -item.quantity, -item.subtotal)
+        return True
+
+    def apply(self, user, operations):
+        """Apply a batch of add/set/remove operations with one upsert and one delete."""
+        cart, _ = Cart.objects.get_or_create(user=user)
+        product_ids = {operation["product_id"] for operation in operations}
+        with transaction.atomic():
+            current = dict(
+                CartItem.objects.select_for_update()
+                .filter(cart=cart, product_id__in=product_ids)
+                .values_list("product_id", "quantity")
+            )
+            changes = _resolve_quantities(current, operations)
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(cart=cart, product_id=product_id, quantity=quantity)
+                    for product_id, quantity in changes.items()
+                    if quantity
+                ],
+                update_conflicts=True,
+                unique_fields=["cart", "product"],
+                update_fields=["quantity"],
+            )
+            removed = [product_id for product_id, quantity in changes.items() if not quantity]
+            if removed:
+                CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+            if changes:
+                prices = dict(Product.objects.filter(pk__in=changes).values_list("pk", "price"))
+                added = {product_id: quantity - current.get(product_id, 0) for product_id, quantity in changes.items()}
+                adjust_totals(
+                    cart.pk,
+                    sum(added.values()),
+                    sum(quantity * prices[product_id] for product_id, quantity in added.items()),
+                )
+        return self.get_cart(user)
+
+    def flush(self, user):
+        """Make the tables hold the user's current cart (nothing to do here)."""
+
+    def discard(self, user):
+        """Forget any copy of the cart kept outside the tables (none here)."""
+
+
+class RedisCartBackend(CartBackend):
+    key_prefix = "cart:"
+    dirty_key = "carts:dirty"
+    # Carts being written back, and since when; a claim older than
+    # claim_timeout was left by a worker that died and is retried.
+    claimed_key = "carts:flushing"
+    claimed_since_key = "carts:flushing:since"
+    claim_timeout = 600
+    # Hash fields that are not product ids
+    meta_fields = ("_id", "_created")
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = redis.Redis.from_url(settings.CART_REDIS_URL, decode_responses=True)
+        return self._client
+
+    def key(self, user_id):
+        return f"{self.key_prefix}{user_id}"
+
+    def load(self, user):
+        """Return the cart hash, copying the cart in from the tables on first use."""
+        key = self.key(user.pk)
+        data = self.client.hgetall(key)
+        if data:
+            return data
+        cart, _ = Cart.objects.get_or_create(user=user)
+        data = {"_id": str(cart.pk), "_created": cart.created_at.isoformat()}
+        data.update(
+            (str(product_id), str(quantity))
+            for product_id, quantity in cart.items.values_list("product_id", "quantity")
+        )
+        # HSETNX: a line added by a concurrent request meanwhile wins
+        with self.client.pipeline() as pipe:
+            for field, value in data.items():
+                pipe.hsetnx(key, field, value)
+            pipe.expire(key, settings.CART_REDIS_TTL)
+            pipe.hgetall(key)
+            return pipe.execute()[-1]
+
+    def changed(self, pipe, user_id):
+        pipe.expire(self.key(user_id), settings.CART_REDIS_TTL)
+        pipe.sadd(self.dirty_key, user_id)
+
+    def cart_from(self, user, data):
+        return Cart(id=int(data["_id"]), user=user, created_at=parse_datetime(data["_created"]))
+
+    def line(self, data, product, quantity):
+        return CartItem(id=product.pk, cart_id=int(data["_id"]), product=product, quantity=quantity)
+
+    def get_cart(self, user):
+        data = self.load(user)
+        cart = self.cart_from(user, data)
+        quantities = {int(field): int(value) for field, value in data.items() if field not in self.meta_fields}
+        products = Product.objects.in_bulk(quantities)
+        items = [
+            self.line(data, products[product_id], quantity)
+            for product_id, quantity in sorted(quantities.items())
+            if product_id in products
+        ]
+        cart.item_count = sum(item.quantity for item in items)
+        cart.total = sum((item.subtotal for item in items), Decimal("0"))
+        return _attach_items(cart, items)
+
+    def summary(self, user):
+        cart = self.get_cart(user)
+        return {"item_count": cart.item_count, "total": cart.total}
+
+    def get_item(self, user, item_id):
+        data = self.load(user)
+        quantity = data.get(str(item_id))
+        if quantity is None:
+            return None
+        product = Product.objects.filter(pk=item_id).first()
+        if product is None:
+            return None
+        return self.line(data, product, int(quantity))
+
+    def add(self, user, product, quantity):
+        data = self.load(user)
+        with self.client.pipeline() as pipe:
+            pipe.hincrby(self.key(user.pk), product.pk, quantity)
+            self.changed(pipe, user.pk)
+            total = pipe.execute()[0]
+        return self.line(data, product, total)
+
+    def update(self, user, item, changes):
+        key = self.key(user.pk)
+        with self.client.pipeline() as pipe:
+            if "product" in changes and changes["product"].pk != item.product.pk:
+                pipe.hdel(key, item.product.pk)
+                item.product = changes["product"]
+                item.id = item.product.pk
+            if "quantity" in changes:
+                item.quantity = changes["quantity"]
+            pipe.hset(key, item.product.pk, item.quantity)
+            self.changed(pipe, user.pk)
+            pipe.execute()
+        return item
+
+    def remove(self, user, item_id):
+        self.load(user)
+        with self.client.pipeline() as pipe:
+            pipe.hdel(self.key(user.pk), item_id)
+            self.changed(pipe, user.pk)
+            return bool(pipe.execute()[0])
+
+    def apply(self, user, operations):
+        # Played in order inside MULTI, so adds stay increments even when
+        # another request changes the cart at the same time.
+        self.load(user)
+        key = self.key(user.pk)
+        with self.client.pipeline() as pipe:
+            for operation in operations:
+                product_id, quantity = operation["product_id"], operation["quantity"]
+                if operation["action"] == "add":
+                    if quantity:
+                        pipe.hincrby(key, product_id, quantity)
+                elif operation["action"] == "set" and quantity:
+                    pipe.hset(key, product_id, quantity)
+                else:
+                    pipe.hdel(key, product_id)
+            self.changed(pipe, user.pk)
+            pipe.execute()
+        return self.get_cart(user)
+
+    def flush(self, user):
+        """Write the user's cart hash to Cart/CartItem."""
+        self.client.srem(self.dirty_key, user.pk)
+        self._write(user.pk, self.client.hgetall(self.key(user.pk)))
+
+    def flush_dirty(self, limit=1000):
+        """Write back up to ``limit`` changed carts; return how many were claimed.
+
+        Carts move from the dirty set to the claimed one and leave it only
+        once written, so a failed write or a dead worker loses no marks. A
+        change made during the write marks the cart dirty again.
+        """
+        self._requeue_stale_claims()
+        candidates = self.client.srandmember(self.dirty_key, limit) or []
+        with self.client.pipeline() as pipe:
+            for user_id in candidates:
+                pipe.smove(self.dirty_key, self.claimed_key, user_id)
+                pipe.hset(self.claimed_since_key, user_id, time.time())
+            moved = pipe.execute()[::2]
+        # Another worker may have claimed some of them first
+        user_ids = [user_id for user_id, claimed in zip(candidates, moved) if claimed]
+
+        with self.client.pipeline() as pipe:
+            for user_id in user_ids:
+                pipe.hgetall(self.key(user_id))
+            carts = pipe.execute()
+        written = []
+        try:
+            for user_id, data in zip(user_ids, carts):
+                self._write(int(user_id), data)
+                written.append(user_id)
+        finally:
+            with self.client.pipeline() as pipe:
+                for user_id in user_ids:
+                    if user_id in written:
+                        pipe.srem(self.claimed_key, user_id)
+                    else:
+                        pipe.smove(self.claimed_key, self.dirty_key, user_id)
+                    pipe.hdel(self.claimed_since_key, user_id)
+                pipe.execute()
+        return len(user_ids)
+
+    def _requeue_stale_claims(self):
+        cutoff = time.time() - self.claim_timeout
+        stale = [
+            user_id for user_id, since in self.client.hgetall(self.claimed_since_key).items()
+            if float(since) < cutoff
+        ]
+        if stale:
+            with self.client.pipeline() as pipe:
+                for user_id in stale:
+                    pipe.smove(self.claimed_key, self.dirty_key, user_id)
+                    pipe.hdel(self.claimed_since_key, user_id)
+                pipe.execute()
+
+    def _write(self, user_id, data):
+        # An expired hash has nothing newer than what was last written.
+        if not data:
+            return
+        quantities = {
+            int(field): int(value) for field, value in data.items() if field not in self.meta_fields and int(value) > 0
+        }
+        with transaction.atomic():
+            cart_id = Cart.objects.get_or_create(user_id=user_id)[0].pk
+            CartItem.objects.filter(cart_id=cart_id).exclude(product_id__in=quantities).delete()
+            if quantities:
+                existing = set(Product.objects.filter(pk__in=quantities).values_list("pk", flat=True))
+                CartItem.objects.bulk_create(
+                    [
+                        CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                        for product_id, quantity in quantities.items()
+                        if product_id in existing
+                    ],
+                    update_conflicts=True,
+                    unique_fields=["cart", "product"],
+                    update_fields=["quantity"],
+                )
+            recalculate_totals(Cart.objects.filter(pk=cart_id))
+
+    def discard(self, user):
+        with self.client.pipeline() as pipe:
+            pipe.delete(self.key(user.pk))
+            pipe.srem(self.dirty_key, user.pk)
+            pipe.execute()
+
+
+_backends = {}
+BACKENDS = {"db": DatabaseCartBackend, "redis": RedisCartBackend}
+
+
+def get_backend(name=None):
+    name = name or settings.CART_BACKEND
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
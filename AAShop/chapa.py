@@ -0,0 +1,175 @@
+import asyncio
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .instrumentation import timed
+
+
+class ChapaError(Exception):
+    pass
+
+
+class ChapaClient:
+    """Thin client for the Chapa API over a pooled, retrying session.
+
+    Every call has explicit connect/read timeouts so a hung gateway cannot
+    pin a worker. Connection errors and 429/5xx answers are retried with
+    exponential backoff; retrying an initialize is safe because Chapa
+    rejects a tx_ref it has already seen.
+    """
+
+    def __init__(self, max_retries=None, backoff_factor=None, pool_size=None):
+        retry = Retry(
+            total=settings.CHAPA_MAX_RETRIES if max_retries is None else max_retries,
+            backoff_factor=settings.CHAPA_BACKOFF_FACTOR if backoff_factor is None else backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "POST"}),
+            raise_on_status=False,
+        )
+        pool_size = pool_size or settings.CHAPA_POOL_SIZE
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, path, **kwargs):
+        headers = {"Authorization": f"Bearer {settings.CHAPA_SECRET_KEY}"}
+        try:
+            with timed("chapa"):
+                response = self.session.request(
+                    method,
+                    f"{settings.CHAPA_BASE_URL}{path}",
+                    headers=headers,
+                    timeout=(settings.CHAPA_CONNECT_TIMEOUT, settings.CHAPA_READ_TIMEOUT),
+                    **kwargs,
+                )
+            return response.json()
+        except (requests.RequestException, ValueError) as exc:
+            raise ChapaError(f"Chapa {method} {path} failed: {exc}") from exc
+
+    def initialize(self, payload):
+        return self.request("POST", "/transaction/initialize", json=payload)
+
+    def verify(self, tx_ref):
+        return self.request("GET", f"/transaction/verify/{tx_ref}")
+
+
+class AsyncChapaClient:
+    """ChapaClient for async views: the same calls, timeouts and retries on httpx.
+
+    An in-flight call holds no thread, only a connection from a pool of
+    CHAPA_ASYNC_POOL_SIZE, so one process can wait on thousands of them.
+    """
+
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, max_retries=None, backoff_factor=None, pool_size=None):
+        self.max_retries = settings.CHAPA_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_factor = settings.CHAPA_BACKOFF_FACTOR if backoff_factor is None else backoff_factor
+        pool_size = pool_size or settings.CHAPA_ASYNC_POOL_SIZE
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.CHAPA_READ_TIMEOUT, connect=settings.CHAPA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def request(self, method, path, **kwargs):
+        headers = {"Authorization": f"Bearer {settings.CHAPA_SECRET_KEY}"}
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            try:
+                with timed("chapa"):
+                    response = await self.http.request(
+                        method, f"{settings.CHAPA_BASE_URL}{path}", headers=headers, **kwargs
+                    )
+                if response.status_code not in self.RETRY_STATUSES or last:
+                    return response.json()
+            except httpx.TransportError as exc:
+                if last:
+                    raise ChapaError(f"Chapa {method} {path} failed: {exc}") from exc
+            except ValueError as exc:
+                raise ChapaError(f"Chapa {method} {path} failed: {exc}") from exc
+            await asyncio.sleep(self.backoff_factor * 2 ** attempt)
+
+    async def initialize(self, payload):
+        return await self.request("POST", "/transaction/initialize", json=payload)
+
+    async def verify(self, tx_ref):
+        return await self.request("GET", f"/transaction/verify/{tx_ref}")
+
+
+_client = None
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    # One client per process so every request reuses the same connection pool.
+    global _client
+    if _client is None:
+        _client = ChapaClient()
+    return _client
+
+
+def get_async_client():
+    # httpx connections belong to the event loop that opened them, so each
+    # loop (one per uvicorn worker) gets its own client.
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = AsyncChapaClient()
+    return _async_clients[loop]
+
+
+def customer_details(user):
+    return {
+        "email": user.email,
+        "first_name": user.first_name or user.username,
+        "last_name": user.last_name or "Customer",
+    }
+
+
+def _initialize_payload(payment, customer):
+    return {
+        "amount": str(payment.amount),
+        "currency": payment.currency,
+        "tx_ref": payment.tx_ref,
+        "callback_url": settings.CHAPA_CALLBACK_URL,
+        "return_url": settings.CHAPA_RETURN_URL,
+        **customer,
+    }
+
+
+def _checkout_url(data):
+    # Anything but a successful answer with a checkout URL leaves the
+    # customer nowhere to pay.
+    checkout_url = None
+    if isinstance(data, dict) and data.get("status") == "success":
+        checkout_url = (data.get("data") or {}).get("checkout_url")
+    if not checkout_url:
+        message = data.get("message") if isinstance(data, dict) else data
+        raise ChapaError(f"Chapa did not initialize the payment: {message}")
+    return checkout_url
+
+
+def initialize_payment(payment, customer):
+    """Open a Chapa checkout for ``payment`` and remember its checkout URL.
+
+    Raises ChapaError when Chapa cannot be reached or does not open one.
+    """
+    data = get_client().initialize(_initialize_payload(payment, customer))
+
+    payment.checkout_url = _checkout_url(data)
+    payment.save(update_fields=["checkout_url", "updated_at"])
+    return data
+
+
+async def ainitialize_payment(payment, customer):
+    """initialize_payment() for async views."""
+    data = await get_async_client().initialize(_initialize_payload(payment, customer))
+
+    payment.checkout_url = _checkout_url(data)
+    await payment.asave(update_fields=["checkout_url", "updated_at"])
+    return data
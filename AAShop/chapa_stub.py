@@ -0,0 +1,111 @@
+"""A local stand-in for the Chapa API, for tests and offline benchmarks."""
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeChapaHandler(BaseHTTPRequestHandler):
+    # Keep-alive like the real API, and no Nagle delay between the header
+    # and body writes (it adds ~40 ms per call on Linux).
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    verify_path = re.compile(r"^/transaction/verify/(?P<tx_ref>[^/]+)/?$")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.rstrip("/") != "/transaction/initialize":
+            return self.reply(404, {"status": "failed", "message": "Not found"})
+
+        self.server.delay()
+        if self.server.decline_initialize:
+            return self.reply(400, {"status": "failed", "message": "Invalid currency", "data": None})
+        tx_ref = payload.get("tx_ref")
+        self.server.initialized[tx_ref] = payload
+        self.reply(200, {
+            "status": "success",
+            "message": "Hosted Link",
+            "data": {"checkout_url": f"{self.server.url}/pay/{tx_ref}"},
+        })
+
+    def do_GET(self):
+        match = self.verify_path.match(self.path)
+        if not match:
+            return self.reply(404, {"status": "failed", "message": "Not found"})
+
+        self.server.delay()
+        tx_ref = match.group("tx_ref")
+        self.reply(200, {
+            "status": "success",
+            "message": "Payment details",
+            "data": {
+                "tx_ref": tx_ref,
+                "status": self.server.outcomes.get(tx_ref, self.server.default_outcome),
+                "reference": f"CH-{uuid.uuid5(uuid.NAMESPACE_URL, tx_ref).hex[:12]}",
+            },
+        })
+
+    def reply(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeChapaServer(ThreadingHTTPServer):
+    """Serves /transaction/initialize and /transaction/verify/<tx_ref>.
+
+    ``latency`` (seconds) is slept before every answer to simulate a slow
+    gateway; ``outcomes`` maps tx_ref to the status verify reports, falling
+    back to ``default_outcome``. With ``decline_initialize`` set, initialize
+    answers like Chapa rejecting the request.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, default_outcome="success"):
+        super().__init__((host, port), FakeChapaHandler)
+        self.latency = latency
+        self.default_outcome = default_outcome
+        self.outcomes = {}
+        self.initialized = {}
+        self.decline_initialize = False
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up mid-answer; that is expected here.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
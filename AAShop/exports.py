@@ -0,0 +1,166 @@
+"""Streaming order exports for finance.
+
+Order lines are read through a server-side cursor (``.iterator()``) as
+plain values_list() rows, already joined with their order, customer,
+product and category, and written out as they arrive, so memory stays
+flat however many orders are exported. CSV has one row per order line;
+NDJSON has one object per order with its lines nested, grouped on the fly
+since lines come in order id order.
+
+Exports read from a read replica when one is configured (see routers.py).
+
+Server-side cursors only exist on PostgreSQL and are off behind pgbouncer
+in transaction mode (DB_PGBOUNCER sets DISABLE_SERVER_SIDE_CURSORS); the
+driver then holds the whole result in memory, so run large exports
+against a direct connection.
+"""
+import csv
+import io
+import time
+from datetime import datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import metrics, routers
+from .models import Order, OrderItem
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# Exported column -> values_list() lookup, in CSV column order
+COLUMNS = {
+    "order_id": "order_id",
+    "created_at": "order__created_at",
+    "status": "order__status",
+    "customer_email": "order__user__email",
+    "order_total": "order__total_price",
+    "line_id": "pk",
+    "product_id": "product_id",
+    "product_name": "product__name",
+    "category": "product__category__name",
+    "quantity": "quantity",
+    "unit_price": "price",
+}
+ORDER_COLUMNS = ("order_id", "created_at", "status", "customer_email", "order_total")
+LINE_COLUMNS = ("line_id", "product_id", "product_name", "category", "quantity", "unit_price")
+STATUSES = {value for value, _ in Order.STATUS_CHOICES}
+
+
+class ExportFilterError(ValueError):
+    pass
+
+
+def _bound(value, name, end=False):
+    try:
+        # Dates first: parse_datetime() also accepts a bare date
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:  # well formed but out of range, e.g. 2026-02-30
+        day = moment = None
+    if day:
+        # An end date covers the whole day
+        moment = datetime.combine(day + timedelta(days=1) if end else day, datetime.min.time())
+    elif moment is None:
+        raise ExportFilterError(f"{name} must be an ISO date or datetime")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_filters(start=None, end=None, status=None):
+    """Turn the raw start/end/status filters into keyword arguments for ``export``.
+
+    ``start`` and ``end`` are ISO dates or datetimes (an end date is
+    inclusive); ``status`` is a comma-separated list of order statuses.
+    """
+    filters = {}
+    if start:
+        filters["start"] = _bound(start, "start")
+    if end:
+        filters["end"] = _bound(end, "end", end=True)
+    if status:
+        statuses = [value.strip().upper() for value in status.split(",") if value.strip()]
+        unknown = sorted(set(statuses) - STATUSES)
+        if unknown:
+            raise ExportFilterError(f"Unknown statuses: {', '.join(unknown)}")
+        filters["statuses"] = statuses
+    return filters
+
+
+def order_lines(start=None, end=None, statuses=None):
+    """values_list() rows of COLUMNS for the matching orders' lines, in order id order."""
+    lines = OrderItem.objects.using(routers.read_alias())
+    if start:
+        lines = lines.filter(order__created_at__gte=start)
+    if end:
+        lines = lines.filter(order__created_at__lt=end)
+    if statuses:
+        lines = lines.filter(order__status__in=statuses)
+    return lines.order_by("order_id", "pk").values_list(*COLUMNS.values())
+
+
+def _csv_chunks(rows, rows_per_chunk):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([*COLUMNS, "line_total"])
+    for count, row in enumerate(rows, 1):
+        order_id, created_at, *rest = row
+        writer.writerow((order_id, created_at.isoformat(), *rest, row[-2] * row[-1]))
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(rows, rows_per_chunk):
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    chunk = []
+    for _, lines in groupby(rows, key=itemgetter(0)):
+        lines = list(lines)
+        order = dict(zip(ORDER_COLUMNS, lines[0]))
+        order["items"] = [
+            {**dict(zip(LINE_COLUMNS, line[len(ORDER_COLUMNS):])), "line_total": line[-2] * line[-1]}
+            for line in lines
+        ]
+        chunk.append(encoder.encode(order))
+        if len(chunk) >= rows_per_chunk:
+            yield "\n".join(chunk) + "\n"
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+
+WRITERS = {"csv": _csv_chunks, "ndjson": _ndjson_chunks}
+
+
+def export(export_format, start=None, end=None, statuses=None, chunk_size=2000, rows_per_chunk=500, stats=None):
+    """Yield the export as text chunks of about ``rows_per_chunk`` rows.
+
+    ``chunk_size`` rows are fetched from the cursor at a time. If a
+    ``stats`` dict is given it is filled with the rows and orders written
+    and the seconds taken once the export is exhausted.
+    """
+    stats = {} if stats is None else stats
+    stats.update(rows=0, orders=0, seconds=0.0)
+    rows = order_lines(start, end, statuses).iterator(chunk_size=chunk_size)
+
+    def counted():
+        last_order = None
+        for row in rows:
+            stats["rows"] += 1
+            if row[0] != last_order:
+                stats["orders"] += 1
+                last_order = row[0]
+            yield row
+
+    begin = time.perf_counter()
+    try:
+        yield from WRITERS[export_format](counted(), rows_per_chunk)
+    finally:
+        stats["seconds"] = time.perf_counter() - begin
+        metrics.increment("order_export_rows_total", stats["rows"], format=export_format)
+        metrics.observe("order_export_seconds", stats["seconds"], buckets=(1, 10, 60, 300, 900, 3600))
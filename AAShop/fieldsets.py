@@ -0,0 +1,177 @@
+"""Flat, sparse representations for list endpoints.
+
+``?view=compact`` or ``?fields=id,name,...`` switches a list endpoint from
+its nested serializer to flat dicts: rows come straight from values(),
+joined columns included, so no model instances or serializer fields are
+built per row. A Fieldset names the flat fields an endpoint offers and the
+lookup each is read from ("product__name"); ``compact`` is the selection
+``view=compact`` returns.
+
+The cart, whose lines may live in Redis, builds the same rows from its
+backend's CartItem instances with ``flat_cart()``.
+"""
+from decimal import Decimal
+from operator import attrgetter
+
+from django.db.models import F
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+
+def _plain(value):
+    # Decimals as strings, as the serializers render them
+    return str(value) if isinstance(value, Decimal) else value
+
+
+class Fieldset:
+    def __init__(self, fields, compact):
+        self.fields = fields
+        self.compact = tuple(compact)
+        self._getters = {name: attrgetter(lookup.replace("__", ".")) for name, lookup in fields.items()}
+
+    def requested(self, params):
+        """The field names query ``params`` select, or None for the full nested representation."""
+        fields = params.get("fields")
+        if fields:
+            names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+            unknown = [name for name in names if name not in self.fields]
+            if unknown:
+                raise ValidationError({
+                    "fields": f"Unknown fields: {', '.join(unknown)}. Choose from {', '.join(self.fields)}"
+                })
+            return names
+        if params.get("view") == "compact":
+            return list(self.compact)
+        return None
+
+    def values(self, queryset, names, extra=()):
+        """``queryset`` as values() rows holding ``names`` and the model fields ``extra``."""
+        plain, renamed = list(extra), {}
+        for name in names:
+            lookup = self.fields[name]
+            if lookup == name:
+                plain.append(name)
+            else:
+                renamed[name] = F(lookup)
+        return queryset.values(*plain, **renamed)
+
+    def rows(self, queryset, names, extra=()):
+        """``values()`` rows as plain dicts, decimals as strings."""
+        return [
+            {name: _plain(value) for name, value in row.items()}
+            for row in self.values(queryset, names, extra)
+        ]
+
+    def row(self, obj, names):
+        """The flat row for a model instance."""
+        return {name: _plain(self._getters[name](obj)) for name in names}
+
+
+class FieldsetListMixin:
+    """List with ``fieldset`` when the request asks for flat rows.
+
+    Fields listed in ``expanded_fields``, such as nested lists, are not
+    values() columns; ``expand_rows()`` fills them in on the page's rows.
+    """
+
+    fieldset = None
+    expanded_fields = ()
+
+    def list(self, request, *args, **kwargs):
+        names = self.fieldset.requested(request.query_params)
+        if names is None:
+            return super().list(request, *args, **kwargs)
+        return self.flat_list(self.filter_queryset(self.get_queryset()), names)
+
+    def flat_list(self, queryset, names):
+        columns = [name for name in names if name not in self.expanded_fields]
+        # Cursor pagination reads its ordering fields off the rows it paged,
+        # and expanded fields are looked up by id.
+        ordering = getattr(self.paginator, "ordering", None) or ()
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        helpers = [field.lstrip("-") for field in ordering]
+        if len(columns) < len(names):
+            helpers.append("id")
+        helpers = list(dict.fromkeys(field for field in helpers if field not in columns))
+
+        source = self.fieldset.values(queryset, columns, helpers)
+        page = self.paginate_queryset(source)
+        paginated = page is not None
+        if not paginated:
+            page = list(source)
+        rows = [{name: _plain(row[name]) for name in columns} for row in page]
+        if len(columns) < len(names):
+            self.expand_rows(rows, [row["id"] for row in page], names, source.db)
+        return self.get_paginated_response(rows) if paginated else Response(rows)
+
+    def expand_rows(self, rows, ids, names, using):
+        """Add the requested expanded fields to ``rows``, read from database ``using``.
+
+        Views with ``expanded_fields`` override this; by default the rows are left as they are.
+        """
+
+
+PRODUCTS = Fieldset(
+    {
+        "id": "id",
+        "name": "name",
+        "description": "description",
+        "price": "price",
+        "stock": "stock",
+        "category_id": "category_id",
+        "category_name": "category__name",
+        "created_at": "created_at",
+    },
+    compact=("id", "name", "price", "stock", "category_name"),
+)
+
+ORDERS = Fieldset(
+    {
+        "id": "id",
+        "user": "user",
+        "status": "status",
+        "total_price": "total_price",
+        "created_at": "created_at",
+        "updated_at": "updated_at",
+        # Filled in by OrderViewSet.expand_rows from ORDER_LINES
+        "items": "items",
+    },
+    compact=("id", "status", "total_price", "created_at", "items"),
+)
+
+# Order lines carry the price snapshotted when the order was placed and the
+# product's current name
+ORDER_LINES = Fieldset(
+    {
+        "id": "id",
+        "product_id": "product_id",
+        "product_name": "product__name",
+        "price": "price",
+        "quantity": "quantity",
+    },
+    compact=("id", "product_id", "product_name", "price", "quantity"),
+)
+
+CART_LINES = Fieldset(
+    {
+        "id": "id",
+        "product_id": "product_id",
+        "product_name": "product__name",
+        "price": "product__price",
+        "quantity": "quantity",
+        "subtotal": "subtotal",
+    },
+    compact=("id", "product_id", "product_name", "price", "quantity", "subtotal"),
+)
+
+
+def flat_cart(cart, names):
+    """The cart with its lines as flat ``CART_LINES`` rows holding ``names``."""
+    return {
+        "id": cart.id,
+        "item_count": cart.item_count,
+        # An empty cart's total may still be the model default, 0
+        "total": _plain(Decimal(cart.total).quantize(Decimal("0.01"))),
+        "items": [CART_LINES.row(item, names) for item in cart.items.all()],
+    }
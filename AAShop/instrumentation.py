@@ -0,0 +1,147 @@
+"""Per-request timing: Server-Timing headers and latency histograms.
+
+A sampled request collects, besides its total wall time, the time spent in
+SQL (and the number of queries), in calls to Chapa and in serializers.
+Code that talks to something slow wraps the call in ``timed("<kind>")``;
+outside a sampled request that is a single context variable lookup.
+
+Only a fraction of requests (REQUEST_TIMING_SAMPLE_RATE) is timed, so
+histogram counts are samples, not request totals. Async views run their
+queries on executor threads, out of reach of the connection's execute
+wrapper, so their requests report no SQL time.
+"""
+import contextlib
+import contextvars
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+# Upper bounds for the per-request query count histogram
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    def __init__(self, db=True):
+        self.durations = {"db": 0.0} if db else {}
+        self.queries = 0
+        self.active = set()
+
+    def add(self, kind, seconds):
+        self.durations[kind] = self.durations.get(kind, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def timed(kind):
+    """Add the time spent in the block to the current request's ``kind``.
+
+    Nested blocks of the same kind (a serializer rendering its nested
+    serializers) are only counted once, by the outermost block.
+    """
+    timings = _current.get()
+    if timings is None or kind in timings.active:
+        yield
+        return
+    timings.active.add(kind)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.active.discard(kind)
+        timings.add(kind, time.perf_counter() - start)
+
+
+class TimedSerializerMixin:
+    """Count a serializer's to_representation as serializer time."""
+
+    def to_representation(self, instance):
+        with timed("serializer"):
+            return super().to_representation(instance)
+
+
+def _view_label(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match._func_path
+
+
+class RequestTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if random.random() >= settings.REQUEST_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+
+        def record_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                timings.queries += 1
+                timings.add("db", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        try:
+            with contextlib.ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(record_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        timings.add("total", time.perf_counter() - start)
+        return self.finish(request, timings, response)
+
+    async def __acall__(self, request):
+        if random.random() >= settings.REQUEST_TIMING_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        timings = RequestTimings(db=False)
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        timings.add("total", time.perf_counter() - start)
+        return self.finish(request, timings, response)
+
+    def finish(self, request, timings, response):
+        self.record(_view_label(request), timings)
+        response["Server-Timing"] = self.server_timing(timings)
+        return response
+
+    def record(self, view, timings):
+        metrics.observe("http_request_duration_seconds", timings.durations["total"], view=view)
+        if "db" in timings.durations:
+            metrics.observe("http_request_db_queries", timings.queries, buckets=QUERY_COUNT_BUCKETS, view=view)
+        for kind in ("db", "chapa", "serializer"):
+            if kind in timings.durations:
+                metrics.observe(f"http_request_{kind}_seconds", timings.durations[kind], view=view)
+
+    def server_timing(self, timings):
+        entries = []
+        for kind, seconds in timings.durations.items():
+            entry = f"{kind};dur={seconds * 1000:.2f}"
+            if kind == "db":
+                entry += f';desc="{timings.queries} queries"'
+            entries.append(entry)
+        return ", ".join(entries)
@@ -0,0 +1,300 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from AAKenyaShop.celery import app as celery_app
+from AAShop import webhooks
+from AAShop.chapa_stub import FakeChapaServer
+from AAShop.models import EmailOutbox, User, WebhookEvent
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, name, ms, status, queries):
+        with self.lock:
+            self.latencies[name].append(ms)
+            if queries is not None:
+                self.queries[name].append(queries)
+            if status >= 400:
+                self.errors[name] += 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for name, timings in self.latencies.items():
+            queries = self.queries.get(name)
+            endpoints[name] = {
+                "requests": len(timings),
+                "errors": self.errors[name],
+                "mean_ms": round(sum(timings) / len(timings), 2),
+                "p50_ms": round(percentile(timings, 50), 2),
+                "p95_ms": round(percentile(timings, 95), 2),
+                "p99_ms": round(percentile(timings, 99), 2),
+                # Successful requests per wall-clock second of the whole run
+                "throughput_rps": round((len(timings) - self.errors[name]) / elapsed, 1),
+                "queries_mean": round(sum(queries) / len(queries), 2) if queries else None,
+            }
+        return endpoints
+
+
+class InProcessTransport:
+    """Drives the URLconf through Django's test client, counting SQL queries.
+
+    Bodies arrive as JSON strings, so webhook signatures match what is sent.
+    """
+
+    def __init__(self):
+        self.client = Client()
+
+    def request(self, method, path, body=None, token=None, headers=None):
+        headers = {f"HTTP_{name.upper().replace('-', '_')}": value for name, value in (headers or {}).items()}
+        if token:
+            headers["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(path, data=body, content_type="application/json", **headers)
+        data = response.json() if response.get("Content-Type", "").startswith("application/json") else None
+        return response.status_code, data, len(ctx.captured_queries)
+
+
+class HttpTransport:
+    """Drives a running server over HTTP; query counts are not visible here."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def request(self, method, path, body=None, token=None, headers=None):
+        headers = {"Content-Type": "application/json", **(headers or {})}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        response = self.session.request(method, self.base_url + path, data=body, headers=headers, timeout=30)
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        return response.status_code, data, None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the shop's critical flow (register, token, browse, add to cart, checkout, "
+        "webhook) against a fake Chapa and write a JSON report"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=["inprocess", "server"], default="inprocess")
+        parser.add_argument("--flows", type=int, default=50, help="Complete shopper flows to run")
+        parser.add_argument("--concurrency", type=int, default=4, help="Parallel shoppers (server mode)")
+        parser.add_argument(
+            "--base-url",
+            help="Benchmark an already running server instead of starting gunicorn; it must share this "
+                 "database (for the clean-up) and CHAPA_WEBHOOK_SECRET",
+        )
+        parser.add_argument("--workers", type=int, default=4, help="gunicorn workers to start (server mode)")
+        parser.add_argument("--seed", type=int, default=7)
+        parser.add_argument("--output", help="Write the JSON report here")
+        parser.add_argument("--baseline", help="A previous JSON report to compare against")
+
+    def handle(self, *args, **options):
+        recorder = Recorder()
+        self.shoppers = []
+        # Webhooks are signed with the secret the server checks; a server
+        # started here gets this one.
+        secret = settings.CHAPA_WEBHOOK_SECRET or "bench-api"
+        with FakeChapaServer() as gateway, override_settings(CHAPA_WEBHOOK_SECRET=secret):
+            start = time.perf_counter()
+            if options["mode"] == "inprocess":
+                concurrency = 1
+                self.run_inprocess(gateway, recorder, options)
+                elapsed = time.perf_counter() - start
+            else:
+                concurrency = options["concurrency"]
+                try:
+                    self.run_server(gateway, recorder, options)
+                    elapsed = time.perf_counter() - start
+                finally:
+                    self.clean_up()
+
+        report = {
+            "mode": options["mode"],
+            "commit": self.git_commit(),
+            "flows": options["flows"],
+            "concurrency": concurrency,
+            "seed": options["seed"],
+            "flows_per_second": round(options["flows"] / elapsed, 2),
+            "endpoints": recorder.summary(elapsed),
+        }
+        self.print_report(report, options["baseline"])
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(report, fh, indent=2, sort_keys=True)
+            self.stdout.write(f"Report written to {options['output']}")
+
+    def run_inprocess(self, gateway, recorder, options):
+        # Run tasks inline and roll every write back so the database is unchanged.
+        celery_app.conf.update(CELERY_TASK_ALWAYS_EAGER=True)
+        rng = random.Random(options["seed"])
+        with override_settings(
+            CHAPA_BASE_URL=gateway.url,
+            EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+            ALLOWED_HOSTS=["testserver"],
+        ), transaction.atomic():
+            transport = InProcessTransport()
+            for _ in range(options["flows"]):
+                self.shopper_flow(transport, recorder, rng)
+            transaction.set_rollback(True)
+
+    def run_server(self, gateway, recorder, options):
+        server = None
+        base_url = options["base_url"]
+        if not base_url:
+            server, base_url = self.start_gunicorn(gateway, options["workers"])
+        try:
+            remaining = iter(range(options["flows"]))
+            lock = threading.Lock()
+
+            def shopper(index):
+                transport = HttpTransport(base_url)
+                rng = random.Random(options["seed"] + index)
+                while True:
+                    with lock:
+                        if next(remaining, None) is None:
+                            return
+                    self.shopper_flow(transport, recorder, rng)
+
+            threads = [threading.Thread(target=shopper, args=(i,)) for i in range(options["concurrency"])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if server:
+                server.terminate()
+                server.wait(timeout=10)
+
+    def start_gunicorn(self, gateway, workers):
+        port = 18000 + os.getpid() % 1000
+        env = dict(
+            os.environ,
+            CHAPA_BASE_URL=gateway.url,
+            CHAPA_WEBHOOK_SECRET=settings.CHAPA_WEBHOOK_SECRET,
+            CELERY_TASK_ALWAYS_EAGER="True",
+            EMAIL_BACKEND="django.core.mail.backends.dummy.EmailBackend",
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "AAKenyaShop.wsgi:application",
+             "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--log-level", "warning"],
+            env=env,
+        )
+        base_url = f"http://127.0.0.1:{port}"
+        for _ in range(100):
+            try:
+                requests.get(f"{base_url}/api/", timeout=5)
+                return server, base_url
+            except requests.RequestException:
+                time.sleep(0.1)
+        server.terminate()
+        raise CommandError("gunicorn did not start")
+
+    def shopper_flow(self, transport, recorder, rng):
+        def call(name, method, path, body=None, token=None, signed=False):
+            body = json.dumps(body) if body is not None else None
+            # Signed with the secret the server checks, as Chapa signs it
+            headers = {"Chapa-Signature": webhooks.sign(body.encode())} if signed else None
+            start = time.perf_counter()
+            status, data, queries = transport.request(method, path, body, token, headers)
+            recorder.add(name, (time.perf_counter() - start) * 1000, status, queries)
+            return status, data
+
+        suffix = uuid.UUID(int=rng.getrandbits(128)).hex[:16]
+        email, password = f"bench-{suffix}@example.com", "bench-password"
+        shopper = {"username": f"bench-{suffix}", "email": email, "tx_refs": []}
+        self.shoppers.append(shopper)
+        # AAShop.urls declares these under "api/" and is itself mounted at "api/"
+        call("register", "post", "/api/api/register/", {"username": f"bench-{suffix}", "email": email, "password": password})
+        status, data = call("token", "post", "/api/api/token/", {"email": email, "password": password})
+        if status != 200:
+            return
+        token = data["access"]
+
+        status, data = call("browse_products", "get", "/api/products/?in_stock=true&page_size=20", token=token)
+        products = data["results"] if status == 200 else []
+        if not products:
+            raise CommandError("No products in stock; seed the database first")
+
+        for product in rng.sample(products, min(2, len(products))):
+            call("add_to_cart", "post", "/api/cart/add/", {"product_id": product["id"], "quantity": 1}, token)
+        call("view_cart", "get", "/api/cart/", token=token)
+
+        status, data = call("checkout", "post", "/api/checkout/", {}, token)
+        if status != 201:
+            return
+        tx_ref = data["payment"]["tx_ref"]
+        shopper["tx_refs"].append(tx_ref)
+        call("webhook", "post", "/api/payments/webhook/", {"tx_ref": tx_ref, "status": "success", "reference": f"CH-{suffix}"}, signed=True)
+
+    def clean_up(self):
+        # What the flows created on the server: the users take their carts,
+        # orders and payments with them. The stock they bought stays sold.
+        usernames = [shopper["username"] for shopper in self.shoppers]
+        emails = [shopper["email"] for shopper in self.shoppers]
+        tx_refs = [tx_ref for shopper in self.shoppers for tx_ref in shopper["tx_refs"]]
+        WebhookEvent.objects.filter(tx_ref__in=tx_refs).delete()
+        EmailOutbox.objects.filter(to__in=emails).delete()
+        deleted, _ = User.objects.filter(username__in=usernames).delete()
+        self.stdout.write(f"Cleaned up {deleted} rows of {len(usernames)} benchmark shoppers")
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def print_report(self, report, baseline_path):
+        baseline = {}
+        if baseline_path:
+            with open(baseline_path) as fh:
+                baseline = json.load(fh)["endpoints"]
+
+        self.stdout.write(
+            f"{report['mode']} @ {report['commit']}: {report['flows']} flows, "
+            f"{report['flows_per_second']} flows/s"
+        )
+        self.stdout.write(
+            f"{'endpoint':<16}{'reqs':>6}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'rps':>9}{'queries':>9}"
+        )
+        for name, stats in report["endpoints"].items():
+            queries = "-" if stats["queries_mean"] is None else f"{stats['queries_mean']:g}"
+            line = (
+                f"{name:<16}{stats['requests']:>6}{stats['errors']:>5}{stats['p50_ms']:>9.2f}"
+                f"{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}{stats['throughput_rps']:>9.1f}{queries:>9}"
+            )
+            if name in baseline:
+                change = (stats["p95_ms"] - baseline[name]["p95_ms"]) / baseline[name]["p95_ms"] * 100
+                line += f"   p95 {change:+.0f}% vs baseline"
+            self.stdout.write(line)
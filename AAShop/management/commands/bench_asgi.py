@@ -0,0 +1,137 @@
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from decimal import Decimal
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from AAShop.chapa_stub import FakeChapaServer
+from AAShop.models import Order, Payment, User
+
+SERVERS = {
+    "wsgi": {
+        "path": "/api/payments/verify/{}/",
+        "argv": lambda port, workers: [
+            sys.executable, "-m", "gunicorn", "AAKenyaShop.wsgi:application", "--bind", f"127.0.0.1:{port}",
+            "--workers", str(workers), "--worker-class", "sync", "--timeout", "120", "--log-level", "warning",
+        ],
+    },
+    "asgi": {
+        "path": "/api/async/payments/verify/{}/",
+        "argv": lambda port, workers: [
+            sys.executable, "-m", "uvicorn", "AAKenyaShop.asgi:application", "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--no-access-log", "--log-level", "warning",
+        ],
+    },
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent payment verifies against a slow fake gateway under gunicorn sync workers "
+        "(the DRF view) and uvicorn (the async view), with the same number of worker processes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--server", choices=[*SERVERS, "all"], default="all")
+        parser.add_argument("--requests", type=int, default=400)
+        parser.add_argument("--concurrency", type=int, default=100, help="Requests in flight at once")
+        parser.add_argument("--workers", type=int, default=2, help="Worker processes per server")
+        parser.add_argument("--latency", type=float, default=0.2, help="Fake gateway latency in seconds")
+
+    def handle(self, *args, **options):
+        names = list(SERVERS) if options["server"] == "all" else [options["server"]]
+        # The gateway reports every payment as pending, so verifies only read
+        # and the runs do not change each other's payments.
+        with FakeChapaServer(latency=options["latency"], default_outcome="pending") as gateway:
+            # The servers run in their own processes, so the benchmark rows
+            # are committed, and deleted at the end.
+            suffix = uuid.uuid4().hex[:12]
+            user = User.objects.create(username=f"bench-{suffix}", email=f"bench-{suffix}@example.com")
+            try:
+                order = Order.objects.create(user=user, total_price=Decimal("100.00"))
+                tx_refs = [f"bench-{suffix}-{i}" for i in range(options["requests"])]
+                Payment.objects.bulk_create(
+                    Payment(order=order, tx_ref=tx_ref, amount=order.total_price) for tx_ref in tx_refs
+                )
+                token = str(RefreshToken.for_user(user).access_token)
+                self.stdout.write(
+                    f"{options['requests']} verifies, {options['concurrency']} in flight, "
+                    f"{options['workers']} worker processes, gateway latency {options['latency'] * 1000:.0f} ms"
+                )
+                for name in names:
+                    self.report(name, *self.run(name, gateway, tx_refs, token, options))
+            finally:
+                user.delete()
+
+    def run(self, name, gateway, tx_refs, token, options):
+        port = free_port()
+        env = {**os.environ, "CHAPA_BASE_URL": gateway.url, "ALLOWED_HOSTS": "127.0.0.1"}
+        server = subprocess.Popen(SERVERS[name]["argv"](port, options["workers"]), env=env)
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            self.wait_until_up(server, base_url)
+            return asyncio.run(self.load(base_url + SERVERS[name]["path"], tx_refs, token, options["concurrency"]))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    def wait_until_up(self, server, base_url):
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"The server exited with status {server.returncode}")
+            try:
+                httpx.get(base_url + "/api/", timeout=1)
+                return
+            except httpx.TransportError:
+                time.sleep(0.2)
+        raise CommandError("The server did not come up within 30 seconds")
+
+    async def load(self, url, tx_refs, token, concurrency):
+        limit = asyncio.Semaphore(concurrency)
+        latencies, errors = [], 0
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        async with httpx.AsyncClient(headers=headers, limits=limits, timeout=120) as client:
+            async def verify(tx_ref):
+                nonlocal errors
+                async with limit:
+                    start = time.perf_counter()
+                    try:
+                        response = await client.get(url.format(tx_ref))
+                    except httpx.TransportError:
+                        errors += 1
+                        return
+                    if response.status_code != 200:
+                        errors += 1
+                        return
+                    latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(verify(tx_ref) for tx_ref in tx_refs))
+            elapsed = time.perf_counter() - start
+        return latencies, errors, elapsed
+
+    def report(self, name, latencies, errors, elapsed):
+        if len(latencies) < 2:
+            raise CommandError(f"{name}: {errors} of the requests failed")
+        cuts = statistics.quantiles(latencies, n=100)
+        self.stdout.write(self.style.SUCCESS(
+            f"  {name}: {len(latencies) / elapsed:8.1f} verifies/s  p50 {cuts[49] * 1000:7.1f} ms  "
+            f"p99 {cuts[98] * 1000:7.1f} ms  errors {errors}"
+        ))
@@ -0,0 +1,109 @@
+import random
+import time
+from decimal import Decimal
+
+import redis
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from AAShop import carts
+from AAShop.models import Category, Product, User
+
+# Share of each cart operation in the benchmark mix
+OPERATIONS = [("add", 0.5), ("view", 0.3), ("update", 0.15), ("remove", 0.05)]
+
+
+class Command(BaseCommand):
+    help = "Compare cart operations per second between the cart storage backends"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backend", choices=["db", "redis", "both"], default="both")
+        parser.add_argument("--ops", type=int, default=2000, help="Cart operations per backend")
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--products", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=11)
+
+    def handle(self, *args, **options):
+        backends = ["db", "redis"] if options["backend"] == "both" else [options["backend"]]
+        # Everything written to the database is rolled back at the end.
+        with override_settings(ALLOWED_HOSTS=["testserver"]), transaction.atomic():
+            category = Category.objects.create(name="Cart benchmark")
+            products = Product.objects.bulk_create(
+                Product(category=category, name=f"Cart benchmark {i}", price=Decimal(100 + i), stock=1000)
+                for i in range(options["products"])
+            )
+            users = [
+                User.objects.create_user(username=f"bench-cart-{i}", email=f"bench-cart-{i}@example.com", password=None)
+                for i in range(options["users"])
+            ]
+            self.stdout.write(f"{options['ops']} operations per backend over {len(users)} carts")
+            for name in backends:
+                self.run(name, users, products, options)
+            transaction.set_rollback(True)
+
+    def run(self, name, users, products, options):
+        rng = random.Random(options["seed"])
+        backend = carts.get_backend(name)
+        clients = {}
+        for user in users:
+            clients[user.pk] = client = APIClient()
+            client.force_authenticate(user)
+
+        kinds, weights = zip(*OPERATIONS)
+        timings = {kind: [] for kind in kinds}
+        queries = {kind: 0 for kind in kinds}
+        lines = {user.pk: [] for user in users}
+        try:
+            with override_settings(CART_BACKEND=name):
+                start = time.perf_counter()
+                for _ in range(options["ops"]):
+                    user = rng.choice(users)
+                    kind = rng.choices(kinds, weights)[0]
+                    if kind in ("update", "remove") and not lines[user.pk]:
+                        kind = "add"
+                    sent = time.perf_counter()
+                    with CaptureQueriesContext(connection) as ctx:
+                        self.operate(kind, clients[user.pk], lines[user.pk], products, rng)
+                    timings[kind].append(time.perf_counter() - sent)
+                    queries[kind] += len(ctx.captured_queries)
+                elapsed = time.perf_counter() - start
+        except redis.ConnectionError as exc:
+            raise CommandError(f"Redis is not reachable: {exc}")
+        finally:
+            if name == "redis":
+                for user in users:
+                    try:
+                        backend.discard(user)
+                    except redis.ConnectionError:
+                        break
+
+        self.stdout.write(self.style.SUCCESS(f"{name}: {options['ops'] / elapsed:,.0f} ops/s"))
+        for kind in kinds:
+            if timings[kind]:
+                count = len(timings[kind])
+                self.stdout.write(
+                    f"  {kind:<7}{count:>6} ops  {sum(timings[kind]) / count * 1000:7.2f} ms/op  "
+                    f"{queries[kind] / count:5.2f} queries/op"
+                )
+
+    def operate(self, kind, client, lines, products, rng):
+        if kind == "add":
+            response = client.post(
+                "/api/cart/add/", {"product_id": rng.choice(products).pk, "quantity": 1}, format="json"
+            )
+            if response.data["id"] not in lines:
+                lines.append(response.data["id"])
+        elif kind == "view":
+            response = client.get("/api/cart/")
+        elif kind == "update":
+            response = client.patch(
+                f"/api/cart/update/{rng.choice(lines)}/", {"quantity": rng.randint(1, 5)}, format="json"
+            )
+        else:
+            line = lines.pop(rng.randrange(len(lines)))
+            response = client.delete(f"/api/cart/remove/{line}/")
+        if response.status_code >= 400:
+            raise CommandError(f"{kind} failed with {response.status_code}: {response.data}")
@@ -0,0 +1,54 @@
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from AAShop.models import Cart, CartItem, Category, Product, User
+from AAShop.services import place_order
+
+
+class Command(BaseCommand):
+    help = "Benchmark order placement for carts of different sizes (all writes are rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100])
+        parser.add_argument("--runs", type=int, default=20)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'items':>6} {'queries':>8} {'mean ms':>9} {'best ms':>9}")
+        for size in options["sizes"]:
+            queries, timings = self.measure(size, options["runs"])
+            self.stdout.write(
+                f"{size:>6} {queries:>8} {sum(timings) / len(timings):>9.2f} {min(timings):>9.2f}"
+            )
+
+    def measure(self, size, runs):
+        timings = []
+        queries = 0
+        for _ in range(runs):
+            with transaction.atomic():
+                user = self.build_cart(size)
+                with CaptureQueriesContext(connection) as ctx:
+                    start = time.perf_counter()
+                    place_order(user)
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries = len(ctx.captured_queries)
+                transaction.set_rollback(True)
+        return queries, timings
+
+    def build_cart(self, size):
+        suffix = uuid.uuid4().hex[:12]
+        user = User.objects.create(username=f"bench-{suffix}", email=f"bench-{suffix}@example.com")
+        category = Category.objects.create(name=f"bench-{suffix}")
+        products = Product.objects.bulk_create(
+            Product(category=category, name=f"Bench product {i}", price=Decimal("10.00") + i, stock=1000)
+            for i in range(size)
+        )
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=product, quantity=2) for product in products
+        )
+        return user
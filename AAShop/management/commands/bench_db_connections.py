@@ -0,0 +1,106 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from AAShop.management.commands.bench_asgi import free_port
+from AAShop.models import User
+
+# Environment for each way of connecting, on top of the current one
+MODES = {
+    "per-request": {"DB_CONN_MAX_AGE": "0", "DB_POOL": "False"},
+    "persistent": {"DB_CONN_MAX_AGE": "60", "DB_POOL": "False"},
+    "pool": {"DB_CONN_MAX_AGE": "0", "DB_POOL": "True"},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare view_cart latency and PostgreSQL sessions opened under gunicorn with a connection "
+        "per request, persistent connections and psycopg's pool"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=[*MODES, "all"], default="all")
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+        parser.add_argument("--path", default="/api/cart/", help="Endpoint to call")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Connection setup only matters against PostgreSQL; point DATABASE_URL at one")
+        names = list(MODES) if options["mode"] == "all" else [options["mode"]]
+
+        # The servers run in their own processes, so the user is committed
+        suffix = uuid.uuid4().hex[:12]
+        user = User.objects.create(username=f"bench-{suffix}", email=f"bench-{suffix}@example.com")
+        try:
+            token = str(RefreshToken.for_user(user).access_token)
+            self.stdout.write(
+                f"{options['requests']} sequential GET {options['path']}, {options['workers']} gunicorn worker(s)"
+            )
+            for name in names:
+                self.report(name, *self.run(name, token, options))
+        finally:
+            user.delete()
+
+    def sessions(self):
+        # Connections ever made to this database (PostgreSQL 14+)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sessions FROM pg_stat_database WHERE datname = current_database()")
+            return cursor.fetchone()[0]
+
+    def run(self, name, token, options):
+        port = free_port()
+        env = {**os.environ, **MODES[name], "ALLOWED_HOSTS": "127.0.0.1"}
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "AAKenyaShop.wsgi:application", "--bind", f"127.0.0.1:{port}",
+             "--workers", str(options["workers"]), "--log-level", "warning"],
+            env=env,
+        )
+        try:
+            url = f"http://127.0.0.1:{port}{options['path']}"
+            with httpx.Client(headers={"Authorization": f"Bearer {token}"}, timeout=30) as client:
+                self.wait_until_up(server, client, url)
+                # Warm up each worker (and fill the pool) before measuring
+                for _ in range(10 * options["workers"]):
+                    client.get(url)
+                before = self.sessions()
+                latencies = []
+                for _ in range(options["requests"]):
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        raise CommandError(f"{name}: {url} answered {response.status_code}")
+                opened = self.sessions() - before
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        return latencies, opened
+
+    def wait_until_up(self, server, client, url):
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f"gunicorn exited with status {server.returncode}")
+            try:
+                client.get(url)
+                return
+            except httpx.TransportError:
+                time.sleep(0.2)
+        raise CommandError("gunicorn did not come up within 30 seconds")
+
+    def report(self, name, latencies, opened):
+        cuts = statistics.quantiles(latencies, n=100)
+        self.stdout.write(self.style.SUCCESS(
+            f"  {name:<12} p50 {cuts[49] * 1000:6.2f} ms  p99 {cuts[98] * 1000:6.2f} ms  "
+            f"{opened:>5} connections opened"
+        ))
@@ -0,0 +1,93 @@
+import io
+import time
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+
+from AAShop.models import EmailOutbox
+from AAShop.outbox import drain
+from AAShop.smtp_stub import FakeSMTPServer
+
+BACKENDS = {
+    "locmem": "django.core.mail.backends.locmem.EmailBackend",
+    "console": "django.core.mail.backends.console.EmailBackend",
+    "smtp": "django.core.mail.backends.smtp.EmailBackend",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare messages per second between one connection per email (the old task) "
+        "and batched outbox drains, on the locmem, console and stub SMTP backends"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backend", choices=[*BACKENDS, "all"], default="all")
+        parser.add_argument("--messages", type=int, default=1000)
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--rate-limit", type=float, default=0, help="Messages a second, 0 for none")
+        parser.add_argument(
+            "--latency", type=float, default=0.02, help="Seconds the SMTP stub takes to accept a connection"
+        )
+
+    def handle(self, *args, **options):
+        names = list(BACKENDS) if options["backend"] == "all" else [options["backend"]]
+        with FakeSMTPServer(latency=options["latency"]) as smtp:
+            for name in names:
+                connection_options = {
+                    "locmem": {},
+                    "console": {"stream": io.StringIO()},
+                    "smtp": {
+                        "host": smtp.host, "port": smtp.port, "username": "", "password": "",
+                        "use_tls": False, "use_ssl": False, "timeout": 5,
+                    },
+                }[name]
+                self.stdout.write(f"{name}: {options['messages']} messages")
+                self.report("one connection each", options["messages"], self.per_message(name, connection_options, options))
+                self.report(
+                    f"outbox, batches of {options['batch_size']}",
+                    options["messages"],
+                    self.outbox(name, connection_options, options),
+                )
+            if smtp.connections:
+                self.stdout.write(f"SMTP stub: {len(smtp.messages)} messages over {smtp.connections} connections")
+
+    def report(self, label, count, elapsed):
+        self.stdout.write(self.style.SUCCESS(f"  {label:<28}{count / elapsed:>9,.0f} msg/s  ({elapsed:.2f} s)"))
+
+    def per_message(self, name, connection_options, options):
+        start = time.perf_counter()
+        for i in range(options["messages"]):
+            # What send_mail() does: a connection opened and closed per call
+            connection = get_connection(BACKENDS[name], **connection_options)
+            EmailMessage(
+                "Payment Confirmation", f"Benchmark message {i}", "no-reply@example.com",
+                [f"bench-{i}@example.com"], connection=connection,
+            ).send()
+        return time.perf_counter() - start
+
+    def outbox(self, name, connection_options, options):
+        providers = {
+            "bench": {"BACKEND": BACKENDS[name], "RATE_LIMIT": options["rate_limit"], "OPTIONS": connection_options},
+        }
+        # Queued emails are rolled back at the end.
+        with override_settings(EMAIL_PROVIDERS=providers), transaction.atomic():
+            EmailOutbox.objects.bulk_create(
+                EmailOutbox(
+                    event="benchmark", provider="bench", to=f"bench-{i}@example.com",
+                    from_email="no-reply@example.com", subject="Payment Confirmation",
+                    body=f"Benchmark message {i}",
+                )
+                for i in range(options["messages"])
+            )
+            start = time.perf_counter()
+            while drain("bench", options["batch_size"]):
+                pass
+            elapsed = time.perf_counter() - start
+            unsent = EmailOutbox.objects.filter(provider="bench").exclude(status="sent").count()
+            transaction.set_rollback(True)
+        if unsent:
+            raise CommandError(f"{unsent} outbox emails were not sent")
+        return elapsed
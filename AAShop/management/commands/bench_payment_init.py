@@ -0,0 +1,54 @@
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from AAKenyaShop.celery import app as celery_app
+from AAShop.chapa_stub import FakeChapaServer
+from AAShop.models import Order, User
+from AAShop.views import initiate_payment
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare how long initiate_payment occupies a worker with inline vs Celery "
+        "initialization against a slow fake gateway (all writes are rolled back)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--latency", type=float, default=0.3, help="Fake gateway latency in seconds")
+        parser.add_argument("--requests", type=int, default=20)
+
+    def handle(self, *args, **options):
+        # Enqueue into an in-memory broker so the async run needs no Redis.
+        celery_app.conf.update(CELERY_BROKER_URL="memory://")
+
+        with FakeChapaServer(latency=options["latency"]) as server:
+            self.stdout.write(f"gateway latency {options['latency'] * 1000:.0f} ms")
+            for mode, async_init in (("inline", False), ("celery", True)):
+                with override_settings(CHAPA_BASE_URL=server.url, CHAPA_ASYNC_INIT=async_init):
+                    timings = self.measure(options["requests"])
+                self.stdout.write(
+                    f"{mode:>7}: mean {sum(timings) / len(timings):8.1f} ms   "
+                    f"max {max(timings):8.1f} ms per request"
+                )
+
+    def measure(self, count):
+        factory = APIRequestFactory()
+        timings = []
+        with transaction.atomic():
+            suffix = uuid.uuid4().hex[:12]
+            user = User.objects.create(username=f"bench-{suffix}", email=f"bench-{suffix}@example.com")
+            Order.objects.create(user=user, status="PENDING", total_price=Decimal("100.00"))
+            for _ in range(count):
+                request = factory.post("/api/payments/initiate/")
+                force_authenticate(request, user=user)
+                start = time.perf_counter()
+                initiate_payment(request)
+                timings.append((time.perf_counter() - start) * 1000)
+            transaction.set_rollback(True)
+        return timings
@@ -0,0 +1,92 @@
+import statistics
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from AAKenyaShop.celery import app as celery_app
+from AAShop.queue_harness import in_memory_broker, profile_worker, worker
+
+# Stand-ins for the real tasks: they take their time without touching the
+# database or the network, and are published to the queues the real ones
+# are routed to.
+done = {"payment": [], "email": []}
+done_lock = threading.Lock()
+
+
+@celery_app.task(name="bench_queues.payment", ignore_result=True)
+def payment_probe(sent):
+    with done_lock:
+        done["payment"].append(time.perf_counter() - sent)
+
+
+@celery_app.task(name="bench_queues.email", ignore_result=True)
+def email_batch(seconds):
+    time.sleep(seconds)
+    with done_lock:
+        done["email"].append(seconds)
+
+
+def routed_queue(task_name):
+    return celery_app.amqp.router.route({}, task_name)["queue"].name
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure how long payment tasks wait for a worker while a backlog of email batches drains, "
+        "with the routed queues and worker profiles and with everything on one queue"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backlog", type=int, default=300, help="Email batches queued up front")
+        parser.add_argument("--email-seconds", type=float, default=0.05, help="Time one email batch takes")
+        parser.add_argument("--payments", type=int, default=100)
+        parser.add_argument("--interval", type=float, default=0.01, help="Seconds between payment tasks")
+
+    def handle(self, *args, **options):
+        profiles = settings.CELERY_WORKER_PROFILES
+        threads = profiles["payments"]["concurrency"] + profiles["email"]["concurrency"]
+        self.stdout.write(
+            f"{options['payments']} payment tasks, one every {options['interval'] * 1000:.0f} ms; "
+            f"{options['backlog']} email batches of {options['email_seconds'] * 1000:.0f} ms; "
+            f"{threads} worker threads in all"
+        )
+        with in_memory_broker():
+            self.report("routed, no backlog", self.run(True, 0, options))
+            self.report("routed, email backlog", self.run(True, options["backlog"], options))
+            self.report("one queue, email backlog", self.run(False, options["backlog"], options))
+
+    def run(self, routed, backlog, options):
+        payments = routed_queue("AAShop.tasks.initialize_chapa_payment") if routed else "default"
+        emails = routed_queue("AAShop.tasks.send_outbox_emails") if routed else "default"
+        for values in done.values():
+            values.clear()
+        for _ in range(backlog):
+            email_batch.apply_async((options["email_seconds"],), queue=emails)
+
+        profiles = settings.CELERY_WORKER_PROFILES
+        with ExitStack() as workers:
+            if routed:
+                workers.enter_context(profile_worker("payments"))
+                workers.enter_context(profile_worker("email"))
+            else:
+                concurrency = profiles["payments"]["concurrency"] + profiles["email"]["concurrency"]
+                workers.enter_context(worker(["default"], concurrency, name="shared"))
+            for _ in range(options["payments"]):
+                payment_probe.apply_async((time.perf_counter(),), queue=payments)
+                time.sleep(options["interval"])
+            deadline = time.monotonic() + 60 + backlog * options["email_seconds"]
+            while len(done["payment"]) < options["payments"] or len(done["email"]) < backlog:
+                if time.monotonic() > deadline:
+                    raise CommandError("Timed out waiting for the workers")
+                time.sleep(0.01)
+        return list(done["payment"])
+
+    def report(self, label, latencies):
+        cuts = statistics.quantiles(latencies, n=100)
+        self.stdout.write(self.style.SUCCESS(
+            f"  {label:<26} wait p50 {cuts[49] * 1000:7.1f} ms  p99 {cuts[98] * 1000:7.1f} ms  "
+            f"max {max(latencies) * 1000:7.1f} ms"
+        ))
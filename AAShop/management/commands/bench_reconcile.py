@@ -0,0 +1,113 @@
+import random
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.utils import timezone
+
+from AAKenyaShop.celery import app as celery_app
+from AAShop import metrics
+from AAShop.chapa import ChapaClient
+from AAShop.chapa_stub import FakeChapaServer
+from AAShop.models import EmailOutbox, Order, Payment, User
+from AAShop.reconciliation import reconcile_pending_payments
+
+# Share of pending payments per gateway answer
+OUTCOMES = [("success", 0.5), ("failed", 0.2), ("pending", 0.3)]
+
+
+class Command(BaseCommand):
+    help = "Reconcile a synthetic backlog of pending payments against a local fake Chapa"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--payments", type=int, default=10_000)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument("--latency", type=float, default=0.005, help="Seconds the fake gateway takes per call")
+        parser.add_argument("--stale-share", type=float, default=0.5, help="Share of payments past the stale cutoff")
+        parser.add_argument("--seed", type=int, default=5)
+        parser.add_argument(
+            "--trace-memory", action="store_true",
+            help="Report peak Python memory of the run (tracemalloc slows it down several times)",
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        celery_app.conf.update(CELERY_TASK_ALWAYS_EAGER=True)
+        # Not wrapped in a rolled-back transaction: that would hold every
+        # after-commit callback until the end and skew the memory figure.
+        # The synthetic rows are deleted afterwards instead. Only they are
+        # reconciled, and any other tx_ref the gateway is asked about stays
+        # pending.
+        with FakeChapaServer(latency=options["latency"], default_outcome="pending") as gateway, override_settings(
+            CHAPA_BASE_URL=gateway.url,
+            EMAIL_BACKEND="django.core.mail.backends.dummy.EmailBackend",
+        ):
+            user = User.objects.create_user(
+                username="bench-reconcile", email="bench-reconcile@example.com", password=None
+            )
+            try:
+                self.run(gateway, user, rng, options)
+            finally:
+                # Queued confirmations outlive their orders (order is SET_NULL)
+                EmailOutbox.objects.filter(to=user.email).delete()
+                user.delete()
+
+    def run(self, gateway, user, rng, options):
+        expected = self.create_backlog(gateway, user, options["payments"], options["stale_share"], rng)
+        self.stdout.write(f"{options['payments']:,} pending payments, gateway latency {options['latency'] * 1000:g} ms")
+
+        client = ChapaClient(max_retries=0, pool_size=options["concurrency"])
+        if options["trace_memory"]:
+            tracemalloc.start()
+        start = time.perf_counter()
+        stats = reconcile_pending_payments(
+            batch_size=options["batch_size"],
+            concurrency=options["concurrency"],
+            min_age=0,
+            stale_after=3600,
+            client=client,
+            payments=Payment.objects.filter(order__user=user),
+        )
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(f"Reconciled in {elapsed:.1f}s: {stats['checked'] / elapsed:,.0f} payments/s")
+        if options["trace_memory"]:
+            self.stdout.write(f"Peak Python memory: {tracemalloc.get_traced_memory()[1] / 2**20:.1f} MiB")
+            tracemalloc.stop()
+        self.stdout.write(", ".join(f"{key} {value:,}" for key, value in stats.items()))
+        self.stdout.write(f"Backlog left: {metrics.gauge_value('payment_reconcile_backlog'):,}")
+        if {key: stats[key] for key in expected} != expected:
+            raise CommandError(f"Expected {expected}")
+
+    def create_backlog(self, gateway, user, total, stale_share, rng, batch_size=5000):
+        statuses, weights = zip(*OUTCOMES)
+        expected = {"completed": 0, "failed": 0, "stale": 0}
+        old = timezone.now() - timedelta(days=2)
+        for start in range(0, total, batch_size):
+            size = min(batch_size, total - start)
+            orders = Order.objects.bulk_create(
+                Order(user=user, status="PENDING", total_price=Decimal("10.00")) for _ in range(size)
+            )
+            payments = Payment.objects.bulk_create(
+                Payment(order=order, tx_ref=f"bench-rec-{order.pk}", amount=order.total_price) for order in orders
+            )
+            stale = []
+            for payment in payments:
+                outcome = rng.choices(statuses, weights)[0]
+                gateway.outcomes[payment.tx_ref] = outcome
+                is_stale = rng.random() < stale_share
+                if is_stale:
+                    stale.append(payment.pk)
+                if outcome == "success":
+                    expected["completed"] += 1
+                elif outcome == "failed":
+                    expected["failed"] += 1
+                elif is_stale:
+                    expected["stale"] += 1
+            # created_at is auto_now_add, so age the stale share afterwards
+            Payment.objects.filter(pk__in=stale).update(created_at=old)
+        return expected
@@ -0,0 +1,70 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+
+from AAShop.models import Category, Product
+from AAShop.search import search_products
+
+WORDS = (
+    "serenity reflection recovery daily meditation journal book guide prayer step "
+    "tradition fellowship coffee mug shirt poster sticker keychain edition classic "
+    "pocket large print audio hardcover paperback gift bundle set notebook pen"
+).split()
+
+
+class Command(BaseCommand):
+    help = "Compare full-text product search latency with an icontains scan (PostgreSQL only)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ensure", type=int, default=0, help="Top the product table up to this many rows first")
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Full-text search needs PostgreSQL")
+
+        rng = random.Random(options["seed"])
+        if options["ensure"]:
+            self.top_up(options["ensure"], rng)
+
+        terms = [" ".join(rng.sample(WORDS, rng.randint(1, 2))) for _ in range(options["queries"])]
+        self.stdout.write(f"{Product.objects.count()} products, {len(terms)} queries")
+
+        base = Product.objects.all()
+        self.report("full-text", [self.timed(search_products(base, term)) for term in terms])
+        self.report("icontains", [
+            self.timed(base.filter(Q(name__icontains=term) | Q(description__icontains=term)).order_by("-id"))
+            for term in terms
+        ])
+
+    def timed(self, queryset):
+        start = time.perf_counter()
+        list(queryset[:20])
+        return (time.perf_counter() - start) * 1000
+
+    def report(self, label, timings):
+        cuts = statistics.quantiles(timings, n=100)
+        self.stdout.write(f"{label:>10}: p50 {cuts[49]:8.2f} ms   p99 {cuts[98]:8.2f} ms")
+
+    def top_up(self, target, rng, batch_size=5000):
+        missing = target - Product.objects.count()
+        category, _ = Category.objects.get_or_create(name="Search benchmark")
+        while missing > 0:
+            size = min(batch_size, missing)
+            Product.objects.bulk_create(
+                Product(
+                    category=category,
+                    name=" ".join(rng.sample(WORDS, 3)).title(),
+                    description=" ".join(rng.choices(WORDS, k=20)),
+                    price=Decimal(rng.randint(100, 5000)),
+                    stock=rng.randint(0, 100),
+                )
+                for _ in range(size)
+            )
+            missing -= size
@@ -0,0 +1,92 @@
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from AAShop.models import Category, Order, OrderItem, Product, User
+from AAShop.serializers import OrderSerializer
+from AAShop.views import OrderViewSet, ProductViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rows per second of the nested serializers and the flat ?view=compact rows "
+        "for the order and product lists, rendered to JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=200)
+        parser.add_argument("--lines", type=int, default=5, help="Lines per order")
+        parser.add_argument("--page-size", type=int, default=100, help="Products per page")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        # The benchmark rows are rolled back at the end.
+        with transaction.atomic():
+            user = self.seed(options)
+            self.factory = APIRequestFactory()
+            self.user = user
+
+            orders = OrderViewSet.as_view({"get": "list"})
+            self.stdout.write(f"Order list: {options['orders']} orders of {options['lines']} lines")
+            self.report("nested (the view)", self.time(options, lambda: self.get(orders, "/api/orders/")))
+            self.report("nested, prefetched", self.time(options, self.prefetched_orders))
+            self.report("flat (view=compact)", self.time(options, lambda: self.get(orders, "/api/orders/?view=compact")))
+
+            products = ProductViewSet.as_view({"get": "list"})
+            url = f"/api/products/?page_size={options['page_size']}"
+            self.stdout.write(f"Product list: pages of {options['page_size']}")
+            self.report("nested (the view)", self.time(options, lambda: self.get(products, url)))
+            self.report("flat (view=compact)", self.time(options, lambda: self.get(products, url + "&view=compact")))
+            transaction.set_rollback(True)
+
+    def seed(self, options):
+        suffix = uuid.uuid4().hex[:12]
+        user = User.objects.create(username=f"bench-{suffix}", email=f"bench-{suffix}@example.com")
+        category = Category.objects.create(name=f"Bench {suffix}")
+        products = Product.objects.bulk_create(
+            Product(category=category, name=f"Bench product {i}", description="Benchmark product " * 10,
+                    price=Decimal("10.00") + i, stock=100)
+            for i in range(max(options["lines"], options["page_size"]))
+        )
+        orders = Order.objects.bulk_create(
+            Order(user=user, total_price=Decimal("50.00")) for _ in range(options["orders"])
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=products[i], quantity=1, price=products[i].price)
+            for order in orders for i in range(options["lines"])
+        )
+        return user
+
+    def get(self, view, url):
+        request = self.factory.get(url)
+        force_authenticate(request, self.user)
+        response = view(request)
+        response.render()
+        data = response.data
+        return len(data["results"] if isinstance(data, dict) else data)
+
+    def prefetched_orders(self):
+        queryset = Order.objects.prefetch_related("items__product__category")
+        data = OrderSerializer(queryset, many=True).data
+        JSONRenderer().render(data)
+        return len(data)
+
+    def time(self, options, run):
+        rows, elapsed = 0, 0.0
+        for _ in range(options["repeat"]):
+            # A cached catalog page would measure the cache, not the serializer
+            cache.clear()
+            start = time.perf_counter()
+            rows += run()
+            elapsed += time.perf_counter() - start
+        return rows, elapsed
+
+    def report(self, label, result):
+        rows, elapsed = result
+        self.stdout.write(self.style.SUCCESS(f"  {label:<22}{rows / elapsed:>10,.0f} rows/s  ({rows} rows, {elapsed:.2f} s)"))
@@ -0,0 +1,65 @@
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+
+from AAShop.models import Category, Product
+from AAShop.services import InsufficientStockError, reserve_stock
+
+
+class Command(BaseCommand):
+    help = "Hammer one product with concurrent stock reservations and check it is never oversold"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--attempts", type=int, default=100, help="Reservations per thread")
+        parser.add_argument("--stock", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        suffix = uuid.uuid4().hex[:12]
+        category = Category.objects.create(name=f"bench-{suffix}")
+        product = Product.objects.create(
+            category=category, name="Flash sale item", price=Decimal("1.00"), stock=options["stock"]
+        )
+        counts = {"reserved": 0, "rejected": 0, "errors": 0}
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                for _ in range(options["attempts"]):
+                    try:
+                        with transaction.atomic():
+                            reserve_stock({product.pk: 1})
+                        outcome = "reserved"
+                    except InsufficientStockError:
+                        outcome = "rejected"
+                    except DatabaseError:
+                        outcome = "errors"
+                    with lock:
+                        counts[outcome] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options["threads"])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        product.refresh_from_db()
+        category.delete()
+
+        attempts = options["threads"] * options["attempts"]
+        self.stdout.write(
+            f"{attempts} attempts in {elapsed:.2f}s ({attempts / elapsed:.0f}/s): "
+            f"{counts['reserved']} reserved, {counts['rejected']} rejected, "
+            f"{counts['errors']} database errors, {product.stock} left"
+        )
+        if counts["reserved"] + product.stock != options["stock"]:
+            raise CommandError("Stock drifted: reservations and remaining stock do not add up")
+        self.stdout.write(self.style.SUCCESS("No oversell"))
@@ -0,0 +1,136 @@
+import json
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+
+from AAKenyaShop.celery import app as celery_app
+from AAShop import metrics
+from AAShop.models import Category, Order, OrderItem, Payment, Product, User, WebhookEvent
+from AAShop.webhooks import process_events, sign
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire a storm of duplicate and out-of-order Chapa webhooks at the webhook endpoint, "
+        "drain them and check that every payment changed state exactly once"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--payments", type=int, default=500)
+        parser.add_argument("--duplicates", type=int, default=5, help="Deliveries of each event")
+        parser.add_argument("--failed-share", type=float, default=0.2, help="Share of payments that fail")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--seed", type=int, default=3)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        # The drain the view schedules runs inline, as a worker would run it
+        # alongside the storm; whatever it leaves is drained below. Everything
+        # is rolled back at the end.
+        celery_app.conf.update(CELERY_TASK_ALWAYS_EAGER=True)
+        with override_settings(
+            CHAPA_WEBHOOK_SECRET="bench-webhooks",
+            ALLOWED_HOSTS=["testserver"],
+        ), transaction.atomic():
+            product, payments = self.create_payments(options["payments"], rng, options["failed_share"])
+            stock_before = product.stock
+            transitions_before = self.transitions()
+
+            deliveries = []
+            for tx_ref, outcome in payments.items():
+                event = {"tx_ref": tx_ref, "status": outcome, "reference": f"CH-{tx_ref}"}
+                deliveries += [event] * options["duplicates"]
+                # Stale "pending" notifications, arriving before or after the outcome
+                deliveries += [{"tx_ref": tx_ref, "status": "pending", "reference": ""}] * 2
+            rng.shuffle(deliveries)
+
+            client = Client()
+            timings = []
+            start = time.perf_counter()
+            for payload in deliveries:
+                body = json.dumps(payload)
+                signature = sign(body.encode())
+                sent = time.perf_counter()
+                response = client.post(
+                    "/api/payments/webhook/", body, content_type="application/json", HTTP_CHAPA_SIGNATURE=signature
+                )
+                timings.append((time.perf_counter() - sent) * 1000)
+                if response.status_code != 200:
+                    raise CommandError(f"Webhook answered {response.status_code}: {response.content!r}")
+            ingest = time.perf_counter() - start
+
+            start = time.perf_counter()
+            processed = 0
+            while True:
+                handled = process_events(options["batch_size"])
+                if not handled:
+                    break
+                processed += handled
+            drain = time.perf_counter() - start
+
+            cuts = statistics.quantiles(timings, n=100)
+            self.stdout.write(
+                f"{len(deliveries)} deliveries for {len(payments)} payments: "
+                f"{len(deliveries) / ingest:.0f} webhooks/s, p50 {cuts[49]:.2f} ms, p99 {cuts[98]:.2f} ms"
+            )
+            self.stdout.write(
+                f"{WebhookEvent.objects.count()} distinct events stored; "
+                f"{processed} left for the final drain, applied in {drain * 1000:.1f} ms"
+            )
+            product.refresh_from_db()
+            transitions = {
+                status: count - transitions_before[status] for status, count in self.transitions().items()
+            }
+            self.check_invariants(payments, transitions, product.stock - stock_before)
+            transaction.set_rollback(True)
+
+    def create_payments(self, count, rng, failed_share):
+        category, _ = Category.objects.get_or_create(name="Webhook benchmark")
+        product = Product.objects.create(category=category, name="Webhook benchmark item", price=Decimal("10.00"), stock=0)
+        user = User.objects.create_user(username="bench-webhooks", email="bench-webhooks@example.com", password=None)
+        orders = Order.objects.bulk_create(
+            Order(user=user, status="PENDING", total_price=Decimal("10.00"), stock_reserved=True) for _ in range(count)
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, quantity=1, price=product.price) for order in orders
+        )
+        payments = {}
+        for order in orders:
+            payments[f"bench-wh-{order.pk}"] = "failed" if rng.random() < failed_share else "success"
+        Payment.objects.bulk_create(
+            Payment(order=order, tx_ref=f"bench-wh-{order.pk}", amount=order.total_price) for order in orders
+        )
+        return product, payments
+
+    def transitions(self):
+        return {
+            status: metrics.counter_value("webhook_payment_transitions_total", status=status)
+            for status in ("completed", "failed")
+        }
+
+    def check_invariants(self, payments, transitions, restocked):
+        expected_completed = sum(outcome == "success" for outcome in payments.values())
+        expected_failed = len(payments) - expected_completed
+        statuses = dict(
+            Payment.objects.filter(tx_ref__in=payments).values_list("tx_ref", "status")
+        )
+        wrong = [tx_ref for tx_ref, outcome in payments.items()
+                 if statuses[tx_ref] != ("completed" if outcome == "success" else "failed")]
+        problems = []
+        if wrong:
+            problems.append(f"{len(wrong)} payments ended in the wrong state")
+        if transitions != {"completed": expected_completed, "failed": expected_failed}:
+            problems.append(f"{transitions} state changes for {expected_completed} completed "
+                            f"and {expected_failed} failed payments")
+        if restocked != expected_failed:
+            problems.append(f"stock released {restocked} times for {expected_failed} failed payments")
+        if problems:
+            raise CommandError("; ".join(problems))
+        self.stdout.write(self.style.SUCCESS(
+            f"{expected_completed} completed and {expected_failed} failed, each applied exactly once"
+        ))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from AAShop import carts
+from AAShop.models import Cart
+
+
+class Command(BaseCommand):
+    help = "Recompute cart item counts and totals from their lines and report the carts that drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="Overwrite drifted carts with the recomputed values")
+        parser.add_argument("--show", type=int, default=20, help="How many drifted carts to list")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        checked = Cart.objects.count()
+        drifted, count_drift, total_drift = [], 0, 0
+        rows = carts.drifted_carts().values_list("pk", "user_id", "item_count", "actual_count", "total", "actual_total")
+        for cart_id, user_id, item_count, actual_count, total, actual_total in rows.iterator(options["chunk_size"]):
+            drifted.append(cart_id)
+            count_drift += abs(item_count - actual_count)
+            total_drift += abs(total - actual_total)
+            if len(drifted) <= options["show"]:
+                self.stdout.write(
+                    f"cart {cart_id} (user {user_id}): item_count {item_count} != {actual_count}, "
+                    f"total {total} != {actual_total}"
+                )
+
+        self.stdout.write(
+            f"Checked {checked:,} carts: {len(drifted):,} drifted "
+            f"(item counts off by {count_drift:,}, totals off by {total_drift:,.2f})"
+        )
+        if not drifted:
+            return
+        if not options["fix"]:
+            raise CommandError("Cart totals drifted; run again with --fix to recompute them")
+        fixed = 0
+        for start in range(0, len(drifted), options["chunk_size"]):
+            fixed += carts.recalculate_totals(Cart.objects.filter(pk__in=drifted[start:start + options["chunk_size"]]))
+        self.stdout.write(self.style.SUCCESS(f"Recomputed {fixed:,} carts"))
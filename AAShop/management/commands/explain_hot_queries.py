@@ -0,0 +1,66 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from AAShop.models import Order, Payment, Product, User
+
+SQLITE_FULL_SCAN = re.compile(r"\bSCAN \S+\s*$", re.MULTILINE)
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the shop's hot queries and fail if any of them falls back to a full table scan"
+
+    def hot_queries(self):
+        user_id = User.objects.values_list("pk", flat=True).first() or 0
+        order_id = Order.objects.values_list("pk", flat=True).first() or 0
+        return {
+            "latest pending order (initiate_payment)":
+                Order.objects.filter(user_id=user_id, status="PENDING").order_by("-id")[:1],
+            "order history":
+                Order.objects.filter(user_id=user_id).order_by("-created_at")[:20],
+            "catalog page":
+                Product.objects.select_related("category").order_by("-created_at", "-id")[:20],
+            "payments of an order":
+                Payment.objects.filter(order_id=order_id, status="completed"),
+            "pending payments batch (reconciliation)":
+                Payment.objects.filter(status="pending", id__gt=0, created_at__lte=timezone.now())
+                .order_by("id")[:500],
+            "orders changed since the watermark (sales rollups)":
+                Order.objects.filter(updated_at__gt=timezone.now()).values_list("created_at", flat=True),
+        }
+
+    def handle(self, *args, **options):
+        failures = []
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                # Small tables are cheaper to scan than to index, so the
+                # planner would pick a Seq Scan on fresh data. With seqscan
+                # disabled it still falls back to one when no index fits,
+                # which is exactly the regression this command looks for.
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+
+            for name, queryset in self.hot_queries().items():
+                plan = self.explain(queryset)
+                scans = self.full_scans(plan)
+                status = self.style.ERROR("SEQ SCAN") if scans else self.style.SUCCESS("indexed")
+                self.stdout.write(f"{status}  {name}")
+                if options["verbosity"] > 1 or scans:
+                    self.stdout.write(plan)
+                if scans:
+                    failures.append(name)
+
+        if failures:
+            raise CommandError(f"Hot queries regressed to sequential scans: {', '.join(failures)}")
+
+    def explain(self, queryset):
+        if connection.vendor == "postgresql":
+            return queryset.explain(analyze=True)
+        return queryset.explain()
+
+    def full_scans(self, plan):
+        if connection.vendor == "postgresql":
+            return "Seq Scan" in plan
+        return bool(SQLITE_FULL_SCAN.search(plan))
@@ -0,0 +1,51 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from AAShop import exports
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class Command(BaseCommand):
+    help = "Stream order lines as CSV or NDJSON and report the export rate"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=list(exports.FORMATS), default="csv", dest="export_format")
+        parser.add_argument("--start", help="ISO date or datetime")
+        parser.add_argument("--end", help="ISO date (inclusive) or datetime")
+        parser.add_argument("--status", help="Comma-separated order statuses")
+        parser.add_argument("--output", default="-", help="File to write, - for stdout")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Rows fetched from the cursor at a time")
+
+    def handle(self, *args, **options):
+        try:
+            filters = exports.parse_filters(options["start"], options["end"], options["status"])
+        except exports.ExportFilterError as exc:
+            raise CommandError(exc)
+
+        stats = {}
+        chunks = exports.export(options["export_format"], chunk_size=options["chunk_size"], stats=stats, **filters)
+        if options["output"] == "-":
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            # Keep the report out of the exported data
+            report = self.stderr
+        else:
+            with open(options["output"], "w", newline="", encoding="utf-8") as output:
+                output.writelines(chunks)
+            report = self.stdout
+
+        rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0
+        message = (
+            f"Exported {stats['rows']:,} order lines of {stats['orders']:,} orders "
+            f"in {stats['seconds']:.1f}s: {rate:,.0f} rows/s"
+        )
+        if resource is not None:
+            # ru_maxrss is in KiB on Linux and bytes on macOS
+            scale = 1 if sys.platform == "darwin" else 1024
+            message += f", peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20:.0f} MiB"
+        report.write(self.style.SUCCESS(message))
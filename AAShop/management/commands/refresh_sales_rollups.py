@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from AAShop.analytics import refresh_sales_rollups
+from AAShop.models import DailyCategorySales, DailyProductSales, DailySales
+
+
+class Command(BaseCommand):
+    help = "Refresh the daily sales rollups behind /api/analytics/"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Drop the rollups and rebuild them from every order")
+        parser.add_argument("--span", type=int, default=31, help="Most consecutive days recomputed per query")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        days = refresh_sales_rollups(full=options["full"], span=options["span"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Recomputed {days:,} days in {time.perf_counter() - start:.2f}s: "
+            f"{DailySales.objects.count():,} daily, {DailyCategorySales.objects.count():,} category "
+            f"and {DailyProductSales.objects.count():,} product rollups"
+        ))
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from AAKenyaShop.celery import app as celery_app
+
+
+def worker_argv(profile, overrides=None):
+    """The ``celery worker`` arguments for a profile of CELERY_WORKER_PROFILES."""
+    options = {**settings.CELERY_WORKER_PROFILES[profile], **(overrides or {})}
+    return [
+        "worker",
+        "--hostname", f"{profile}@%h",
+        "--queues", ",".join(options["queues"]),
+        "--concurrency", str(options["concurrency"]),
+        "--prefetch-multiplier", str(options["prefetch_multiplier"]),
+        # Hand tasks to child processes as they free up, not round robin,
+        # so one slow task does not hold back the ones queued behind it
+        "-O", "fair",
+        "--loglevel", options.get("loglevel", "INFO"),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Run a Celery worker for one of the CELERY_WORKER_PROFILES (payments, email, bulk or all)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("profile", choices=sorted(settings.CELERY_WORKER_PROFILES))
+        parser.add_argument("--concurrency", type=int, help="Override the profile's concurrency")
+        parser.add_argument("--loglevel", default="INFO")
+        parser.add_argument("--print", action="store_true", help="Print the celery command line and exit")
+
+    def handle(self, *args, **options):
+        overrides = {"loglevel": options["loglevel"]}
+        if options["concurrency"]:
+            overrides["concurrency"] = options["concurrency"]
+        argv = worker_argv(options["profile"], overrides)
+        if options["print"]:
+            self.stdout.write("celery -A AAKenyaShop " + " ".join(argv))
+            return
+        celery_app.worker_main(argv)
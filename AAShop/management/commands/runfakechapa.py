@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from AAShop.chapa_stub import FakeChapaServer
+
+
+class Command(BaseCommand):
+    help = "Run a local fake Chapa gateway (point CHAPA_BASE_URL at it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each answer")
+        parser.add_argument("--outcome", default="success", help="Status reported by verify")
+
+    def handle(self, *args, **options):
+        server = FakeChapaServer(
+            options["host"], options["port"], latency=options["latency"], default_outcome=options["outcome"]
+        )
+        self.stdout.write(f"Fake Chapa listening on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
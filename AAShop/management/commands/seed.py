@@ -1,13 +1,112 @@
-from django.core.management.base import BaseCommand
+import bisect
+import contextlib
+import csv
+import io
+import itertools
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
-from AAShop.models import Category, Product
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+from AAShop.models import Category, Product, Cart, CartItem, Order, OrderItem, Payment
 
 User = get_user_model()
 
+SEED_EMAIL_DOMAIN = "seed.aakenyashop.test"
+
+# Rows generated at --scale 1
+SCALE_PROFILE = {"users": 50_000, "products": 20_000, "orders": 1_000_000, "carts": 10_000}
+
+# Relative order volume per month (Jan..Dec): holiday peak, mid-year lull
+MONTH_WEIGHTS = [0.8, 0.75, 0.85, 0.9, 0.95, 0.8, 0.75, 0.85, 0.95, 1.0, 1.4, 1.9]
+# Relative order volume per hour of day: evening peak, quiet nights
+HOUR_WEIGHTS = [0.2, 0.1, 0.1, 0.1, 0.1, 0.2, 0.4, 0.7, 0.9, 1.0, 1.0, 1.1,
+                1.3, 1.2, 1.0, 1.0, 1.1, 1.3, 1.6, 1.9, 2.0, 1.7, 1.1, 0.5]
+MAX_TIME_WEIGHT = max(MONTH_WEIGHTS) * max(HOUR_WEIGHTS)
+
+ORDER_STATUSES = [("PAID", 0.55), ("SHIPPED", 0.25), ("PENDING", 0.12), ("CANCELLED", 0.08)]
+PAYMENT_STATUS = {"PAID": "completed", "SHIPPED": "completed", "PENDING": "pending", "CANCELLED": "failed"}
+
+WORDS = (
+    "serenity reflection recovery daily meditation journal book guide prayer step "
+    "tradition fellowship coffee mug shirt poster sticker keychain edition classic "
+    "pocket large print audio hardcover paperback gift bundle set notebook pen"
+).split()
+
+
+@contextlib.contextmanager
+def historical_timestamps(*models):
+    """Let bulk_create keep the created_at/updated_at values we generate."""
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def insert_rows(model, objs):
+    """Insert rows whose ids we never need back.
+
+    On PostgreSQL this streams them through COPY, several times faster than
+    INSERT for the millions of order lines and payments; elsewhere it is a
+    plain bulk_create.
+    """
+    if connection.vendor != "postgresql":
+        model.objects.bulk_create(objs)
+        return
+
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for obj in objs:
+        row = [field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields]
+        writer.writerow(r"\N" if value is None else value for value in row)
+    buffer.seek(0)
+
+    quote = connection.ops.quote_name
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(
+        quote(model._meta.db_table), ", ".join(quote(field.column) for field in fields)
+    )
+    with connection.cursor() as cursor:
+        raw = cursor.cursor
+        if hasattr(raw, "copy_expert"):  # psycopg2
+            raw.copy_expert(sql, buffer)
+        else:  # psycopg 3
+            with raw.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+
+
 class Command(BaseCommand):
-    help = "Seed database with initial data"
+    help = "Seed database with initial data, or with a large synthetic dataset (--scale)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scale", type=float,
+            help="Generate a synthetic dataset; 1.0 means %s" % ", ".join(
+                f"{count:,} {name}" for name, count in SCALE_PROFILE.items()
+            ),
+        )
+        for name in SCALE_PROFILE:
+            parser.add_argument(f"--{name}", type=int, help=f"Override the number of {name}")
+        parser.add_argument("--seed", type=int, default=1, help="Random seed; same seed, same data")
+        parser.add_argument("--batch-size", type=int, default=5000)
 
     def handle(self, *args, **kwargs):
+        if kwargs["scale"] is not None:
+            return self.seed_scale(kwargs)
+
         # Create superuser if not exists
         if not User.objects.filter(username="admin").exists():
             User.objects.create_superuser("admin", "admin@gmail.com", "admin123")
@@ -40,3 +139,176 @@ class Command(BaseCommand):
                 }
             )
         self.stdout.write(self.style.SUCCESS("Products seeded"))
+
+    # Synthetic dataset
+
+    def seed_scale(self, options):
+        if User.objects.filter(email__endswith=f"@{SEED_EMAIL_DOMAIN}").exists():
+            raise CommandError("A synthetic dataset is already loaded; flush the database first")
+
+        counts = {
+            name: options[name] if options[name] is not None else int(base * options["scale"])
+            for name, base in SCALE_PROFILE.items()
+        }
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        # Anchor timestamps to midnight so a seed reproduces the same data all day
+        self.now = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.started = time.perf_counter()
+
+        with historical_timestamps(User, Category, Product, Cart, Order, Payment):
+            user_ids = self.create_users(counts["users"])
+            products = self.create_products(counts["products"])
+            self.create_carts(user_ids, products, min(counts["carts"], len(user_ids)))
+            self.create_orders(user_ids, products, counts["orders"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Synthetic dataset ready in {time.perf_counter() - self.started:.1f}s"
+        ))
+
+    def progress(self, label, done, total):
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(f"  {label}: {done:,}/{total:,} ({elapsed:.1f}s)")
+
+    def batches(self, total):
+        for start in range(0, total, self.batch_size):
+            yield start, min(self.batch_size, total - start)
+
+    def random_past(self, days=365):
+        """A timestamp within the last ``days`` following the seasonal weights."""
+        while True:
+            moment = self.now - timedelta(seconds=self.rng.randrange(days * 86400))
+            weight = MONTH_WEIGHTS[moment.month - 1] * HOUR_WEIGHTS[moment.hour]
+            if self.rng.random() * MAX_TIME_WEIGHT < weight:
+                return moment
+
+    def create_users(self, total):
+        password = make_password(None)
+        user_ids = []
+        for start, size in self.batches(total):
+            users = User.objects.bulk_create(
+                User(
+                    username=f"seed{i}",
+                    email=f"user{i}@{SEED_EMAIL_DOMAIN}",
+                    first_name=self.rng.choice(("Abebe", "Wanjiru", "Otieno", "Amina", "Kamau", "Achieng")),
+                    last_name=self.rng.choice(("Mwangi", "Odhiambo", "Kiptoo", "Tadesse", "Njeri", "Mutua")),
+                    password=password,
+                    date_joined=self.random_past(days=730),
+                )
+                for i in range(start, start + size)
+            )
+            user_ids.extend(user.pk for user in users)
+        self.progress("users", len(user_ids), total)
+        return user_ids
+
+    def create_products(self, total):
+        categories = Category.objects.bulk_create(
+            Category(name=f"Seed category {i}", created_at=self.now, updated_at=self.now) for i in range(20)
+        )
+        products = []
+        for start, size in self.batches(total):
+            batch = []
+            for i in range(start, start + size):
+                created = self.random_past(days=730)
+                batch.append(Product(
+                    category=self.rng.choice(categories),
+                    name=f"{' '.join(self.rng.sample(WORDS, 3)).title()} #{i}",
+                    description=" ".join(self.rng.choices(WORDS, k=20)),
+                    price=Decimal(self.rng.randint(100, 10_000)),
+                    stock=self.rng.randint(0, 500),
+                    created_at=created,
+                    updated_at=created,
+                ))
+            products.extend((product.pk, product.price) for product in Product.objects.bulk_create(batch))
+        self.progress("products", len(products), total)
+
+        # Power-law popularity: the product at rank r is picked with weight
+        # 1 / r^1.1, so a few best sellers dominate and the tail is long.
+        self.rng.shuffle(products)
+        self.popularity = list(itertools.accumulate(1 / rank ** 1.1 for rank in range(1, len(products) + 1)))
+        return products
+
+    def pick_products(self, products, count):
+        picked = {}
+        while len(picked) < count:
+            index = bisect.bisect(self.popularity, self.rng.random() * self.popularity[-1])
+            product_id, price = products[min(index, len(products) - 1)]
+            picked[product_id] = price
+        return picked.items()
+
+    def line_count(self, products, mean=2.5):
+        # Geometric number of lines: most baskets are small
+        count = 1
+        while count < min(20, len(products)) and self.rng.random() > 1 / mean:
+            count += 1
+        return count
+
+    def create_carts(self, user_ids, products, total):
+        owners = self.rng.sample(user_ids, total)
+        for start, size in self.batches(total):
+            carts = [
+                Cart(user_id=user_id, created_at=self.random_past(days=30))
+                for user_id in owners[start:start + size]
+            ]
+            baskets = [
+                [
+                    (product_id, price, self.rng.randint(1, 3))
+                    for product_id, price in self.pick_products(products, self.line_count(products))
+                ]
+                for _ in carts
+            ]
+            for cart, basket in zip(carts, baskets):
+                cart.item_count = sum(quantity for _, _, quantity in basket)
+                cart.total = sum(price * quantity for _, price, quantity in basket)
+            with transaction.atomic():
+                Cart.objects.bulk_create(carts)
+                insert_rows(CartItem, [
+                    CartItem(cart=cart, product_id=product_id, quantity=quantity)
+                    for cart, basket in zip(carts, baskets)
+                    for product_id, _, quantity in basket
+                ])
+        self.progress("carts", total, total)
+
+    def create_orders(self, user_ids, products, total):
+        statuses, weights = zip(*ORDER_STATUSES)
+        for start, size in self.batches(total):
+            orders, lines = [], []
+            for _ in range(size):
+                created = self.random_past()
+                status = self.rng.choices(statuses, weights)[0]
+                items = [
+                    (product_id, price, 1 if self.rng.random() < 0.8 else self.rng.randint(2, 4))
+                    for product_id, price in self.pick_products(products, self.line_count(products))
+                ]
+                lines.append(items)
+                orders.append(Order(
+                    user_id=self.rng.choice(user_ids),
+                    status=status,
+                    total_price=sum(price * quantity for _, price, quantity in items),
+                    created_at=created,
+                    updated_at=created + timedelta(minutes=self.rng.randint(0, 4320)),
+                ))
+
+            with transaction.atomic():
+                orders = Order.objects.bulk_create(orders)
+                insert_rows(OrderItem, [
+                    OrderItem(order=order, product_id=product_id, quantity=quantity, price=price)
+                    for order, items in zip(orders, lines)
+                    for product_id, price, quantity in items
+                ])
+                insert_rows(Payment, [
+                    Payment(
+                        order=order,
+                        tx_ref=f"seed-{order.pk}",
+                        amount=order.total_price,
+                        status=PAYMENT_STATUS[order.status],
+                        transaction_id=f"CH-SEED-{order.pk}" if order.status in ("PAID", "SHIPPED") else None,
+                        created_at=order.created_at,
+                        updated_at=order.updated_at,
+                    )
+                    # Some pending orders were abandoned before reaching Chapa
+                    for order in orders
+                    if order.status != "PENDING" or self.rng.random() < 0.6
+                ])
+            if (start // self.batch_size) % 20 == 0 or start + size == total:
+                self.progress("orders", start + size, total)
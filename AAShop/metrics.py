@@ -0,0 +1,106 @@
+"""In-process metrics, rendered in the Prometheus text format at /metrics/.
+
+Values are per process; with several gunicorn workers each worker reports
+its own numbers and the scraper sums them.
+"""
+import threading
+from collections import defaultdict
+
+# Upper bounds, in seconds, for latency histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {}
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def increment(name, amount=1, **labels):
+    with _lock:
+        _counters[(name, _labels(labels))] += amount
+
+
+def counter_value(name, **labels):
+    return _counters.get((name, _labels(labels)), 0)
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[(name, _labels(labels))] = value
+
+
+def gauge_value(name, **labels):
+    return _gauges.get((name, _labels(labels)))
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """Record ``value`` in the histogram ``name``.
+
+    The buckets of a series are fixed by its first observation.
+    """
+    key = (name, _labels(labels))
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = {"buckets": tuple(buckets), "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for index, bound in enumerate(series["buckets"]):
+            if value <= bound:
+                series["counts"][index] += 1
+                break
+        series["sum"] += value
+        series["count"] += 1
+
+
+def histogram_count(name, **labels):
+    series = _histograms.get((name, _labels(labels)))
+    return series["count"] if series else 0
+
+
+def _number(value):
+    # Every digit: "%g" would turn a counter at 1234567 into 1.23457e+06
+    if isinstance(value, int) or (isinstance(value, float) and value.is_integer()):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format(name, labels, value):
+    if labels:
+        name += "{" + ",".join(f'{key}="{val}"' for key, val in labels) + "}"
+    return f"{name} {_number(value)}"
+
+
+def render():
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted(
+            (key, dict(series, counts=list(series["counts"]))) for key, series in _histograms.items()
+        )
+    lines = []
+    seen = set()
+    for (name, labels), value in counters:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(_format(name, labels, value))
+    for (name, labels), value in gauges:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} gauge")
+        lines.append(_format(name, labels, value))
+    for (name, labels), series in histograms:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, count in zip(series["buckets"], series["counts"]):
+            cumulative += count
+            lines.append(_format(f"{name}_bucket", labels + (("le", f"{bound:g}"),), cumulative))
+        lines.append(_format(f"{name}_bucket", labels + (("le", "+Inf"),), series["count"]))
+        lines.append(_format(f"{name}_sum", labels, series["sum"]))
+        lines.append(_format(f"{name}_count", labels, series["count"]))
+    return "\n".join(lines) + "\n"
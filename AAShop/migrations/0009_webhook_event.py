@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AAShop', '0008_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tx_ref', models.CharField(max_length=100)),
+                ('event_id', models.CharField(max_length=100)),
+                ('status', models.CharField(blank=True, max_length=20)),
+                ('reference', models.CharField(blank=True, max_length=200)),
+                ('payload', models.JSONField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='webhook_event_unprocessed_idx')],
+                'constraints': [models.UniqueConstraint(fields=('tx_ref', 'event_id'), name='webhook_event_unique')],
+            },
+        ),
+    ]
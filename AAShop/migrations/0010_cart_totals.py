@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:10
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Cart = apps.get_model("AAShop", "Cart")
+    CartItem = apps.get_model("AAShop", "CartItem")
+    money = models.DecimalField(max_digits=12, decimal_places=2)
+    lines = CartItem.objects.filter(cart=models.OuterRef("pk")).order_by().values("cart")
+    count = lines.annotate(count=models.Sum("quantity")).values("count")
+    total = lines.annotate(
+        total=models.Sum(models.F("quantity") * models.F("product__price"), output_field=money)
+    ).values("total")
+    Cart.objects.update(
+        item_count=Coalesce(models.Subquery(count), 0),
+        total=Coalesce(models.Subquery(total), models.Value(0), output_field=money),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AAShop', '0009_webhook_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 21:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AAShop', '0014_order_stock_reserved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='refund_due',
+            field=models.BooleanField(default=False),
+        ),
+    ]
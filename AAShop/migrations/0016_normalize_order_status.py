@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 21:17
+
+from django.db import migrations
+from django.db.models.functions import Now
+
+
+def uppercase_statuses(apps, schema_editor):
+    # The original checkout created orders as "pending", which no order
+    # transition (nor initiate_payment) matches.
+    Order = apps.get_model("AAShop", "Order")
+    for status in ("PENDING", "PAID", "SHIPPED", "CANCELLED"):
+        # updated_at moves so the sales rollups pick the orders up again
+        Order.objects.filter(status=status.lower()).update(status=status, updated_at=Now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('AAShop', '0015_payment_refund_due'),
+    ]
+
+    operations = [
+        migrations.RunPython(uppercase_statuses, migrations.RunPython.noop),
+    ]
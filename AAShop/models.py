@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
 
 
 class User(AbstractUser):
@@ -33,10 +36,19 @@ class Product(models.Model):
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
+    # Maintained by a database trigger on PostgreSQL (see migration 0007)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"], name="product_search_vector_gin"),
+            # Catalog listing / cursor pagination order
+            models.Index(fields=["-created_at", "-id"], name="product_created_idx"),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -52,10 +64,29 @@ class Order(models.Model):
     user = models.ForeignKey(User, related_name="orders", on_delete=models.CASCADE)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="PENDING")
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Whether the order holds stock taken at checkout; orders placed before
+    # checkout reserved stock never did, so cancelling them gives none back.
+    stock_reserved = models.BooleanField(default=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # A user's order history, newest first
+            models.Index(fields=["user", "-created_at"], name="order_user_created_idx"),
+            # initiate_payment: latest PENDING order of a user
+            models.Index(
+                fields=["user", "-id"],
+                condition=models.Q(status="PENDING"),
+                name="order_pending_user_idx",
+            ),
+            # Sales rollups: orders changed since the watermark, and the
+            # orders placed on the days being recomputed
+            models.Index(fields=["updated_at"], name="order_updated_idx"),
+            models.Index(fields=["created_at"], name="order_created_idx"),
+        ]
+
     def __str__(self):
         return f"Order {self.id} - {self.user.email}"
 
@@ -71,24 +102,80 @@ class OrderItem(models.Model):
 
 
 class Payment(models.Model):
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("completed", "Completed"),
+        ("failed", "Failed"),
+    ]
+
     order = models.ForeignKey(
         "Order", on_delete=models.CASCADE, related_name="payments", null=True, blank=True
     )
     tx_ref = models.CharField(max_length=100, unique=True)  
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=10, default="ETB")  
-    status = models.CharField(max_length=20, default="pending") 
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
     transaction_id = models.CharField(max_length=200, blank=True, null=True)
+    checkout_url = models.URLField(max_length=500, blank=True)
+    # Completed for an order that was cancelled, or already paid through
+    # another payment, by then: the money has to go back to the customer.
+    refund_due = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Payments of an order by outcome (order_id alone is already
+            # indexed as a foreign key)
+            models.Index(fields=["order", "status"], name="payment_order_status_idx"),
+            # Reconciliation walks pending payments in id order
+            models.Index(
+                fields=["id"],
+                condition=models.Q(status="pending"),
+                name="payment_pending_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.tx_ref} - {self.status}"
+
+
+class WebhookEvent(models.Model):
+    """A Chapa webhook delivery, stored as received and applied later in batches."""
+    tx_ref = models.CharField(max_length=100)
+    # Chapa's event id when it sends one, else a hash of the payload, so a
+    # redelivered event lands on the same row
+    event_id = models.CharField(max_length=100)
+    status = models.CharField(max_length=20, blank=True)
+    reference = models.CharField(max_length=200, blank=True)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tx_ref", "event_id"], name="webhook_event_unique"),
+        ]
+        indexes = [
+            # The worker drains unprocessed events in arrival order
+            models.Index(
+                fields=["id"],
+                condition=models.Q(processed_at__isnull=True),
+                name="webhook_event_unprocessed_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.tx_ref} {self.status} ({self.event_id})"
     
 
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="cart")
     created_at = models.DateTimeField(auto_now_add=True)
+    # Kept in step with the lines by the cart backends (see carts.py);
+    # check_cart_totals recomputes them and reports drift.
+    item_count = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
     def __str__(self):
         return f"Cart of {self.user}"
@@ -108,3 +195,94 @@ class CartItem(models.Model):
     @property
     def subtotal(self):
         return self.quantity * self.product.price
+
+
+class SalesRollup(models.Model):
+    """Paid sales of one day, precomputed by analytics.refresh_sales_rollups."""
+    day = models.DateField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.PositiveIntegerField(default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class DailySales(SalesRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["day"], name="daily_sales_unique"),
+        ]
+
+
+class DailyCategorySales(SalesRollup):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="+")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["category", "day"], name="daily_category_sales_unique"),
+        ]
+        indexes = [models.Index(fields=["day"], name="daily_category_sales_day_idx")]
+
+
+class DailyProductSales(SalesRollup):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "day"], name="daily_product_sales_unique"),
+        ]
+        indexes = [models.Index(fields=["day"], name="daily_product_sales_day_idx")]
+
+
+class RefreshWatermark(models.Model):
+    """How far a background refresh has got, e.g. through Order.updated_at.
+
+    Also used as a lease: the value is then when the current holder's ends.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
+
+
+class EmailOutbox(models.Model):
+    """A transactional email, written with the change it reports and sent later in batches."""
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, related_name="emails", null=True, blank=True)
+    # What the email is about, e.g. "payment_completed": one email per order and event
+    event = models.CharField(max_length=50)
+    # Key of settings.EMAIL_PROVIDERS the email goes out through
+    provider = models.CharField(max_length=50, default="default")
+    to = models.EmailField()
+    from_email = models.CharField(max_length=200)
+    subject = models.CharField(max_length=200)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["order", "event"], name="email_outbox_order_event_unique"),
+        ]
+        indexes = [
+            # The worker drains due emails of a provider, oldest first
+            models.Index(
+                fields=["provider", "next_attempt_at"],
+                condition=models.Q(status="pending"),
+                name="email_outbox_due_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event} to {self.to} ({self.status})"
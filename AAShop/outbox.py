@@ -0,0 +1,168 @@
+"""Transactional email outbox.
+
+Emails are written to EmailOutbox in the same transaction as the change
+they report, so one goes out only if the change committed, and the
+(order, event) unique constraint turns queueing the same email twice into
+a no-op. A Celery task sends due emails in batches: a batch is claimed
+with SKIP LOCKED and leased for LEASE seconds (a worker that dies
+mid-batch leaves it to be picked up again), then sent over a single
+connection of its provider instead of one SMTP connection per email.
+
+Each provider in settings.EMAIL_PROVIDERS is held to its RATE_LIMIT
+through a per-window counter in the default cache. The counter is only
+shared by every worker when that cache is (Redis, via CACHE_URL), so a
+rate-limited provider will not drain on a per-process cache unless DEBUG
+is on. A failed email is retried with exponential backoff and given up ("failed")
+after EMAIL_OUTBOX_MAX_ATTEMPTS attempts.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import EmailOutbox
+
+# Seconds a claimed batch stays hidden from other workers
+LEASE = 5 * 60
+
+
+def payment_confirmation(order_id, email, amount):
+    return EmailOutbox(
+        order_id=order_id,
+        event="payment_completed",
+        to=email,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        subject="Payment Confirmation",
+        body=f"Your payment for Order #{order_id} of {amount} ETB has been marked as completed.",
+    )
+
+
+def enqueue(emails):
+    """Queue unsaved EmailOutbox rows and have them sent once the transaction commits.
+
+    An email already queued for the same order and event is dropped.
+    """
+    emails = list(emails)
+    if not emails:
+        return
+    EmailOutbox.objects.bulk_create(emails, ignore_conflicts=True)
+    transaction.on_commit(schedule_drain)
+
+
+def schedule_drain():
+    # At most one drain a second; emails queued meanwhile go out in its batch.
+    # On a per-process cache that holds per process only: extra drains just
+    # find nothing left to claim.
+    if cache.add("email-outbox:drain-scheduled", 1, timeout=1):
+        # Imported here: tasks imports this module.
+        from .tasks import send_outbox_emails
+
+        send_outbox_emails.apply_async(countdown=1)
+
+
+def _check_rate_limit(provider, rate):
+    if rate and isinstance(caches["default"], (LocMemCache, DummyCache)) and not settings.DEBUG:
+        # Each worker would keep its own count and send at the full rate.
+        raise ImproperlyConfigured(
+            f"Email provider {provider!r} has a RATE_LIMIT, which needs a cache shared by "
+            "all workers; set CACHE_URL."
+        )
+
+
+def throttle(provider, rate):
+    """Wait until ``provider`` may send one more message at ``rate`` messages a second.
+
+    The count is kept in the default cache and is only as shared as it is.
+    """
+    if not rate:
+        return
+    # Windows of at least a second, so rates below 1/s work too
+    period = max(1.0, 1 / rate)
+    allowance = round(rate * period)
+    while True:
+        now = time.time()
+        window = int(now // period)
+        key = f"email-outbox:rate:{provider}:{window}"
+        cache.add(key, 0, timeout=int(period) + 1)
+        try:
+            if cache.incr(key) <= allowance:
+                return
+        except ValueError:  # the window expired between add() and incr()
+            continue
+        time.sleep((window + 1) * period - now)
+
+
+def _retry(email, error, now):
+    email.attempts += 1
+    email.last_error = f"{type(error).__name__}: {error}"[:2000]
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = "failed"
+    else:
+        email.next_attempt_at = now + timedelta(
+            seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1)
+        )
+
+
+def drain(provider="default", batch_size=None):
+    """Send one batch of ``provider``'s due emails; return how many were claimed."""
+    config = settings.EMAIL_PROVIDERS[provider]
+    _check_rate_limit(provider, config["RATE_LIMIT"])
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status="pending", provider=provider, next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        if not emails:
+            return 0
+        EmailOutbox.objects.filter(pk__in=[email.pk for email in emails]).update(
+            next_attempt_at=now + timedelta(seconds=LEASE)
+        )
+
+    start = time.perf_counter()
+    sent, failed = [], []
+    connection = get_connection(config["BACKEND"], **config["OPTIONS"])
+    try:
+        for position, email in enumerate(emails):
+            try:
+                connection.open()  # a no-op while the connection is up
+            except Exception as exc:
+                # The provider is unreachable: the rest of the batch waits
+                # for its retry instead of each timing out in turn.
+                failed += [(rest, exc) for rest in emails[position:]]
+                break
+            throttle(provider, config["RATE_LIMIT"])
+            message = EmailMessage(email.subject, email.body, email.from_email, [email.to])
+            try:
+                connection.send_messages([message])
+            except Exception as exc:
+                failed.append((email, exc))
+                # Start the next message on a fresh connection
+                connection.close()
+            else:
+                sent.append(email.pk)
+    finally:
+        connection.close()
+
+    now = timezone.now()
+    EmailOutbox.objects.filter(pk__in=sent).update(status="sent", sent_at=now, last_error="")
+    for email, exc in failed:
+        _retry(email, exc, now)
+    EmailOutbox.objects.bulk_update(
+        [email for email, _ in failed], ["status", "attempts", "last_error", "next_attempt_at"]
+    )
+
+    metrics.increment("emails_sent_total", len(sent), provider=provider)
+    metrics.increment("email_send_failures_total", len(failed), provider=provider)
+    metrics.observe("email_batch_seconds", time.perf_counter() - start, buckets=(0.1, 1, 10, 60, 300))
+    return len(emails)
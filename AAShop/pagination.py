@@ -0,0 +1,18 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class ProductCursorPagination(CursorPagination):
+    # Keyset pagination: each page is a "WHERE created_at < cursor" range
+    # scan instead of an OFFSET, so page N costs the same as page 1.
+    # id breaks ties between products created in the same instant.
+    ordering = ("-created_at", "-id")
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class SearchResultsPagination(PageNumberPagination):
+    # Search results are ordered by rank, which a cursor cannot seek on.
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
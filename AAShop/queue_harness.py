@@ -0,0 +1,85 @@
+"""Run Celery for real, in one process, for tests and queueing benchmarks.
+
+``in_memory_broker()`` points the app at kombu's in-process memory
+transport with eager mode off, so tasks are actually published to their
+routed queues; ``profile_worker()`` starts a worker thread consuming the
+queues of a CELERY_WORKER_PROFILES profile, as ``run_worker`` would.
+
+Harness workers prefetch without limit: over the memory transport a
+worker applies acks only between two-second polls, so a prefetch limit
+would stall it rather than pace it. Prefetch settings therefore only show
+against the real broker.
+"""
+from contextlib import contextmanager
+
+from celery.contrib.testing.worker import start_worker
+from django.conf import settings
+
+from AAKenyaShop.celery import app as celery_app
+
+# The app reads Django settings under the CELERY_ namespace, so its
+# configuration keys keep the prefix.
+OVERRIDDEN = (
+    "CELERY_BROKER_URL", "CELERY_RESULT_BACKEND", "CELERY_TASK_ALWAYS_EAGER", "CELERY_BROKER_TRANSPORT_OPTIONS",
+)
+
+
+@contextmanager
+def in_memory_broker():
+    saved = {key: celery_app.conf.get(key) for key in OVERRIDDEN}
+    _drop_pools()
+    celery_app.conf.update(
+        CELERY_BROKER_URL="memory://",
+        CELERY_RESULT_BACKEND="cache+memory://",
+        CELERY_TASK_ALWAYS_EAGER=False,
+        # The memory transport is polled; the default second would dominate
+        CELERY_BROKER_TRANSPORT_OPTIONS={"polling_interval": 0.01},
+    )
+    try:
+        with celery_app.connection_for_write() as connection:
+            channel = connection.default_channel
+            for queue in queue_names():
+                channel.queue_purge(queue)
+        yield celery_app
+    finally:
+        _drop_pools()
+        celery_app.conf.update(saved)
+
+
+def _drop_pools():
+    # Broker connections and producers are pooled for the broker URL in use
+    # when first needed; drop them so the next publish uses the current one.
+    celery_app._pool = None
+    celery_app.amqp._producer_pool = None
+
+
+def queue_names():
+    profiles = settings.CELERY_WORKER_PROFILES.values()
+    return sorted({queue for profile in profiles for queue in profile["queues"]})
+
+
+def queue_sizes():
+    with celery_app.connection_for_write() as connection:
+        channel = connection.default_channel
+        return {queue: channel._size(queue) for queue in queue_names()}
+
+
+@contextmanager
+def worker(queues, concurrency, name="harness"):
+    """A worker thread consuming ``queues`` with a pool of ``concurrency`` threads."""
+    with start_worker(
+        celery_app,
+        concurrency=concurrency,
+        pool="threads",
+        perform_ping_check=False,
+        queues=queues,
+        prefetch_multiplier=0,
+        hostname=f"{name}@harness",
+    ) as controller:
+        yield controller
+
+
+def profile_worker(profile, concurrency=None):
+    """A worker serving ``profile``'s queues as ``run_worker <profile>`` would."""
+    options = settings.CELERY_WORKER_PROFILES[profile]
+    return worker(options["queues"], concurrency or options["concurrency"], name=profile)
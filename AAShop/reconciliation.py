@@ -0,0 +1,131 @@
+"""Settle pending payments against Chapa in the background.
+
+Payments whose customer never came back (and whose webhook never arrived)
+stay pending until reconciled here. Pending rows are walked in keyset-paged
+batches over the partial payment_pending_idx index, so memory stays flat
+however large the backlog; each batch is verified with a bounded number of
+concurrent requests over the shared, pooled Chapa client and settled with
+bulk updates.
+
+Beat may fire again while a large backlog is still being worked through.
+``reconcile_exclusively()`` keeps runs from overlapping across every
+worker with a lease on a RefreshWatermark row, so it needs no shared cache.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+from .chapa import ChapaError, get_client
+from .models import Payment, RefreshWatermark
+from .services import apply_payment_outcomes
+
+
+# The RefreshWatermark row whose value is when the current run's lease ends
+RUN_LEASE = "payment_reconcile_lease"
+
+
+def reconcile_exclusively(lease=3600, **options):
+    """reconcile_pending_payments() unless another run holds the lease; None if one does.
+
+    A run that dies keeps the lease for at most ``lease`` seconds.
+    """
+    now = timezone.now()
+    RefreshWatermark.objects.get_or_create(name=RUN_LEASE, defaults={"value": now})
+    until = now + timedelta(seconds=lease)
+    if not RefreshWatermark.objects.filter(name=RUN_LEASE, value__lte=now).update(value=until):
+        return None
+    try:
+        return reconcile_pending_payments(**options)
+    finally:
+        # Unless the lease ran out and another run took it meanwhile
+        RefreshWatermark.objects.filter(name=RUN_LEASE, value=until).update(value=timezone.now())
+
+
+def pending_batches(batch_size, created_before, payments=None):
+    """Yield lists of (pk, tx_ref, created_at) for pending payments, in id order.
+
+    ``payments`` narrows them down to a Payment queryset; all payments by default.
+    """
+    payments = Payment.objects.all() if payments is None else payments
+    last_pk = 0
+    while True:
+        batch = list(
+            payments.filter(status="pending", pk__gt=last_pk, created_at__lte=created_before)
+            .order_by("pk")
+            .values_list("pk", "tx_ref", "created_at")[:batch_size]
+        )
+        if not batch:
+            return
+        yield batch
+        last_pk = batch[-1][0]
+
+
+def _verify(client, tx_ref):
+    try:
+        data = client.verify(tx_ref)
+    except ChapaError:
+        return None
+    details = data.get("data") or {}
+    return (details.get("status") or "").lower(), details.get("reference")
+
+
+def reconcile_pending_payments(
+    batch_size=None, concurrency=None, min_age=None, stale_after=None, client=None, payments=None
+):
+    """Verify every pending payment older than ``min_age`` seconds with Chapa.
+
+    Payments Chapa reports as paid or failed are settled; those still
+    unresolved after ``stale_after`` seconds are failed, which cancels
+    their order and releases its stock. ``payments``, a Payment queryset,
+    limits the run to those payments. Returns counts of what happened.
+    """
+    batch_size = batch_size or settings.PAYMENT_RECONCILE_BATCH_SIZE
+    concurrency = concurrency or settings.PAYMENT_RECONCILE_CONCURRENCY
+    min_age = settings.PAYMENT_RECONCILE_MIN_AGE if min_age is None else min_age
+    stale_after = settings.PAYMENT_STALE_AFTER if stale_after is None else stale_after
+    client = client or get_client()
+
+    payments = Payment.objects.all() if payments is None else payments
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=stale_after)
+    metrics.set_gauge("payment_reconcile_backlog", payments.filter(status="pending").count())
+
+    stats = {"checked": 0, "completed": 0, "failed": 0, "stale": 0, "errors": 0}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for batch in pending_batches(batch_size, now - timedelta(seconds=min_age), payments):
+            results = pool.map(lambda payment: _verify(client, payment[1]), batch)
+            outcomes, stale = {}, set()
+            for (_, tx_ref, created_at), result in zip(batch, results):
+                if result is None:
+                    stats["errors"] += 1
+                    continue
+                status, reference = result
+                if status == "success":
+                    outcomes[tx_ref] = ("completed", reference)
+                elif status == "failed":
+                    outcomes[tx_ref] = ("failed", None)
+                elif created_at <= stale_before:
+                    outcomes[tx_ref] = ("failed", None)
+                    stale.add(tx_ref)
+
+            completed, failed = apply_payment_outcomes(outcomes) if outcomes else ([], [])
+            expired = sum(tx_ref in stale for _, tx_ref, _ in failed)
+            stats["checked"] += len(batch)
+            stats["completed"] += len(completed)
+            stats["failed"] += len(failed) - expired
+            stats["stale"] += expired
+
+    duration = time.perf_counter() - start
+    metrics.increment("payment_reconcile_checked_total", stats["checked"])
+    metrics.increment("payment_reconcile_errors_total", stats["errors"])
+    for outcome in ("completed", "failed", "stale"):
+        metrics.increment("payment_reconcile_settled_total", stats[outcome], outcome=outcome)
+    metrics.observe("payment_reconcile_run_seconds", duration, buckets=(1, 10, 60, 300, 900, 3600))
+    metrics.set_gauge("payment_reconcile_rate", stats["checked"] / duration if duration else 0)
+    metrics.set_gauge("payment_reconcile_backlog", payments.filter(status="pending").count())
+    return stats
@@ -0,0 +1,152 @@
+"""Send catalog and reporting reads to the read replicas.
+
+Replicas are the "replica_<name>" aliases settings.py adds for each
+DATABASE_URL_REPLICA_<NAME> variable, listed in DATABASE_REPLICAS. During
+a request ReplicaRouter sends reads of the catalog and sales rollup models
+to one of them at random; order history listings and exports ask for one
+with ``read_alias()``. Writes, and every other read, use the primary, as do
+the reads that fill the catalog response cache (see cache.py).
+
+Replicas lag behind the primary, so reads stay on it where a replica could
+miss a write the reader expects to see:
+
+* for POST/PUT/PATCH/DELETE requests, which read what they are about to
+  change (stock, say),
+* for the rest of any request once it has written,
+* for REPLICA_PIN_SECONDS after a user's POST/PUT/PATCH/DELETE that wrote
+  (order history right after checkout, say),
+* inside ``primary()`` blocks.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+
+REPLICATED_MODELS = {
+    "AAShop.Product", "AAShop.Category",
+    # Only written by the rollup refresh, outside requests
+    "AAShop.DailySales", "AAShop.DailyCategorySales", "AAShop.DailyProductSales",
+}
+UNSAFE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+_request = contextvars.ContextVar("replica_routing_request", default=None)
+_primary = contextvars.ContextVar("replica_routing_primary", default=False)
+
+
+class _RequestState:
+    def __init__(self, request):
+        self.request = request
+        self.wrote = False
+        self.pinned_user = None
+
+
+def _pin_key(user_id):
+    return f"db:pinned:{user_id}"
+
+
+def _pinned(state):
+    if state.wrote or getattr(state.request, "method", None) in UNSAFE_METHODS:
+        return True
+    # request.user is only the real user once DRF has authenticated it, so
+    # the pin is looked up on the first read that needs it.
+    user = getattr(state.request, "user", None)
+    if user is None or not user.is_authenticated:
+        return False
+    if state.pinned_user is None:
+        state.pinned_user = cache.get(_pin_key(user.pk)) is not None
+    return state.pinned_user
+
+
+def read_alias():
+    """The alias to read replicated data from: a replica, or the primary if it must be."""
+    replicas = settings.DATABASE_REPLICAS
+    state = _request.get()
+    if not replicas or _primary.get() or (state is not None and _pinned(state)):
+        return "default"
+    return random.choice(replicas)
+
+
+@contextmanager
+def primary():
+    """Read everything from the primary inside the block."""
+    token = _primary.set(True)
+    try:
+        yield
+    finally:
+        _primary.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _request.get() is None or model._meta.label not in REPLICATED_MODELS:
+            return None
+        if hints.get("instance") is not None:
+            # Related objects come from where the instance came from
+            return None
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        state = _request.get()
+        if state is not None:
+            state.wrote = True
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # A replica holds the same rows as the primary
+        databases = {"default", *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get their schema through replication
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """Scope ReplicaRouter's routing and stickiness to the current request."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = _RequestState(request)
+        token = _request.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        self.remember_write(request, state, response)
+        return response
+
+    async def __acall__(self, request):
+        state = _RequestState(request)
+        token = _request.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request.reset(token)
+        self.remember_write(request, state, response)
+        return response
+
+    def remember_write(self, request, state, response):
+        if not settings.DATABASE_REPLICAS or not state.wrote:
+            return
+        if request.method not in UNSAFE_METHODS or response.status_code >= 400:
+            return
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            cache.set(_pin_key(user.pk), 1, settings.REPLICA_PIN_SECONDS)
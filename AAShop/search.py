@@ -0,0 +1,27 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, Q
+
+# Must match the configuration used by the search_vector trigger
+# (migration 0007).
+SEARCH_CONFIG = "english"
+
+
+def search_products(queryset, query):
+    """Filter ``queryset`` down to products matching ``query``, best first.
+
+    On PostgreSQL this uses the GIN-indexed ``search_vector`` (name weighted
+    above description). Other backends fall back to a substring scan so the
+    endpoint still works in local development.
+    """
+    if connection.vendor != "postgresql":
+        return queryset.filter(
+            Q(name__icontains=query) | Q(description__icontains=query)
+        ).order_by("-created_at", "-id")
+
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type="websearch")
+    return (
+        queryset.filter(search_vector=search_query)
+        .annotate(rank=SearchRank(F("search_vector"), search_query))
+        .order_by("-rank", "-id")
+    )
@@ -1,12 +1,16 @@
+from datetime import timedelta
+
+from django.utils import timezone
 from rest_framework import serializers
+from .instrumentation import TimedSerializerMixin
 from .models import Category, Product, Order, OrderItem, User, Payment, Cart, CartItem
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = "__all__"
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
         queryset=Category.objects.all(), source="category", write_only=True
@@ -16,7 +20,7 @@ class ProductSerializer(serializers.ModelSerializer):
         model = Product
         fields = ["id", "name", "description", "price", "stock", "category", "category_id"]
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(), source="product", write_only=True
@@ -26,7 +30,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ["id", "order", "product", "product_id", "quantity"]
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
 
     class Meta:
@@ -34,7 +38,7 @@ class OrderSerializer(serializers.ModelSerializer):
         fields = ["id", "user", "total_price", "status", "created_at", "updated_at", "items"]
         read_only_fields = ["id", "user", "total_price", "status", "created_at", "updated_at", "items"]
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ["id", "username", "email", "is_staff", "is_active"]
@@ -59,10 +63,10 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Payment
-        fields = ['id','tx_ref','amount','currency','transaction_id','status','created_at', 'updated_at']
+        fields = ['id','tx_ref','amount','currency','transaction_id','status','checkout_url','created_at', 'updated_at']
         read_only_fields = fields
 
 
@@ -74,7 +78,7 @@ class PaymentInitiateRequestSerializer(serializers.Serializer):
     first_name = serializers.CharField(required=False, default="John")
     last_name = serializers.CharField(required=False, default="Doe")
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     product = serializers.StringRelatedField(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(), source="product", write_only=True
@@ -84,12 +88,76 @@ class CartItemSerializer(serializers.ModelSerializer):
         model = CartItem
         fields = ["id", "product", "product_id", "quantity", "subtotal"]
         read_only_fields = ["id", "subtotal"]
+        # A line of 0 is a removal, which has endpoints of its own
+        extra_kwargs = {"quantity": {"min_value": 1}}
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
 
     class Meta:
         model = Cart
-        fields = ["id", "user", "items", "created_at"]
-        read_only_fields = ["id", "user", "created_at"]
\ No newline at end of file
+        fields = ["id", "user", "items", "item_count", "total", "created_at"]
+        read_only_fields = ["id", "user", "item_count", "total", "created_at"]
+
+
+class CartSummarySerializer(serializers.Serializer):
+    item_count = serializers.IntegerField()
+    total = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class CartBulkOperationSerializer(serializers.Serializer):
+    ACTIONS = ["add", "set", "remove"]
+
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, default=1)
+    action = serializers.ChoiceField(choices=ACTIONS, default="add")
+
+
+class CartBulkSerializer(serializers.Serializer):
+    """A batch of cart changes; every product is checked with one query."""
+    operations = CartBulkOperationSerializer(many=True, allow_empty=False, max_length=1000)
+
+    def validate_operations(self, operations):
+        product_ids = {operation["product_id"] for operation in operations}
+        found = set(Product.objects.filter(pk__in=product_ids).values_list("pk", flat=True))
+        missing = sorted(product_ids - found)
+        if missing:
+            raise serializers.ValidationError(f"Unknown products: {', '.join(map(str, missing))}")
+        return operations
+
+
+class SalesQuerySerializer(serializers.Serializer):
+    GROUPS = ["day", "category", "product"]
+
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    group_by = serializers.ChoiceField(choices=GROUPS, default="day")
+    category = serializers.IntegerField(required=False)
+    product = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=50)
+
+    def validate(self, attrs):
+        # Defaults to the last 30 days
+        attrs.setdefault("end", timezone.localdate())
+        attrs.setdefault("start", attrs["end"] - timedelta(days=29))
+        if attrs["start"] > attrs["end"]:
+            raise serializers.ValidationError("start must not be after end")
+        return attrs
+
+
+class SalesRowSerializer(serializers.Serializer):
+    day = serializers.DateField(required=False)
+    id = serializers.IntegerField(required=False)
+    name = serializers.CharField(required=False)
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    units = serializers.IntegerField()
+    orders = serializers.IntegerField()
+
+
+class SalesReportSerializer(serializers.Serializer):
+    start = serializers.DateField()
+    end = serializers.DateField()
+    group_by = serializers.CharField()
+    totals = SalesRowSerializer()
+    results = SalesRowSerializer(many=True)
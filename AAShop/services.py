@@ -0,0 +1,226 @@
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, Value, When
+from django.db.models.functions import Now
+
+from . import carts, metrics, outbox
+from .cache import forget_stock
+from .models import Cart, CartItem, Order, OrderItem, Payment, Product
+from .states import orders, payments
+
+
+class EmptyCartError(Exception):
+    pass
+
+
+class InsufficientStockError(Exception):
+    def __init__(self, product_ids):
+        super().__init__("Insufficient stock")
+        self.product_ids = list(product_ids)
+
+
+def _stock_change(quantities, sign):
+    return Case(*(When(pk=pk, then=F("stock") + sign * qty) for pk, qty in quantities.items()))
+
+
+def reserve_stock(quantities):
+    """Take ``{product_id: quantity}`` out of stock, all or nothing.
+
+    Must run inside a transaction. The product rows are locked in primary
+    key order so checkouts sharing products queue up instead of deadlocking,
+    and the decrement is a single conditional UPDATE for the whole order.
+    """
+    product_ids = sorted(quantities)
+    available = dict(
+        Product.objects.select_for_update()
+        .filter(pk__in=product_ids)
+        .order_by("pk")
+        .values_list("pk", "stock")
+    )
+    short = [pk for pk in product_ids if available.get(pk, 0) < quantities[pk]]
+    if short:
+        raise InsufficientStockError(short)
+
+    enough = Q()
+    for pk in product_ids:
+        enough |= Q(pk=pk, stock__gte=quantities[pk])
+    updated = Product.objects.filter(enough).update(
+        stock=_stock_change(quantities, -1), updated_at=Now()
+    )
+    if updated != len(product_ids):
+        # Only reachable on backends without row locks; the caller's
+        # transaction rolls back whatever was decremented.
+        raise InsufficientStockError(product_ids)
+    # Queryset updates skip post_save, so the catalog cache is told directly;
+    # cached product pages stay, only their stock is re-read.
+    forget_stock(product_ids)
+
+
+def release_stock(order_ids):
+    """Give back the stock still reserved by the orders ``order_ids``, at most once each.
+
+    Orders that never reserved stock (see Order.stock_reserved) are skipped.
+    """
+    lines = OrderItem.objects.filter(order_id__in=order_ids, order__stock_reserved=True)
+    quantities = {}
+    for product_id, quantity in lines.values_list("product_id", "quantity"):
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    Order.objects.filter(pk__in=order_ids, stock_reserved=True).update(stock_reserved=False)
+    if quantities:
+        Product.objects.filter(pk__in=quantities).update(
+            stock=_stock_change(quantities, 1), updated_at=Now()
+        )
+        forget_stock(quantities)
+
+
+def cancel_orders(order_ids):
+    """Move orders to CANCELLED and put their stock back, at most once each.
+
+    Orders already cancelled or shipped are left alone. The stock of all
+    cancelled orders goes back in a single UPDATE. Returns the ids of the
+    orders that were cancelled.
+    """
+    return orders.move(order_ids, "CANCELLED")
+
+
+@orders.on("CANCELLED")
+def _release_cancelled(order_ids):
+    release_stock(order_ids)
+
+
+def _without_live_payments(order_ids):
+    """The orders among ``order_ids`` that have no payment pending or completed.
+
+    Must run inside a transaction. The orders are locked first, so of two
+    payments failing on one order at once, the second sees the first failed.
+    """
+    locked = list(
+        Order.objects.select_for_update()
+        .filter(pk__in=order_ids)
+        .order_by("pk")
+        .values_list("pk", flat=True)
+    )
+    live = Payment.objects.filter(order=OuterRef("pk"), status__in=("pending", "completed"))
+    return list(Order.objects.filter(pk__in=locked).exclude(Exists(live)).values_list("pk", flat=True))
+
+
+def cancel_order(order):
+    """Move an order to CANCELLED and put its stock back, at most once."""
+    cancelled = cancel_orders([order.pk])
+    if cancelled:
+        order.status = "CANCELLED"
+    return bool(cancelled)
+
+
+def place_order(user):
+    """Turn the user's cart into a PENDING order and empty the cart.
+
+    The cart lines are read with their products in one query, stock is
+    reserved for every line, the order lines are written with a single bulk
+    insert and everything runs in one transaction, so the number of queries
+    does not grow with the cart size and a failed reservation writes nothing.
+    """
+    backend = carts.get_backend()
+    with transaction.atomic():
+        # A cart kept outside the tables is written back first, and dropped
+        # once the order is committed.
+        backend.flush(user)
+        items = list(
+            CartItem.objects.filter(cart__user=user).select_related("product")
+        )
+        if not items:
+            raise EmptyCartError("Cart is empty")
+
+        quantities = {}
+        for item in items:
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+        reserve_stock(quantities)
+
+        total_price = sum(item.quantity * item.product.price for item in items)
+        order = Order.objects.create(user=user, status="PENDING", total_price=total_price, stock_reserved=True)
+
+        OrderItem.objects.bulk_create(
+            OrderItem(
+                order=order,
+                product=item.product,
+                quantity=item.quantity,
+                price=item.product.price,
+            )
+            for item in items
+        )
+
+        CartItem.objects.filter(pk__in=[item.pk for item in items]).delete()
+        # Recomputed rather than decremented, so lines written around the
+        # cart backends cannot leave it negative
+        carts.recalculate_totals(Cart.objects.filter(pk=items[0].cart_id))
+        transaction.on_commit(lambda: backend.discard(user))
+
+    return order
+
+
+def apply_payment_outcomes(outcomes):
+    """Settle pending payments from ``{tx_ref: ("completed" | "failed", reference)}``.
+
+    Payments move through the state machine in states.py, so only those
+    still pending move and replaying an outcome, or racing another worker
+    (or verify_payment) on the same tx_ref, changes nothing. Completed payments
+    mark their order PAID and queue a confirmation email after commit (or,
+    when the order is no longer PENDING, are flagged ``refund_due``);
+    failed ones cancel their order, which releases its stock, unless
+    another payment for it is still pending or has completed. Returns the
+    (completed, failed) payments as (pk, tx_ref, order_id) tuples.
+    """
+    candidates = {"completed": [], "failed": []}
+    for payment in Payment.objects.filter(tx_ref__in=outcomes, status="pending").values_list("pk", "tx_ref", "order_id"):
+        candidates[outcomes[payment[1]][0]].append(payment)
+
+    with transaction.atomic():
+        completed = []
+        if candidates["completed"]:
+            moved = set(payments.move(
+                [pk for pk, *_ in candidates["completed"]],
+                "completed",
+                transaction_id=Case(*(
+                    When(pk=pk, then=Value(outcomes[tx_ref][1])) for pk, tx_ref, _ in candidates["completed"]
+                )),
+            ))
+            completed = [payment for payment in candidates["completed"] if payment[0] in moved]
+
+        moved = set(payments.move([pk for pk, *_ in candidates["failed"]], "failed"))
+        failed = [payment for payment in candidates["failed"] if payment[0] in moved]
+        # A failed payment gives the reserved stock back, unless the
+        # customer may still pay (or has paid) through another one
+        if failed:
+            cancel_orders(_without_live_payments({order_id for _, _, order_id in failed if order_id}))
+
+    return completed, failed
+
+
+def fail_payment(payment):
+    """Fail a payment Chapa would not start, cancelling its order unless another payment is live."""
+    _, failed = apply_payment_outcomes({payment.tx_ref: ("failed", None)})
+    if failed:
+        payment.status = "failed"
+    return bool(failed)
+
+
+@payments.on("completed")
+def _payment_completed(payment_ids):
+    paid = list(
+        Payment.objects.filter(pk__in=payment_ids, order__isnull=False)
+        .order_by("pk")
+        .values_list("pk", "order_id", "amount", "order__user__email")
+    )
+    newly_paid = set(orders.move([order_id for _, order_id, *_ in paid], "PAID"))
+    confirmations, refunds = [], []
+    for pk, order_id, amount, email in paid:
+        if order_id in newly_paid:
+            newly_paid.discard(order_id)
+            confirmations.append(outbox.payment_confirmation(order_id, email, amount))
+        else:
+            # The order did not move to PAID through this payment, so there
+            # is nothing to confirm and the charge has to be refunded.
+            refunds.append(pk)
+    outbox.enqueue(confirmations)
+    if refunds:
+        Payment.objects.filter(pk__in=refunds).update(refund_due=True)
+        metrics.increment("payment_refund_due_total", len(refunds))
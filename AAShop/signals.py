@@ -0,0 +1,42 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from rest_framework_simplejwt.settings import api_settings
+
+from . import authentication, carts
+from .cache import forget_stock, invalidate
+from .models import Category, Product, User
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    invalidate("product")
+    forget_stock([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_cache(sender, **kwargs):
+    invalidate("category")
+
+
+@receiver([post_save, post_delete], sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    authentication.forget(getattr(instance, api_settings.USER_ID_FIELD))
+
+
+@receiver(pre_save, sender=Product)
+def remember_saved_price(sender, instance, raw=False, update_fields=None, **kwargs):
+    if instance.pk and not raw and (update_fields is None or "price" in update_fields):
+        instance._saved_price = Product.objects.filter(pk=instance.pk).values_list("price", flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+def reprice_carts(sender, instance, **kwargs):
+    saved_price = instance.__dict__.pop("_saved_price", None)
+    if saved_price is not None and saved_price != instance.price:
+        carts.reprice(instance.pk, saved_price, instance.price)
+
+
+@receiver(pre_delete, sender=Product)
+def drop_from_carts(sender, instance, **kwargs):
+    carts.drop_product(instance.pk, instance.price)
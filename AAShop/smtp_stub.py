@@ -0,0 +1,90 @@
+"""A local SMTP sink for tests and offline email benchmarks."""
+import socketserver
+import threading
+import time
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        # Connection setup (TLS, AUTH) is what a real provider makes slow
+        self.server.delay()
+        self.server.connections += 1
+        self.reply("220 fake-smtp ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii", "replace").strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250-fake-smtp", "250 8BITMIME")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                for line in iter(self.rfile.readline, b""):
+                    if line in (b".\r\n", b".\n"):
+                        break
+                    lines.append(line)
+                if self.server.reject.is_set():
+                    self.reply("451 Try again later")
+                    continue
+                with self.server.lock:
+                    self.server.messages.append(b"".join(lines))
+                self.reply("250 Queued")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:  # MAIL FROM, RCPT TO, RSET, NOOP
+                self.reply("250 OK")
+
+    def reply(self, *lines):
+        self.wfile.write("".join(f"{line}\r\n" for line in lines).encode())
+
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    """Accepts every message and keeps it in ``messages``.
+
+    ``latency`` (seconds) is slept before greeting each new connection, to
+    simulate a provider's handshake; while ``reject`` is set every message
+    gets a temporary failure.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        super().__init__((host, port), FakeSMTPHandler)
+        self.latency = latency
+        self.messages = []
+        self.connections = 0
+        self.reject = threading.Event()
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,79 @@
+"""Order and payment state machines.
+
+Every status change is a conditional ``UPDATE ... WHERE status IN (<states
+that may move to the target>)`` writing only the status, updated_at and
+the fields passed along, so of two requests racing on the same row
+(verify_payment and the webhook worker on one tx_ref, say) exactly one
+moves it. Hooks registered for a target state run only for the rows that
+moved, so their side effects (marking the order paid, emails, releasing
+stock) happen once. Neither machine ever returns to an earlier state, so
+the status itself serves as the row version.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models.functions import Now
+
+from .models import Order, Payment
+
+
+class StateMachine:
+    def __init__(self, model, flow):
+        self.model = model
+        self.flow = flow
+        self._hooks = defaultdict(list)
+
+    def sources(self, target):
+        """The states a row may be in to move to ``target``."""
+        if target not in self.flow:
+            raise ValueError(f"Unknown {self.model.__name__} status {target!r}")
+        return [state for state, targets in self.flow.items() if target in targets]
+
+    def on(self, target):
+        """Register ``hook(pks)`` to run, inside the transaction, for rows that moved to ``target``."""
+        def register(hook):
+            self._hooks[target].append(hook)
+            return hook
+        return register
+
+    def move(self, pks, target, **changes):
+        """Move the rows ``pks`` to ``target`` where the flow allows it; return the pks that moved.
+
+        ``changes`` are further field values (or expressions) written by the
+        same UPDATE. A single row is moved optimistically: the conditional
+        UPDATE alone decides, and its row count tells whether it won. A batch
+        locks its candidates first (in pk order, so batches cannot deadlock)
+        to learn which of them move.
+        """
+        pks = sorted(set(pks))
+        sources = self.sources(target)
+        if not pks:
+            return []
+        with transaction.atomic():
+            rows = self.model.objects.filter(status__in=sources)
+            if len(pks) > 1:
+                pks = list(
+                    rows.select_for_update(of=("self",))
+                    .filter(pk__in=pks)
+                    .order_by("pk")
+                    .values_list("pk", flat=True)
+                )
+            if not pks or not rows.filter(pk__in=pks).update(status=target, updated_at=Now(), **changes):
+                return []
+            for hook in self._hooks[target]:
+                hook(pks)
+        return pks
+
+
+orders = StateMachine(Order, {
+    "PENDING": ("PAID", "CANCELLED"),
+    "PAID": ("SHIPPED", "CANCELLED"),
+    "SHIPPED": (),
+    "CANCELLED": (),
+})
+
+payments = StateMachine(Payment, {
+    "pending": ("completed", "failed"),
+    "completed": (),
+    "failed": (),
+})
@@ -1,8 +1,82 @@
 from celery import shared_task
-from django.core.mail import send_mail
+from django.conf import settings
+from django.core.cache import cache
 
-@shared_task
+from .analytics import refresh_sales_rollups as refresh_rollups
+from .carts import get_backend
+from .chapa import ChapaError, initialize_payment
+from .models import Payment
+from .outbox import drain, enqueue, payment_confirmation
+from .reconciliation import reconcile_exclusively
+from .services import fail_payment
+from .webhooks import process_events
+
+# Tasks that are safe to run twice are acknowledged once they finish
+# (acks_late), so one cut short by a dying worker is redelivered instead of
+# lost. initialize_chapa_payment is acknowledged on receipt: running it
+# again would initialize the same tx_ref twice. Queues and priorities are
+# in settings.CELERY_TASK_ROUTES.
+
+
+@shared_task(acks_late=True)
 def send_payment_confirmation_email(user_email, order_id, amount, status):
-    subject = "Payment Confirmation"
-    message = f"Your payment for Order #{order_id} of {amount} ETB has been marked as {status}."
-    send_mail(subject, message, "no-reply@yourshop.com", [user_email])
+    # Confirmations now go through the outbox; this only hands over ones
+    # queued before the switch.
+    enqueue([payment_confirmation(order_id, user_email, amount)])
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def send_outbox_emails():
+    # Keep draining each provider while batches come back full; retries
+    # that are not due yet are left to beat.
+    for provider in settings.EMAIL_PROVIDERS:
+        while drain(provider) == settings.EMAIL_OUTBOX_BATCH_SIZE:
+            pass
+
+
+@shared_task(bind=True, max_retries=3, ignore_result=True)
+def initialize_chapa_payment(self, payment_id, customer):
+    payment = Payment.objects.get(pk=payment_id)
+    try:
+        initialize_payment(payment, customer)
+    except ChapaError as exc:
+        if self.request.retries >= self.max_retries:
+            # The client polling for a checkout_url sees the payment fail
+            fail_payment(payment)
+            return
+        raise self.retry(exc=exc, countdown=2 ** self.request.retries)
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def process_webhook_events(batch_size=500):
+    # Keep draining while batches come back full; beat picks up the rest.
+    while process_events(batch_size) == batch_size:
+        pass
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def reconcile_payments():
+    # Skipped while another worker's run holds the lease
+    reconcile_exclusively()
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def flush_dirty_carts(batch_size=1000):
+    # Write-behind for the Redis cart backend; nothing to do with "db".
+    if settings.CART_BACKEND != "redis":
+        return
+    backend = get_backend()
+    while backend.flush_dirty(batch_size) == batch_size:
+        pass
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def refresh_sales_rollups():
+    # A full rebuild can outlast the beat interval; skip runs meanwhile
+    # instead of queueing them on the watermark row lock.
+    if not cache.add("sales-rollups:running", 1, timeout=3600):
+        return
+    try:
+        refresh_rollups()
+    finally:
+        cache.delete("sales-rollups:running")
@@ -1,3 +1,1815 @@
-from django.test import TestCase
+import csv
+import hashlib
+import hmac
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from AAKenyaShop.celery import app as celery_app
+
+from . import authentication, carts, metrics, outbox, routers, states, tasks, webhooks
+from .analytics import refresh_sales_rollups
+from .chapa import ChapaClient, ChapaError
+from .chapa_stub import FakeChapaServer
+from .models import (
+    Cart, CartItem, Category, EmailOutbox, Order, OrderItem, Payment, Product, RefreshWatermark, User, WebhookEvent,
+)
+from .queue_harness import in_memory_broker, profile_worker, queue_sizes
+from .reconciliation import RUN_LEASE, reconcile_exclusively, reconcile_pending_payments
+from .services import (
+    EmptyCartError, InsufficientStockError, apply_payment_outcomes, cancel_order, place_order, reserve_stock,
+)
+from .smtp_stub import FakeSMTPServer
+
+
+def setUpModule():
+    # Run .delay() inline so tests never need a broker.
+    celery_app.conf.update(CELERY_TASK_ALWAYS_EAGER=True)
+
+
+class ProductListQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="shopper", email="shopper@example.com", password="secret123"
+        )
+        categories = [Category.objects.create(name=f"Category {i}") for i in range(5)]
+        Product.objects.bulk_create(
+            Product(
+                category=categories[i % len(categories)],
+                name=f"Product {i}",
+                price=Decimal("100.00") + i,
+                stock=10,
+            )
+            for i in range(60)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def list_products(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_is_constant_regardless_of_page_size(self):
+        small, small_queries = self.list_products("/api/products/?page_size=5")
+        large, large_queries = self.list_products("/api/products/?page_size=50")
+
+        self.assertEqual(len(small.data["results"]), 5)
+        self.assertEqual(len(large.data["results"]), 50)
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(large_queries, 1)
+
+    def test_cursor_walks_whole_catalog_without_duplicates(self):
+        seen = []
+        url = "/api/products/?page_size=25"
+        while url:
+            response, queries = self.list_products(url)
+            self.assertEqual(queries, 1)
+            seen.extend(product["id"] for product in response.data["results"])
+            url = response.data["next"]
+
+        self.assertEqual(len(seen), 60)
+        self.assertEqual(len(set(seen)), 60)
+        self.assertIn("name", response.data["results"][0]["category"])
+
+
+class PlaceOrderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Books")
+        cls.products = Product.objects.bulk_create(
+            Product(category=cls.category, name=f"Book {i}", price=Decimal("10.00") + i, stock=100)
+            for i in range(20)
+        )
+
+    def make_cart(self, email, size):
+        user = User.objects.create_user(username=email, email=email, password="secret123")
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=product, quantity=2) for product in self.products[:size]
+        )
+        return user
+
+    def test_order_lines_snapshot_prices_and_cart_is_emptied(self):
+        user = self.make_cart("one@example.com", 3)
+
+        order = place_order(user)
+
+        self.assertEqual(order.status, "PENDING")
+        self.assertEqual(order.total_price, Decimal("66.00"))
+        self.assertEqual(
+            sorted(order.items.values_list("price", "quantity")),
+            [(Decimal("10.00"), 2), (Decimal("11.00"), 2), (Decimal("12.00"), 2)],
+        )
+        self.assertFalse(CartItem.objects.filter(cart__user=user).exists())
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        small = self.make_cart("small@example.com", 1)
+        large = self.make_cart("large@example.com", 20)
+
+        with CaptureQueriesContext(connection) as small_ctx:
+            place_order(small)
+        with CaptureQueriesContext(connection) as large_ctx:
+            place_order(large)
+
+        self.assertEqual(len(small_ctx.captured_queries), len(large_ctx.captured_queries))
+
+    def test_empty_cart_creates_nothing(self):
+        user = self.make_cart("empty@example.com", 0)
+
+        with self.assertRaises(EmptyCartError):
+            place_order(user)
+        self.assertFalse(Order.objects.filter(user=user).exists())
+
+    def test_cart_order_endpoint(self):
+        user = self.make_cart("api@example.com", 2)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.post("/api/cart/order/")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data["items"]), 2)
+
+        response = client.post("/api/cart/order/")
+        self.assertEqual(response.status_code, 400)
+
+
+class StockReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name="Merchandise")
+        cls.user = User.objects.create_user(username="buyer", email="buyer@example.com", password="secret123")
+
+    def make_product(self, stock):
+        return Product.objects.create(category=self.category, name="Mug", price=Decimal("5.00"), stock=stock)
+
+    def fill_cart(self, *lines):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        for product, quantity in lines:
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+
+    def test_place_order_decrements_stock(self):
+        mug, shirt = self.make_product(5), self.make_product(2)
+        self.fill_cart((mug, 3), (shirt, 2))
+
+        place_order(self.user)
+
+        mug.refresh_from_db()
+        shirt.refresh_from_db()
+        self.assertEqual((mug.stock, shirt.stock), (2, 0))
+
+    def test_insufficient_stock_writes_nothing(self):
+        mug, shirt = self.make_product(5), self.make_product(1)
+        self.fill_cart((mug, 3), (shirt, 2))
+
+        with self.assertRaises(InsufficientStockError) as ctx:
+            place_order(self.user)
+
+        self.assertEqual(ctx.exception.product_ids, [shirt.pk])
+        mug.refresh_from_db()
+        self.assertEqual(mug.stock, 5)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), 2)
+
+    def test_cancel_releases_stock_once(self):
+        mug = self.make_product(5)
+        self.fill_cart((mug, 4))
+        order = place_order(self.user)
+
+        self.assertTrue(cancel_order(order))
+        self.assertFalse(cancel_order(order))
+
+        mug.refresh_from_db()
+        self.assertEqual(mug.stock, 5)
+        order.refresh_from_db()
+        self.assertEqual(order.status, "CANCELLED")
+
+    def test_failed_payment_keeps_an_order_another_payment_may_settle(self):
+        mug = self.make_product(5)
+        self.fill_cart((mug, 2))
+        order = place_order(self.user)
+        for tx_ref in ("tx-first", "tx-second", "tx-third"):
+            Payment.objects.create(order=order, tx_ref=tx_ref, amount=order.total_price)
+
+        apply_payment_outcomes({"tx-first": ("failed", None)})
+        order.refresh_from_db()
+        mug.refresh_from_db()
+        self.assertEqual((order.status, mug.stock), ("PENDING", 3))
+
+        apply_payment_outcomes({"tx-second": ("completed", "CH-second"), "tx-third": ("failed", None)})
+        order.refresh_from_db()
+        mug.refresh_from_db()
+        self.assertEqual((order.status, mug.stock), ("PAID", 3))
+
+    def test_last_failed_payment_cancels_the_order(self):
+        mug = self.make_product(5)
+        self.fill_cart((mug, 2))
+        order = place_order(self.user)
+        for tx_ref in ("tx-one", "tx-two"):
+            Payment.objects.create(order=order, tx_ref=tx_ref, amount=order.total_price)
+
+        apply_payment_outcomes({"tx-one": ("failed", None)})
+        apply_payment_outcomes({"tx-two": ("failed", None)})
+
+        order.refresh_from_db()
+        mug.refresh_from_db()
+        self.assertEqual((order.status, mug.stock), ("CANCELLED", 5))
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "needs row-level locking")
+class ConcurrentStockReservationTests(TransactionTestCase):
+    def test_threads_never_oversell(self):
+        category = Category.objects.create(name="Flash sale")
+        product = Product.objects.create(category=category, name="Hot item", price=Decimal("1.00"), stock=50)
+        reserved = []
+
+        def worker():
+            try:
+                for _ in range(10):
+                    try:
+                        with transaction.atomic():
+                            reserve_stock({product.pk: 1})
+                        reserved.append(1)
+                    except InsufficientStockError:
+                        pass
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(len(reserved), 50)
+        self.assertEqual(product.stock, 0)
+
+
+class ChapaGatewayTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.gateway = FakeChapaServer().start()
+        cls.addClassCleanup(cls.gateway.stop)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username="payer", email="payer@example.com", password="secret123", first_name="Abebe"
+        )
+
+    def setUp(self):
+        self.gateway.latency = 0
+        self.gateway.outcomes.clear()
+        self.gateway.decline_initialize = False
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        settings_override = override_settings(CHAPA_BASE_URL=self.gateway.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def make_order(self):
+        category = Category.objects.create(name=f"Category {Category.objects.count()}")
+        product = Product.objects.create(category=category, name="Big Book", price=Decimal("1000.00"), stock=4)
+        order = Order.objects.create(
+            user=self.user, status="PENDING", total_price=Decimal("2000.00"), stock_reserved=True
+        )
+        OrderItem.objects.create(order=order, product=product, quantity=2, price=product.price)
+        return order, product
+
+    def test_initiate_payment_stores_checkout_url(self):
+        self.make_order()
+
+        response = self.client.post("/api/payments/initiate/")
+
+        self.assertEqual(response.status_code, 201)
+        tx_ref = response.data["payment"]["tx_ref"]
+        self.assertEqual(response.data["payment"]["checkout_url"], f"{self.gateway.url}/pay/{tx_ref}")
+        self.assertEqual(self.gateway.initialized[tx_ref]["first_name"], "Abebe")
+
+    @override_settings(CHAPA_ASYNC_INIT=True)
+    def test_async_initialization_returns_payment_to_poll(self):
+        self.make_order()
+
+        response = self.client.post("/api/payments/initiate/")
+
+        self.assertEqual(response.status_code, 202)
+        self.assertIsNone(response.data["chapa_response"])
+        tx_ref = response.data["payment"]["tx_ref"]
+        status = self.client.get(f"/api/payments/status/{tx_ref}/")
+        self.assertEqual(status.data["checkout_url"], f"{self.gateway.url}/pay/{tx_ref}")
+
+    def test_declined_initialization_cancels_order_and_releases_stock(self):
+        self.gateway.decline_initialize = True
+        for async_init in (False, True):
+            order, product = self.make_order()
+            with override_settings(CHAPA_ASYNC_INIT=async_init):
+                response = self.client.post("/api/payments/initiate/")
+
+            self.assertEqual(response.status_code, 202 if async_init else 502)
+            payment = Payment.objects.get(tx_ref=response.data["payment"]["tx_ref"])
+            order.refresh_from_db()
+            product.refresh_from_db()
+            self.assertEqual((payment.status, payment.checkout_url), ("failed", ""))
+            self.assertEqual((order.status, product.stock), ("CANCELLED", 6))
+
+    @override_settings(CHAPA_READ_TIMEOUT=0.1)
+    def test_hung_gateway_times_out(self):
+        self.gateway.latency = 0.5
+        client = ChapaClient(max_retries=0)
+
+        start = time.perf_counter()
+        with self.assertRaises(ChapaError):
+            client.verify("any-ref")
+        self.assertLess(time.perf_counter() - start, 0.45)
+
+    def test_failed_verification_cancels_order_and_releases_stock(self):
+        order, product = self.make_order()
+        payment = Payment.objects.create(order=order, tx_ref="tx-failed", amount=order.total_price)
+        self.gateway.outcomes["tx-failed"] = "failed"
+
+        response = self.client.get("/api/payments/verify/tx-failed/")
+
+        self.assertEqual(response.data["payment"]["status"], "failed")
+        order.refresh_from_db()
+        product.refresh_from_db()
+        self.assertEqual(order.status, "CANCELLED")
+        self.assertEqual(product.stock, 6)
+
+
+class CatalogCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="browser", email="browser@example.com", password="secret123")
+        cls.category = Category.objects.create(name="Books")
+        cls.product = Product.objects.create(category=cls.category, name="Big Book", price=Decimal("10.00"), stock=5)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(ctx.captured_queries)
+
+    def test_second_read_is_served_from_cache(self):
+        hits = metrics.counter_value("catalog_cache_hits_total", view="product")
+        misses = metrics.counter_value("catalog_cache_misses_total", view="product")
+
+        first, first_queries = self.get(f"/api/products/{self.product.pk}/")
+        second, second_queries = self.get(f"/api/products/{self.product.pk}/")
+
+        self.assertEqual(first, second)
+        self.assertEqual((first_queries, second_queries), (1, 0))
+        self.assertEqual(metrics.counter_value("catalog_cache_hits_total", view="product"), hits + 1)
+        self.assertEqual(metrics.counter_value("catalog_cache_misses_total", view="product"), misses + 1)
+
+    def test_product_update_is_visible_immediately(self):
+        self.get("/api/products/")
+
+        response = self.client.patch(f"/api/products/{self.product.pk}/", {"name": "Big Book, 4th edition"})
+        self.assertEqual(response.status_code, 200)
+
+        data, _ = self.get("/api/products/")
+        self.assertEqual(data["results"][0]["name"], "Big Book, 4th edition")
+
+    def test_category_rename_invalidates_nested_product_data(self):
+        self.get(f"/api/products/{self.product.pk}/")
+        self.get("/api/categories/")
+
+        self.category.name = "Literature"
+        self.category.save()
+
+        product, _ = self.get(f"/api/products/{self.product.pk}/")
+        categories, _ = self.get("/api/categories/")
+        self.assertEqual(product["category"]["name"], "Literature")
+        self.assertEqual(categories[0]["name"], "Literature")
+
+    def test_stock_reservation_keeps_cached_pages_with_current_stock(self):
+        self.get(f"/api/products/{self.product.pk}/")
+        self.get("/api/products/")
+        hits = metrics.counter_value("catalog_cache_hits_total", view="product")
+
+        with transaction.atomic():
+            reserve_stock({self.product.pk: 2})
+
+        (product, product_queries), (products, list_queries) = (
+            self.get(f"/api/products/{self.product.pk}/"), self.get("/api/products/")
+        )
+        self.assertEqual((product["stock"], products["results"][0]["stock"]), (3, 3))
+        # Both pages came from the cache; only the stock was re-read, once
+        self.assertEqual(metrics.counter_value("catalog_cache_hits_total", view="product"), hits + 2)
+        self.assertEqual((product_queries, list_queries), (1, 0))
+
+    def test_metrics_endpoint_exposes_cache_counters(self):
+        self.get("/api/categories/")
+
+        response = self.client.get("/metrics/")
+        self.assertContains(response, 'catalog_cache_misses_total{view="category"}')
+
+    def test_metrics_keep_every_digit(self):
+        metrics.increment("metrics_format_test_total", 1234567)
+        metrics.set_gauge("metrics_format_test_seconds", 1234567.125)
+
+        rendered = metrics.render().splitlines()
+        self.assertIn("metrics_format_test_total 1234567", rendered)
+        self.assertIn("metrics_format_test_seconds 1234567.125", rendered)
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="seeker", email="seeker@example.com", password="secret123")
+        cls.books = Category.objects.create(name="Books")
+        cls.merch = Category.objects.create(name="Merchandise")
+        cls.big_book = Product.objects.create(
+            category=cls.books, name="Big Book", description="Basic text", price=Decimal("1000.00"), stock=5
+        )
+        cls.reflections = Product.objects.create(
+            category=cls.books, name="Daily Reflections", description="A book of reflections",
+            price=Decimal("800.00"), stock=0,
+        )
+        cls.mug = Product.objects.create(
+            category=cls.merch, name="Mug", description="Coffee mug", price=Decimal("500.00"), stock=3
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, query):
+        response = self.client.get(f"/api/products/search/?{query}")
+        self.assertEqual(response.status_code, 200)
+        return {product["name"] for product in response.data["results"]}
+
+    def test_matches_name_and_description(self):
+        self.assertEqual(self.search("q=book"), {"Big Book", "Daily Reflections"})
+
+    def test_filters_by_category_price_and_stock(self):
+        self.assertEqual(self.search("q=book&in_stock=true"), {"Big Book"})
+        self.assertEqual(self.search("q=book&max_price=900"), {"Daily Reflections"})
+        self.assertEqual(self.search(f"q=mug&category={self.books.pk}"), set())
+
+    def test_requires_terms(self):
+        response = self.client.get("/api/products/search/")
+        self.assertEqual(response.status_code, 400)
+
+    @unittest.skipUnless(connection.vendor == "postgresql", "needs the search_vector trigger")
+    def test_name_matches_rank_above_description_matches(self):
+        response = self.client.get("/api/products/search/?q=book")
+        self.assertEqual(response.data["results"][0]["name"], "Big Book")
+
+
+class HotQueryIndexTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command("explain_hot_queries", stdout=out)
+        self.assertNotIn("SEQ SCAN", out.getvalue())
+
+
+class ScaleSeedTests(TestCase):
+    def test_generates_consistent_orders(self):
+        call_command("seed", scale=0, users=20, products=30, orders=200, carts=5, batch_size=64, stdout=StringIO())
+
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(Order.objects.count(), 200)
+        self.assertEqual(Cart.objects.count(), 5)
+        for order in Order.objects.prefetch_related("items")[:20]:
+            self.assertEqual(order.total_price, sum(item.price * item.quantity for item in order.items.all()))
+        self.assertFalse(Payment.objects.filter(order__status="PAID").exclude(status="completed").exists())
+
+
+class ApiBenchmarkTests(TestCase):
+    def test_inprocess_run_covers_the_flow_and_leaves_no_data(self):
+        category = Category.objects.create(name="Books")
+        Product.objects.create(category=category, name="Big Book", price=Decimal("10.00"), stock=50)
+        Product.objects.create(category=category, name="Mug", price=Decimal("5.00"), stock=50)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "report.json")
+            call_command("bench_api", flows=2, output=output, stdout=StringIO())
+            with open(output) as fh:
+                report = json.load(fh)
+
+        endpoints = report["endpoints"]
+        self.assertEqual(
+            set(endpoints),
+            {"register", "token", "browse_products", "add_to_cart", "view_cart", "checkout", "webhook"},
+        )
+        self.assertTrue(all(stats["errors"] == 0 for stats in endpoints.values()))
+        self.assertEqual(endpoints["checkout"]["requests"], 2)
+        self.assertIsNotNone(endpoints["checkout"]["queries_mean"])
+        self.assertFalse(Order.objects.exists())
+
+
+class RequestTimingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="timed", email="timed@example.com", password="secret123")
+        order = Order.objects.create(user=cls.user, status="PENDING", total_price=Decimal("10.00"))
+        Payment.objects.create(order=order, tx_ref="tx-timed", amount=order.total_price)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def server_timing(self, response):
+        return dict(entry.split(";", 1) for entry in response["Server-Timing"].split(", "))
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1)
+    def test_sampled_request_reports_time_per_component(self):
+        before = metrics.histogram_count("http_request_duration_seconds", view="verify_payment")
+        with FakeChapaServer() as gateway, override_settings(CHAPA_BASE_URL=gateway.url):
+            response = self.client.get("/api/payments/verify/tx-timed/")
+
+        timing = self.server_timing(response)
+        self.assertEqual(set(timing), {"db", "chapa", "serializer", "total"})
+        self.assertRegex(timing["db"], r'^dur=[\d.]+;desc="\d+ queries"$')
+        self.assertEqual(
+            metrics.histogram_count("http_request_duration_seconds", view="verify_payment"), before + 1
+        )
+        self.assertContains(
+            self.client.get("/metrics/"), 'http_request_chapa_seconds_bucket{view="verify_payment",le="+Inf"}'
+        )
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_request_is_not_timed(self):
+        response = self.client.get("/api/payments/status/tx-timed/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Server-Timing", response)
+
+
+class WebhookIngestionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="hooked", email="hooked@example.com", password="secret123")
+        category = Category.objects.create(name="Books")
+        cls.product = Product.objects.create(category=category, name="Big Book", price=Decimal("10.00"), stock=5)
+        cls.order = Order.objects.create(
+            user=cls.user, status="PENDING", total_price=Decimal("20.00"), stock_reserved=True
+        )
+        OrderItem.objects.create(order=cls.order, product=cls.product, quantity=2, price=cls.product.price)
+        cls.payment = Payment.objects.create(order=cls.order, tx_ref="tx-hook", amount=cls.order.total_price)
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(CHAPA_WEBHOOK_SECRET="hook-secret")
+    def deliver(self, payload):
+        body = json.dumps(payload)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                "/api/payments/webhook/", body, content_type="application/json",
+                HTTP_X_CHAPA_SIGNATURE=webhooks.sign(body.encode()),
+            )
+
+    def test_redelivered_events_are_applied_once(self):
+        event = {"tx_ref": "tx-hook", "status": "success", "reference": "CH-1"}
+        for _ in range(3):
+            self.assertEqual(self.deliver(event).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            tasks.process_webhook_events()
+
+        self.assertEqual(WebhookEvent.objects.filter(tx_ref="tx-hook").count(), 1)
+        self.assertFalse(WebhookEvent.objects.filter(processed_at__isnull=True).exists())
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.transaction_id), ("completed", "CH-1"))
+        self.assertEqual(self.order.status, "PAID")
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_late_events_do_not_undo_an_applied_outcome(self):
+        self.deliver({"tx_ref": "tx-hook", "status": "failed", "reference": ""})
+        self.deliver({"tx_ref": "tx-hook", "status": "success", "reference": "CH-2"})
+        with self.captureOnCommitCallbacks(execute=True):
+            tasks.process_webhook_events()
+
+        self.payment.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual(self.payment.status, "failed")
+        self.assertEqual(self.product.stock, 7)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_success_wins_over_failure_in_the_same_batch(self):
+        WebhookEvent.objects.bulk_create([
+            WebhookEvent(tx_ref="tx-hook", event_id="b", status="success", reference="CH-3", payload={}),
+            WebhookEvent(tx_ref="tx-hook", event_id="a", status="failed", payload={}),
+        ])
+
+        self.assertEqual(webhooks.process_events(), 2)
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, "completed")
+
+    @override_settings(CHAPA_WEBHOOK_SECRET="hook-secret")
+    def test_signature_is_required_when_a_secret_is_configured(self):
+        body = json.dumps({"tx_ref": "tx-hook", "status": "success"})
+        signature = hmac.new(b"hook-secret", body.encode(), hashlib.sha256).hexdigest()
+
+        unsigned = self.client.post("/api/payments/webhook/", body, content_type="application/json")
+        signed = self.client.post(
+            "/api/payments/webhook/", body, content_type="application/json", HTTP_X_CHAPA_SIGNATURE=signature
+        )
+
+        self.assertEqual(unsigned.status_code, 401)
+        self.assertEqual(signed.status_code, 200)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    @override_settings(CHAPA_WEBHOOK_SECRET="", DEBUG=False)
+    def test_unsigned_webhooks_are_rejected_without_a_secret(self):
+        body = json.dumps({"tx_ref": "tx-hook", "status": "success"})
+
+        response = self.client.post("/api/payments/webhook/", body, content_type="application/json")
+
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(WebhookEvent.objects.exists())
+        with override_settings(DEBUG=True):
+            self.assertEqual(
+                self.client.post("/api/payments/webhook/", body, content_type="application/json").status_code, 200
+            )
+
+    def test_benchmark_storm_applies_every_payment_once(self):
+        out = StringIO()
+        call_command("bench_webhooks", payments=20, duplicates=3, stdout=out)
+        self.assertIn("each applied exactly once", out.getvalue())
+
+
+class PaymentReconciliationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.gateway = FakeChapaServer().start()
+        cls.addClassCleanup(cls.gateway.stop)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="late", email="late@example.com", password="secret123")
+        category = Category.objects.create(name="Books")
+        cls.product = Product.objects.create(category=category, name="Big Book", price=Decimal("10.00"), stock=0)
+
+    def setUp(self):
+        settings_override = override_settings(CHAPA_BASE_URL=self.gateway.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+    def make_payment(self, tx_ref, outcome, age):
+        order = Order.objects.create(
+            user=self.user, status="PENDING", total_price=Decimal("10.00"), stock_reserved=True
+        )
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price=self.product.price)
+        payment = Payment.objects.create(order=order, tx_ref=tx_ref, amount=order.total_price)
+        Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - timedelta(seconds=age))
+        self.gateway.outcomes[tx_ref] = outcome
+        return payment
+
+    def test_settles_pending_payments_in_batches(self):
+        paid = self.make_payment("rec-paid", "success", age=3600)
+        failed = self.make_payment("rec-failed", "failed", age=3600)
+        stale = self.make_payment("rec-stale", "pending", age=7 * 86400)
+        waiting = self.make_payment("rec-waiting", "pending", age=3600)
+        fresh = self.make_payment("rec-fresh", "success", age=10)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = reconcile_pending_payments(batch_size=2, concurrency=2, min_age=600, stale_after=86400)
+
+        self.assertEqual(stats, {"checked": 4, "completed": 1, "failed": 1, "stale": 1, "errors": 0})
+        statuses = dict(Payment.objects.values_list("tx_ref", "status"))
+        self.assertEqual(statuses, {
+            "rec-paid": "completed", "rec-failed": "failed", "rec-stale": "failed",
+            "rec-waiting": "pending", "rec-fresh": "pending",
+        })
+        self.assertEqual(Order.objects.get(pk=paid.order_id).status, "PAID")
+        self.assertEqual(
+            set(Order.objects.filter(status="CANCELLED").values_list("pk", flat=True)),
+            {failed.order_id, stale.order_id},
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 2)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(metrics.gauge_value("payment_reconcile_backlog"), 2)
+        self.assertEqual({waiting.pk, fresh.pk}, set(Payment.objects.filter(status="pending").values_list("pk", flat=True)))
+
+    def test_second_run_changes_nothing(self):
+        self.make_payment("rec-again", "success", age=3600)
+        reconcile_pending_payments(min_age=600)
+
+        stats = reconcile_pending_payments(min_age=600)
+
+        self.assertEqual(stats["checked"], 0)
+
+    def test_run_limited_to_some_payments_leaves_the_rest(self):
+        mine = self.make_payment("rec-mine", "success", age=3600)
+        self.make_payment("rec-other", "success", age=3600)
+
+        stats = reconcile_pending_payments(min_age=600, payments=Payment.objects.filter(pk=mine.pk))
+
+        self.assertEqual((stats["checked"], stats["completed"]), (1, 1))
+        self.assertEqual(Payment.objects.get(tx_ref="rec-other").status, "pending")
+        self.assertEqual(metrics.gauge_value("payment_reconcile_backlog"), 0)
+
+    def test_failing_an_order_that_never_reserved_stock_releases_none(self):
+        legacy = self.make_payment("rec-legacy", "pending", age=3 * 86400)
+        Order.objects.filter(pk=legacy.order_id).update(stock_reserved=False)
+
+        stats = reconcile_pending_payments(min_age=600, stale_after=86400)
+
+        self.assertEqual(stats["stale"], 1)
+        self.assertEqual(Order.objects.get(pk=legacy.order_id).status, "CANCELLED")
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+
+    def test_runs_do_not_overlap_while_the_lease_is_held(self):
+        self.make_payment("rec-leased", "success", age=3600)
+        RefreshWatermark.objects.create(name=RUN_LEASE, value=timezone.now() + timedelta(minutes=5))
+
+        self.assertIsNone(reconcile_exclusively(min_age=600))
+        self.assertEqual(Payment.objects.get(tx_ref="rec-leased").status, "pending")
+
+        # A lease its holder never released runs out
+        RefreshWatermark.objects.filter(name=RUN_LEASE).update(value=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(reconcile_exclusively(min_age=600)["completed"], 1)
+        self.assertLessEqual(RefreshWatermark.objects.get(name=RUN_LEASE).value, timezone.now())
+
+
+def redis_available():
+    try:
+        return redis.Redis.from_url(settings.CART_REDIS_URL, socket_connect_timeout=0.2).ping()
+    except redis.RedisError:
+        return False
+
+
+class DatabaseCartBackendTests(TestCase):
+    backend = "db"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="carter", email="carter@example.com", password="secret123")
+        category = Category.objects.create(name="Books")
+        cls.products = [
+            Product.objects.create(category=category, name=f"Book {i}", price=Decimal("10.00") * (i + 1), stock=50)
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        settings_override = override_settings(CART_BACKEND=self.backend)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(carts.get_backend(self.backend).discard, self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add(self, product, quantity):
+        response = self.client.post("/api/cart/add/", {"product_id": product.pk, "quantity": quantity}, format="json")
+        self.assertEqual(response.status_code, 201)
+        return response.data
+
+    def test_adding_twice_increments_the_line(self):
+        self.add(self.products[0], 1)
+        line = self.add(self.products[0], 2)
+
+        self.assertEqual((line["quantity"], line["subtotal"]), (3, Decimal("30.00")))
+        cart = self.client.get("/api/cart/").data
+        self.assertEqual([(item["product"], item["quantity"]) for item in cart["items"]], [("Book 0", 3)])
+
+    def test_update_and_remove_use_the_returned_line_id(self):
+        line = self.add(self.products[1], 1)
+
+        updated = self.client.patch(f"/api/cart/update/{line['id']}/", {"quantity": 4}, format="json")
+        self.assertEqual(updated.data["quantity"], 4)
+        self.assertEqual(self.client.delete(f"/api/cart/remove/{line['id']}/").status_code, 200)
+        self.assertEqual(self.client.delete(f"/api/cart/remove/{line['id']}/").status_code, 404)
+        self.assertEqual(self.client.get("/api/cart/").data["items"], [])
+
+    def test_updates_of_a_line_read_before_another_update_keep_the_totals(self):
+        line = self.add(self.products[0], 1)
+        backend = carts.get_backend()
+        stale = backend.get_item(self.user, line["id"])
+
+        backend.update(self.user, backend.get_item(self.user, line["id"]), {"quantity": 5})
+        backend.update(self.user, stale, {"quantity": 2})
+
+        self.assertEqual(self.summary(), (2, Decimal("20.00")))
+
+    def test_view_cart_queries_do_not_grow_with_lines(self):
+        self.add(self.products[0], 1)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get("/api/cart/")
+        for product in self.products[1:]:
+            self.add(product, 1)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get("/api/cart/")
+
+        self.assertEqual(len(response.data["items"]), 5)
+        self.assertEqual(len(small), len(large))
+
+    def test_checkout_orders_what_the_cart_holds(self):
+        self.add(self.products[2], 2)
+        self.add(self.products[3], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order = place_order(self.user)
+
+        self.assertEqual(order.total_price, Decimal("100.00"))
+        self.assertEqual(self.client.get("/api/cart/").data["items"], [])
+
+    def summary(self):
+        response = self.client.get("/api/cart/summary/")
+        return response.data["item_count"], Decimal(response.data["total"])
+
+    def test_cart_carries_its_item_count_and_total(self):
+        line = self.add(self.products[0], 2)
+        self.add(self.products[1], 1)
+        self.client.patch(f"/api/cart/update/{line['id']}/", {"quantity": 3}, format="json")
+        self.bulk([
+            {"product_id": self.products[2].pk, "quantity": 2},
+            {"product_id": self.products[1].pk, "action": "remove"},
+        ])
+        self.assertEqual(self.summary(), (5, Decimal("90.00")))
+
+        self.client.delete(f"/api/cart/remove/{line['id']}/")
+        cart = self.client.get("/api/cart/").data
+        self.assertEqual((cart["item_count"], Decimal(cart["total"])), (2, Decimal("60.00")))
+        self.assertEqual(self.summary(), (2, Decimal("60.00")))
+
+    def test_price_changes_reach_cart_totals(self):
+        category = Category.objects.create(name="Maps")
+        atlas = Product.objects.create(category=category, name="Atlas", price=Decimal("5.00"), stock=10)
+        globe = Product.objects.create(category=category, name="Globe", price=Decimal("7.00"), stock=10)
+        self.add(atlas, 2)
+        self.add(globe, 1)
+
+        atlas.price = Decimal("6.50")
+        atlas.save()
+        self.assertEqual(self.summary(), (3, Decimal("20.00")))
+        globe.delete()
+        self.assertEqual(self.summary(), (2, Decimal("13.00")))
+
+    def bulk(self, operations):
+        return self.client.post("/api/cart/bulk/", {"operations": operations}, format="json")
+
+    def test_bulk_adds_sets_and_removes_in_one_request(self):
+        self.add(self.products[0], 1)
+        self.add(self.products[1], 1)
+
+        response = self.bulk([
+            {"product_id": self.products[0].pk, "quantity": 2},
+            {"product_id": self.products[1].pk, "action": "remove"},
+            {"product_id": self.products[2].pk, "quantity": 5, "action": "set"},
+            {"product_id": self.products[2].pk, "quantity": 1},
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(item["product"], item["quantity"]) for item in response.data["items"]],
+            [("Book 0", 3), ("Book 2", 6)],
+        )
+
+    def test_bulk_rejects_unknown_products_without_writing(self):
+        response = self.bulk([
+            {"product_id": self.products[0].pk, "quantity": 1},
+            {"product_id": 999999, "quantity": 1},
+        ])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get("/api/cart/").data["items"], [])
+
+    def test_bulk_queries_do_not_grow_with_lines(self):
+        category = Category.objects.create(name="Wishlist")
+        many = Product.objects.bulk_create(
+            Product(category=category, name=f"Item {i}", price=Decimal("1.00"), stock=10) for i in range(500)
+        )
+        self.add(self.products[0], 1)
+        with CaptureQueriesContext(connection) as small:
+            self.bulk([{"product_id": product.pk, "quantity": 1} for product in self.products])
+        with CaptureQueriesContext(connection) as large:
+            response = self.bulk([{"product_id": product.pk, "quantity": 2} for product in many])
+
+        self.assertEqual(len(response.data["items"]), 505)
+        # SQLite caps the parameters of one statement, so it splits the upsert
+        upserts = 1
+        if self.backend == "db":
+            upserts = math.ceil(len(many) / connection.ops.bulk_batch_size(["cart", "product", "quantity"], many))
+        self.assertEqual(len(large), len(small) + upserts - 1)
+
+
+    def test_cart_reads_are_single_queries(self):
+        self.add(self.products[0], 1)
+        self.add(self.products[1], 2)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.summary(), (3, Decimal("50.00")))
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.client.get("/api/cart/").data["items"]), 2)
+
+    def test_checkout_empties_the_totals(self):
+        self.add(self.products[0], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(self.user)
+
+        self.assertEqual(self.summary(), (0, Decimal("0")))
+        self.assertEqual(Cart.objects.get(user=self.user).item_count, 0)
+
+
+class CartTotalsCheckTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Tools")
+        self.product = Product.objects.create(category=category, name="Saw", price=Decimal("12.50"), stock=5)
+        self.carts = []
+        for i in range(3):
+            user = User.objects.create_user(username=f"checker{i}", email=f"checker{i}@example.com", password=None)
+            carts.get_backend("db").add(user, self.product, i + 1)
+            self.carts.append(user.cart)
+
+    def check(self, **options):
+        out = StringIO()
+        call_command("check_cart_totals", stdout=out, **options)
+        return out.getvalue()
+
+    def test_consistent_carts_pass(self):
+        self.assertIn("3 carts: 0 drifted", self.check())
+
+    def test_drift_is_reported_and_fixed(self):
+        # A queryset update skips the price fan-out
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal("10.00"))
+        Cart.objects.filter(pk=self.carts[0].pk).update(item_count=7)
+
+        with self.assertRaises(CommandError):
+            self.check()
+        self.assertIn("3 drifted", self.check(fix=True))
+        self.assertIn("0 drifted", self.check())
+        self.assertEqual(
+            list(Cart.objects.order_by("pk").values_list("item_count", "total")),
+            [(1, Decimal("10.00")), (2, Decimal("20.00")), (3, Decimal("30.00"))],
+        )
+
+
+@unittest.skipUnless(redis_available(), "needs a Redis server at CART_REDIS_URL")
+class RedisCartBackendTests(DatabaseCartBackendTests):
+    backend = "redis"
+
+    def test_changes_are_written_behind(self):
+        self.add(self.products[4], 3)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+        tasks.flush_dirty_carts.run()
+
+        self.assertEqual(
+            list(CartItem.objects.filter(cart__user=self.user).values_list("product_id", "quantity")),
+            [(self.products[4].pk, 3)],
+        )
+        self.assertEqual(
+            list(Cart.objects.filter(user=self.user).values_list("item_count", "total")), [(3, Decimal("150.00"))]
+        )
+
+    def test_carts_stay_dirty_until_written_back(self):
+        class BrokenDatabase(carts.RedisCartBackend):
+            def _write(self, user_id, data):
+                raise DatabaseError("database went away")
+
+        backend = carts.get_backend()
+        self.add(self.products[4], 3)
+        with self.assertRaises(DatabaseError):
+            BrokenDatabase(backend.client).flush_dirty()
+        self.assertTrue(backend.client.sismember(backend.dirty_key, self.user.pk))
+
+        # A worker that died mid-flush leaves its claim behind
+        backend.client.smove(backend.dirty_key, backend.claimed_key, self.user.pk)
+        backend.client.hset(backend.claimed_since_key, self.user.pk, time.time() - backend.claim_timeout - 1)
+        backend.flush_dirty()
+
+        self.assertEqual(CartItem.objects.get(cart__user=self.user).quantity, 3)
+        self.assertFalse(backend.client.sismember(backend.claimed_key, self.user.pk))
+
+    def test_zero_quantity_lines_are_refused(self):
+        response = self.client.post("/api/cart/add/", {"product_id": self.products[0].pk, "quantity": 0}, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        tasks.flush_dirty_carts.run()
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+
+class OrderExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username="finance", email="finance@example.com", password=None, is_staff=True
+        )
+        customer = User.objects.create_user(username="buyer", email="buyer@example.com", password=None)
+        category = Category.objects.create(name="Tea")
+        cls.products = [
+            Product.objects.create(category=category, name=f"Tea {i}", price=Decimal("4.00"), stock=10)
+            for i in range(2)
+        ]
+        cls.orders = []
+        for status, day in [("PAID", 1), ("PENDING", 2), ("PAID", 3)]:
+            order = Order.objects.create(user=customer, status=status, total_price=Decimal("11.00"))
+            Order.objects.filter(pk=order.pk).update(created_at=timezone.make_aware(timezone.datetime(2026, 3, day, 12)))
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=cls.products[0], quantity=2, price=Decimal("4.00")),
+                OrderItem(order=order, product=cls.products[1], quantity=1, price=Decimal("3.00")),
+            ])
+            cls.orders.append(order)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, **params):
+        response = self.client.get("/api/orders/export/", params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv_has_one_row_per_order_line(self):
+        rows = list(csv.DictReader(StringIO(self.export())))
+
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(
+            (rows[0]["order_id"], rows[0]["status"], rows[0]["product_name"], rows[0]["line_total"]),
+            (str(self.orders[0].pk), "PAID", "Tea 0", "8.00"),
+        )
+
+    def test_ndjson_nests_lines_under_their_order(self):
+        orders = [json.loads(line) for line in self.export(type="ndjson").splitlines()]
+
+        self.assertEqual([order["order_id"] for order in orders], [order.pk for order in self.orders])
+        self.assertEqual([item["line_total"] for item in orders[0]["items"]], ["8.00", "3.00"])
+
+    def test_filters_by_date_range_and_status(self):
+        rows = list(csv.DictReader(StringIO(self.export(start="2026-03-02", end="2026-03-03", status="paid"))))
+
+        self.assertEqual({row["order_id"] for row in rows}, {str(self.orders[2].pk)})
+
+    def test_streams_with_a_single_query(self):
+        response = self.client.get("/api/orders/export/")
+        with self.assertNumQueries(1):
+            b"".join(response.streaming_content)
+
+    def test_rejects_bad_filters_and_non_staff(self):
+        self.assertEqual(self.client.get("/api/orders/export/", {"start": "March"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/orders/export/", {"end": "2026-02-30"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/orders/export/", {"status": "LOST"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/orders/export/", {"type": "xml"}).status_code, 400)
+        self.client.force_authenticate(User.objects.get(username="buyer"))
+        self.assertEqual(self.client.get("/api/orders/export/").status_code, 403)
+
+    def test_command_writes_the_export_and_reports_the_rate(self):
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "orders.ndjson")
+            call_command("export_orders", format="ndjson", status="PAID", output=path, stdout=out)
+            with open(path, encoding="utf-8") as exported:
+                self.assertEqual(len(exported.read().splitlines()), 2)
+
+        self.assertIn("Exported 4 order lines of 2 orders", out.getvalue())
+        self.assertIn("rows/s", out.getvalue())
+
+
+class SalesAnalyticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(
+            username="analyst", email="analyst@example.com", password=None, is_staff=True
+        )
+        cls.customer = User.objects.create_user(username="shopper", email="shopper@example.com", password=None)
+        cls.drinks, cls.snacks = Category.objects.create(name="Drinks"), Category.objects.create(name="Snacks")
+        cls.juice = Product.objects.create(category=cls.drinks, name="Juice", price=Decimal("2.00"), stock=100)
+        cls.chips = Product.objects.create(category=cls.snacks, name="Chips", price=Decimal("3.00"), stock=100)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def order(self, day, status, lines):
+        order = Order.objects.create(user=self.customer, status=status)
+        Order.objects.filter(pk=order.pk).update(
+            created_at=timezone.make_aware(timezone.datetime(2026, 5, day, 10))
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, quantity=quantity, price=product.price)
+            for product, quantity in lines
+        )
+        return order
+
+    def report(self, **params):
+        response = self.client.get("/api/analytics/", {"start": "2026-05-01", "end": "2026-05-31", **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_rollups_count_paid_orders_by_day_category_and_product(self):
+        self.order(1, "PAID", [(self.juice, 2), (self.chips, 1)])
+        self.order(1, "SHIPPED", [(self.juice, 1)])
+        self.order(2, "PENDING", [(self.chips, 5)])
+        refresh_sales_rollups(full=True)
+
+        daily = self.report()
+        self.assertEqual(
+            [(str(row["day"]), row["revenue"], row["units"], row["orders"]) for row in daily["results"]],
+            [("2026-05-01", "9.00", 4, 2)],
+        )
+        categories = self.report(group_by="category")["results"]
+        self.assertEqual([(row["name"], row["revenue"], row["orders"]) for row in categories],
+                         [("Drinks", "6.00", 2), ("Snacks", "3.00", 1)])
+        products = self.report(group_by="product", category=self.snacks.pk)["results"]
+        self.assertEqual([(row["id"], row["units"]) for row in products], [(self.chips.pk, 1)])
+
+    def test_refresh_only_recomputes_days_of_changed_orders(self):
+        self.order(1, "PAID", [(self.juice, 1)])
+        pending = self.order(3, "PENDING", [(self.chips, 2)])
+        refresh_sales_rollups()
+
+        self.assertEqual(refresh_sales_rollups(overlap=0), 0)
+        pending.refresh_from_db()
+        pending.status = "PAID"
+        pending.save()
+        self.assertEqual(refresh_sales_rollups(overlap=0), 1)
+
+        self.assertEqual(self.report()["totals"], {"revenue": "8.00", "units": 3, "orders": 2})
+
+    def test_reports_read_only_the_rollups(self):
+        self.order(4, "PAID", [(self.juice, 1)])
+        refresh_sales_rollups()
+
+        for params in ({}, {"group_by": "category"}, {"group_by": "product"}):
+            with CaptureQueriesContext(connection) as ctx:
+                self.report(**params)
+            tables = " ".join(query["sql"] for query in ctx.captured_queries)
+            self.assertNotIn('"AAShop_order"', tables)
+            self.assertNotIn('"AAShop_orderitem"', tables)
+
+    def test_rejects_bad_queries_and_non_staff(self):
+        self.assertEqual(self.client.get("/api/analytics/", {"start": "2026-06-01", "end": "2026-05-01"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/analytics/", {"group_by": "hour"}).status_code, 400)
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get("/api/analytics/").status_code, 403)
+
+
+class StateTransitionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="mover", email="mover@example.com", password=None)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_only_allowed_transitions_move_rows(self):
+        shipped = Order.objects.create(user=self.user, status="SHIPPED")
+        pending = Order.objects.create(user=self.user, status="PENDING")
+
+        self.assertEqual(states.orders.move([shipped.pk, pending.pk], "CANCELLED"), [pending.pk])
+        self.assertEqual(states.orders.move([pending.pk], "PAID"), [])
+        with self.assertRaises(ValueError):
+            states.orders.move([pending.pk], "LOST")
+        self.assertEqual(
+            list(Order.objects.order_by("pk").values_list("status", flat=True)), ["SHIPPED", "CANCELLED"]
+        )
+
+    def test_hooks_fire_once_per_moved_row(self):
+        order = Order.objects.create(user=self.user, status="PENDING")
+        payment = Payment.objects.create(order=order, tx_ref="tx-once", amount=Decimal("5.00"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                apply_payment_outcomes({"tx-once": ("completed", "CH-once")})
+        apply_payment_outcomes({"tx-once": ("failed", None)})
+
+        payment.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual((payment.status, payment.transaction_id, order.status), ("completed", "CH-once", "PAID"))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_payment_completed_after_the_order_left_pending_is_refunded_not_confirmed(self):
+        cancelled = Order.objects.create(user=self.user, status="PENDING")
+        Payment.objects.create(order=cancelled, tx_ref="tx-late", amount=Decimal("5.00"))
+        cancel_order(cancelled)
+        twice = Order.objects.create(user=self.user, status="PENDING")
+        for tx_ref in ("tx-twice-1", "tx-twice-2"):
+            Payment.objects.create(order=twice, tx_ref=tx_ref, amount=Decimal("5.00"))
+        refunds = metrics.counter_value("payment_refund_due_total")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_payment_outcomes({
+                "tx-late": ("completed", "CH-late"),
+                "tx-twice-1": ("completed", "CH-twice-1"),
+                "tx-twice-2": ("completed", "CH-twice-2"),
+            })
+
+        self.assertEqual(
+            dict(Payment.objects.values_list("tx_ref", "refund_due")),
+            {"tx-late": True, "tx-twice-1": False, "tx-twice-2": True},
+        )
+        cancelled.refresh_from_db()
+        self.assertEqual(cancelled.status, "CANCELLED")
+        self.assertEqual(list(EmailOutbox.objects.values_list("order_id", flat=True)), [twice.pk])
+        self.assertEqual(metrics.counter_value("payment_refund_due_total"), refunds + 2)
+
+    def test_writes_touch_only_the_transition_fields(self):
+        order = Order.objects.create(user=self.user, status="PENDING", total_price=Decimal("9.00"))
+        stale = Order.objects.get(pk=order.pk)
+        Order.objects.filter(pk=order.pk).update(total_price=Decimal("12.00"))
+
+        with CaptureQueriesContext(connection) as ctx:
+            states.orders.move([stale.pk], "PAID")
+
+        update = next(query["sql"] for query in ctx.captured_queries if query["sql"].startswith("UPDATE"))
+        self.assertNotIn("total_price", update)
+        self.assertEqual(Order.objects.get(pk=order.pk).total_price, Decimal("12.00"))
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "needs row-level locking")
+class ConcurrentPaymentSettlementTests(TransactionTestCase):
+    rounds = 5
+    threads_per_side = 4
+
+    def setUp(self):
+        gateway = FakeChapaServer(default_outcome="success").start()
+        self.addCleanup(gateway.stop)
+        settings_override = override_settings(CHAPA_BASE_URL=gateway.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.user = User.objects.create_user(username="racer", email="racer@example.com", password=None)
+
+    def race(self, tx_ref):
+        start = threading.Barrier(2 * self.threads_per_side)
+        errors = []
+
+        def verify():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            start.wait()
+            response = client.get(f"/api/payments/verify/{tx_ref}/")
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+        def webhook(number):
+            start.wait()
+            webhooks.record_event({"tx_ref": tx_ref, "status": "success", "event_id": f"{tx_ref}-{number}"})
+            webhooks.process_events()
+
+        def run(target, *args):
+            try:
+                target(*args)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(verify,)) for _ in range(self.threads_per_side)]
+        threads += [threading.Thread(target=run, args=(webhook, i)) for i in range(self.threads_per_side)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_verify_and_webhook_settle_a_payment_once(self):
+        for round_number in range(self.rounds):
+            mail.outbox = []
+            cache.clear()
+            order = Order.objects.create(user=self.user, status="PENDING", total_price=Decimal("10.00"))
+            payment = Payment.objects.create(order=order, tx_ref=f"race-{round_number}", amount=order.total_price)
+
+            self.assertEqual(self.race(payment.tx_ref), [])
+
+            payment.refresh_from_db()
+            order.refresh_from_db()
+            self.assertEqual((payment.status, order.status), ("completed", "PAID"))
+            self.assertEqual(len(mail.outbox), 1)
+
+
+class EmailOutboxTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.smtp = FakeSMTPServer().start()
+        cls.addClassCleanup(cls.smtp.stop)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="reader", email="reader@example.com", password=None)
+
+    def setUp(self):
+        cache.clear()
+        self.smtp.messages.clear()
+        self.smtp.connections = 0
+        self.smtp.reject.clear()
+        providers = {"default": {
+            "BACKEND": "django.core.mail.backends.smtp.EmailBackend",
+            "RATE_LIMIT": 0,
+            "OPTIONS": {
+                "host": self.smtp.host, "port": self.smtp.port, "username": "", "password": "",
+                "use_tls": False, "use_ssl": False, "timeout": 5,
+            },
+        }}
+        settings_override = override_settings(
+            EMAIL_PROVIDERS=providers, EMAIL_OUTBOX_MAX_ATTEMPTS=2, EMAIL_OUTBOX_RETRY_DELAY=60
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def queue(self, count):
+        orders = Order.objects.bulk_create(Order(user=self.user, status="PAID") for _ in range(count))
+        outbox.enqueue(outbox.payment_confirmation(order.pk, self.user.email, "10.00") for order in orders)
+
+    def test_confirmation_is_queued_once_and_sent_after_commit(self):
+        order = Order.objects.create(user=self.user, status="PENDING")
+        Payment.objects.create(order=order, tx_ref="tx-mail", amount=Decimal("10.00"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_payment_outcomes({"tx-mail": ("completed", "CH-mail")})
+            outbox.enqueue([outbox.payment_confirmation(order.pk, self.user.email, "10.00")])
+            self.assertEqual(self.smtp.messages, [])
+
+        email = EmailOutbox.objects.get()
+        self.assertEqual((email.order_id, email.event, email.status), (order.pk, "payment_completed", "sent"))
+        self.assertEqual(len(self.smtp.messages), 1)
+
+    def test_a_batch_goes_over_one_connection(self):
+        self.queue(5)
+
+        # Claim (in a transaction) and mark sent, whatever the batch size
+        with self.assertNumQueries(5):
+            self.assertEqual(outbox.drain(), 5)
+
+        self.assertEqual((len(self.smtp.messages), self.smtp.connections), (5, 1))
+        self.assertFalse(EmailOutbox.objects.exclude(status="sent").exists())
+
+    def test_failures_back_off_then_give_up(self):
+        self.queue(3)
+        self.smtp.reject.set()
+        start = timezone.now()
+
+        self.assertEqual(outbox.drain(), 3)
+        self.assertEqual(outbox.drain(), 0)  # not due again yet
+        for email in EmailOutbox.objects.all():
+            self.assertEqual((email.status, email.attempts), ("pending", 1))
+            self.assertIn("451", email.last_error)
+            self.assertGreaterEqual(email.next_attempt_at, start + timedelta(seconds=60))
+
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(outbox.drain(), 3)
+        self.assertEqual(set(EmailOutbox.objects.values_list("status", "attempts")), {("failed", 2)})
+
+    def test_unreachable_provider_fails_the_batch_at_once(self):
+        self.queue(3)
+        with override_settings(EMAIL_PROVIDERS={"default": {
+            "BACKEND": "django.core.mail.backends.smtp.EmailBackend",
+            "RATE_LIMIT": 0,
+            "OPTIONS": {"host": "127.0.0.1", "port": 9, "username": "", "password": "", "timeout": 1},
+        }}):
+            self.assertEqual(outbox.drain(), 3)
+        self.assertEqual(set(EmailOutbox.objects.values_list("status", "attempts")), {("pending", 1)})
+
+    def test_rate_limited_provider_refuses_a_per_process_cache(self):
+        self.queue(1)
+        providers = {"default": {**settings.EMAIL_PROVIDERS["default"], "RATE_LIMIT": 10}}
+        local = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+        with override_settings(EMAIL_PROVIDERS=providers, CACHES=local, DEBUG=False):
+            with self.assertRaises(ImproperlyConfigured):
+                outbox.drain()
+        self.assertEqual(EmailOutbox.objects.get().status, "pending")
+        self.assertEqual(self.smtp.messages, [])
+
+        with override_settings(EMAIL_PROVIDERS=providers, CACHES=local, DEBUG=True):
+            self.assertEqual(outbox.drain(), 1)
+
+    def test_throttle_holds_a_provider_to_its_rate(self):
+        start = time.monotonic()
+        for _ in range(3):
+            outbox.throttle("slow", 1)
+        # Three messages at one a second span three one-second windows
+        self.assertGreater(time.monotonic() - start, 1.0)
+
+
+probed = []
+
+
+@celery_app.task(name="AAShop.tests.queue_probe", ignore_result=True)
+def queue_probe():
+    probed.append(threading.current_thread().name)
+
+
+class TaskRoutingTests(TestCase):
+    def route(self, name):
+        return celery_app.amqp.router.route({}, name)
+
+    def test_payment_work_is_kept_apart_from_bulk_work(self):
+        queues = {
+            name: self.route(f"AAShop.tasks.{name}")["queue"].name
+            for name in (
+                "initialize_chapa_payment", "process_webhook_events", "send_outbox_emails",
+                "reconcile_payments", "refresh_sales_rollups", "flush_dirty_carts",
+            )
+        }
+        self.assertEqual(queues["initialize_chapa_payment"], "payments")
+        self.assertEqual(queues["process_webhook_events"], "payments")
+        self.assertEqual(queues["send_outbox_emails"], "email")
+        for name in ("reconcile_payments", "refresh_sales_rollups", "flush_dirty_carts"):
+            self.assertEqual(queues[name], "bulk")
+        self.assertEqual(self.route("AAShop.tasks.initialize_chapa_payment")["priority"], 0)
+
+        served = {queue for profile in settings.CELERY_WORKER_PROFILES.values() for queue in profile["queues"]}
+        self.assertLessEqual(set(queues.values()) | {settings.CELERY_TASK_DEFAULT_QUEUE}, served)
+
+    def test_only_idempotent_tasks_are_acknowledged_late(self):
+        self.assertFalse(tasks.initialize_chapa_payment.acks_late)
+        for task in (tasks.process_webhook_events, tasks.send_outbox_emails, tasks.reconcile_payments):
+            self.assertTrue(task.acks_late, task.name)
+
+    def test_run_worker_uses_the_profile(self):
+        out = StringIO()
+        call_command("run_worker", "payments", "--print", stdout=out)
+        self.assertIn("--queues payments --concurrency 8 --prefetch-multiplier 1", out.getvalue())
+
+    def test_a_payments_worker_is_not_held_up_by_queued_emails(self):
+        probed.clear()
+        with in_memory_broker():
+            for _ in range(3):
+                tasks.send_outbox_emails.apply_async()
+            queue_probe.apply_async(queue=self.route("AAShop.tasks.initialize_chapa_payment")["queue"])
+            # Only a real queue can hold work back
+            self.assertEqual(queue_sizes()["email"], 3)
+
+            with profile_worker("payments"):
+                deadline = time.monotonic() + 10
+                while not probed and time.monotonic() < deadline:
+                    time.sleep(0.01)
+
+            self.assertEqual(len(probed), 1)
+            self.assertEqual(queue_sizes(), {"bulk": 0, "default": 0, "email": 3, "payments": 0})
+        self.assertTrue(celery_app.conf.task_always_eager)
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.gateway = FakeChapaServer().start()
+        cls.addClassCleanup(cls.gateway.stop)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="waiter", email="waiter@example.com", password=None)
+        category = Category.objects.create(name="Async")
+        cls.product = Product.objects.create(category=category, name="Lamp", price=Decimal("12.50"), stock=5)
+        cls.order = Order.objects.create(user=cls.user, status="PENDING", total_price=Decimal("12.50"))
+        cls.auth = {"Authorization": f"Bearer {RefreshToken.for_user(cls.user).access_token}"}
+
+    def setUp(self):
+        settings_override = override_settings(CHAPA_BASE_URL=self.gateway.url, CHAPA_ASYNC_INIT=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.gateway.outcomes.clear()
+        cache.clear()
+
+    def test_every_middleware_can_run_async(self):
+        # One sync-only middleware would put every async view back on a thread
+        for path in settings.MIDDLEWARE:
+            self.assertTrue(getattr(import_string(path), "async_capable", False), path)
+
+    async def test_initiate_and_verify_a_payment(self):
+        response = await self.async_client.post("/api/async/payments/initiate/", headers=self.auth)
+        self.assertEqual(response.status_code, 201)
+        tx_ref = response.json()["payment"]["tx_ref"]
+        self.assertEqual(response.json()["payment"]["checkout_url"], f"{self.gateway.url}/pay/{tx_ref}")
+        self.assertIn(tx_ref, self.gateway.initialized)
+
+        response = await self.async_client.get(f"/api/async/payments/verify/{tx_ref}/", headers=self.auth)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["payment"]["status"], "completed")
+        self.assertEqual(response.json()["chapa_response"]["data"]["email"], "waiter@example.com")
+        order = await Order.objects.aget(pk=self.order.pk)
+        self.assertEqual(order.status, "PAID")
+
+    async def test_gateway_failure_fails_the_payment(self):
+        with override_settings(CHAPA_BASE_URL="http://127.0.0.1:9", CHAPA_MAX_RETRIES=0):
+            response = await self.async_client.post("/api/async/payments/initiate/", headers=self.auth)
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(response.json()["payment"]["status"], "failed")
+
+    async def test_requests_without_a_valid_token_are_refused(self):
+        response = await self.async_client.get("/api/async/cart/")
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get("/api/async/cart/", headers={"Authorization": "Bearer nope"})
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get("/api/async/payments/verify/missing/", headers=self.auth)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_cart_endpoints_match_the_sync_ones(self):
+        response = await self.async_client.post(
+            "/api/async/cart/add/", {"product_id": self.product.pk, "quantity": 2},
+            content_type="application/json", headers=self.auth,
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["quantity"], 2)
+        response = await self.async_client.post(
+            "/api/async/cart/add/", {"product_id": 0}, content_type="application/json", headers=self.auth
+        )
+        self.assertEqual(response.status_code, 400)
+
+        cart = (await self.async_client.get("/api/async/cart/", headers=self.auth)).json()
+        summary = (await self.async_client.get("/api/async/cart/summary/", headers=self.auth)).json()
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        sync_cart = await sync_to_async(client.get)("/api/cart/")
+        self.assertEqual(cart, json.loads(sync_cart.content))
+        self.assertEqual(summary, {"item_count": 2, "total": "25.00"})
+
+    @override_settings(CHAPA_WEBHOOK_SECRET="hook-secret")
+    async def test_webhook_stores_each_event_once(self):
+        body = json.dumps({"tx_ref": "async-tx", "status": "success", "event_id": "evt-1"})
+        for _ in range(2):
+            response = await self.async_client.post(
+                "/api/async/payments/webhook/", body, content_type="application/json",
+                headers={"Chapa-Signature": webhooks.sign(body.encode())},
+            )
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(await WebhookEvent.objects.filter(tx_ref="async-tx").acount(), 1)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="regular", email="regular@example.com", password="secret-1")
+        cls.auth = {"HTTP_AUTHORIZATION": f"Bearer {RefreshToken.for_user(cls.user).access_token}"}
+
+    def setUp(self):
+        cache.clear()
+        authentication.local_users.clear()
+
+    def user_queries(self, path="/api/cart/", status=200):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(path, **self.auth)
+        self.assertEqual(response.status_code, status)
+        return [query["sql"] for query in ctx.captured_queries if '"AAShop_user"' in query["sql"]]
+
+    def test_only_the_first_request_looks_the_user_up(self):
+        self.assertEqual(len(self.user_queries()), 1)
+        self.assertEqual(self.user_queries(), [])
+
+        # Another process finds the user in the shared cache
+        authentication.local_users.clear()
+        hits = metrics.counter_value("auth_user_cache_hits_total", tier="shared")
+        self.assertEqual(self.user_queries(), [])
+        self.assertEqual(metrics.counter_value("auth_user_cache_hits_total", tier="shared"), hits + 1)
+
+    def test_saving_the_user_drops_the_cached_copy(self):
+        self.user_queries()
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password("secret-2")
+        user.save()
+        self.assertEqual(len(self.user_queries()), 1)
+
+        user.is_active = False
+        user.save(update_fields=["is_active"])
+        self.user_queries(status=401)
+
+    def test_queryset_updates_forget_the_user_explicitly(self):
+        self.user_queries()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.user_queries()
+        authentication.forget(self.user.pk)
+        self.user_queries(status=401)
+
+    def test_requests_get_their_own_copy(self):
+        first = authentication.get_user(self.user.pk)
+        first.first_name = "Changed"
+        self.assertEqual(authentication.get_user(self.user.pk).first_name, "")
+        self.assertIsNone(authentication.get_user(0))
+
+    def test_local_entries_expire_and_the_least_recent_is_evicted(self):
+        local = authentication.LocalCache(size=2, ttl=60)
+        local.set("a", 1)
+        local.set("b", 2)
+        local.get("a")
+        local.set("c", 3)
+        self.assertEqual((local.get("a"), local.get("b"), local.get("c")), (1, None, 3))
+
+        local.ttl = 0
+        local.set("d", 4)
+        self.assertIsNone(local.get("d"))
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTests(TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        # A second connection to the test database stands in for a replica;
+        # committed rows are visible to it, hence TransactionTestCase.
+        default = connections["default"].settings_dict
+        connections.settings["replica"] = {
+            **default,
+            # Without a pool of its own (DB_POOL) left open at the end
+            "OPTIONS": {key: value for key, value in default["OPTIONS"].items() if key != "pool"},
+            "TEST": {**default["TEST"], "MIRROR": "default"},
+        }
+        cls.databases = {"default", "replica"}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+
+    def setUp(self):
+        gateway = FakeChapaServer().start()
+        self.addCleanup(gateway.stop)
+        settings_override = override_settings(CHAPA_BASE_URL=gateway.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(username="reader", email="reader@example.com", password=None)
+        self.admin = User.objects.create_user(
+            username="auditor", email="auditor@example.com", password=None, is_staff=True
+        )
+        category = Category.objects.create(name="Replicated")
+        self.product = Product.objects.create(category=category, name="Kettle", price=Decimal("20.00"), stock=5)
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tables_read(self, method, path, data=None, status=200):
+        """The tables each alias read during the request."""
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            response = getattr(self.client, method)(path, data, format="json")
+            if response.streaming:
+                b"".join(response.streaming_content)
+        self.assertEqual(response.status_code, status, getattr(response, "data", None))
+
+        def tables(queries):
+            # Exports read through a declared server-side cursor on PostgreSQL
+            return {
+                table for query in queries if query["sql"].startswith(("SELECT", "DECLARE"))
+                for table in ("AAShop_product", "AAShop_category", "AAShop_order", "AAShop_orderitem")
+                if f'FROM "{table}"' in query["sql"]
+            }
+        return tables(primary.captured_queries), tables(replica.captured_queries)
+
+    def test_catalog_reads_go_to_the_replica(self):
+        primary, replica = self.tables_read("get", "/api/products/search/?q=Kettle")
+        self.assertEqual(replica, {"AAShop_product"})
+        self.assertEqual(primary, set())
+        # Outside a request everything stays on the primary
+        self.assertEqual(Product.objects.all().db, "default")
+
+    def test_catalog_cache_is_filled_from_the_primary(self):
+        self.assertEqual(self.tables_read("get", "/api/products/"), ({"AAShop_product"}, set()))
+        self.assertEqual(self.tables_read("get", f"/api/products/{self.product.pk}/"), ({"AAShop_product"}, set()))
+
+    def test_order_history_sticks_to_the_primary_after_checkout(self):
+        self.assertEqual(self.tables_read("get", "/api/orders/"), (set(), {"AAShop_order"}))
+
+        self.client.post("/api/cart/add/", {"product_id": self.product.pk, "quantity": 1}, format="json")
+        self.tables_read("post", "/api/checkout/", {}, status=201)
+        primary, replica = self.tables_read("get", "/api/orders/")
+        self.assertIn("AAShop_order", primary)
+        self.assertEqual(replica, set())
+
+        # Once the pin expires the replica takes over again, items included
+        cache.delete(f"db:pinned:{self.user.pk}")
+        primary, replica = self.tables_read("get", "/api/orders/")
+        self.assertEqual(primary, set())
+        self.assertEqual(replica, {"AAShop_order", "AAShop_orderitem", "AAShop_product", "AAShop_category"})
+
+    def test_exports_read_the_replica(self):
+        self.client.force_authenticate(self.admin)
+        primary, replica = self.tables_read("get", "/api/orders/export/")
+        self.assertEqual(replica, {"AAShop_orderitem"})
+        self.assertEqual(primary, set())
+
+    def test_writes_read_what_they_change_from_the_primary(self):
+        primary, replica = self.tables_read(
+            "post", "/api/cart/add/", {"product_id": self.product.pk, "quantity": 1}, status=201
+        )
+        self.assertIn("AAShop_product", primary)
+        self.assertEqual(replica, set())
+
+    def test_a_request_reads_its_own_writes(self):
+        state = routers._RequestState(None)
+        token = routers._request.set(state)
+        try:
+            self.assertEqual(Product.objects.all().db, "replica")
+            self.product.save()
+            self.assertEqual(Product.objects.all().db, "default")
+        finally:
+            routers._request.reset(token)
+
+
+class FlatRepresentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="skimmer", email="skimmer@example.com", password=None)
+        category = Category.objects.create(name="Stationery")
+        cls.products = [
+            Product.objects.create(category=category, name=f"Pen {i}", price=Decimal("2.50") + i, stock=20)
+            for i in range(5)
+        ]
+        cls.orders = []
+        for i in range(3):
+            order = Order.objects.create(user=cls.user, total_price=Decimal("7.50"))
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=cls.products[i], quantity=1, price=Decimal("2.50")),
+                OrderItem(order=order, product=cls.products[i + 1], quantity=2, price=Decimal("2.50")),
+            ])
+            cls.orders.append(order)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_compact_products_are_flat_and_match_the_nested_ones(self):
+        nested = self.client.get("/api/products/").data["results"]
+        compact = self.client.get("/api/products/", {"view": "compact"}).data["results"]
+
+        self.assertEqual(list(compact[0]), ["id", "name", "price", "stock", "category_name"])
+        self.assertEqual(
+            [(p["id"], p["name"], p["price"], p["stock"], p["category"]["name"]) for p in nested],
+            [(p["id"], p["name"], p["price"], p["stock"], p["category_name"]) for p in compact],
+        )
+
+    def test_sparse_fields_page_through_the_catalog(self):
+        seen = []
+        url = "/api/products/?fields=name&page_size=2"
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual({tuple(row) for row in response.data["results"]}, {("name",)})
+            seen.extend(row["name"] for row in response.data["results"])
+            url = response.data["next"]
+
+        self.assertEqual(sorted(seen), [product.name for product in self.products])
+
+    def test_compact_orders_snapshot_their_lines_in_two_queries(self):
+        with self.assertNumQueries(2):
+            compact = self.client.get("/api/orders/", {"view": "compact"}).json()
+        nested = self.client.get("/api/orders/").json()
+
+        self.assertEqual(len(compact), 3)
+        for flat, order in zip(compact, nested):
+            self.assertEqual((flat["id"], flat["status"], flat["total_price"]), (order["id"], order["status"], order["total_price"]))
+            self.assertEqual(
+                [(line["product_id"], line["product_name"], line["price"], line["quantity"]) for line in flat["items"]],
+                [(item["product"]["id"], item["product"]["name"], "2.50", item["quantity"]) for item in order["items"]],
+            )
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get("/api/orders/", {"fields": "id,secret"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("secret", str(response.data["fields"]))
+
+    def test_compact_cart_matches_the_nested_one(self):
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=self.products[1], quantity=3)
+        nested = self.client.get("/api/cart/").data
+
+        compact = self.client.get("/api/cart/", {"view": "compact"}).data
+
+        self.assertEqual(compact["items"], [{
+            "id": nested["items"][0]["id"], "product_id": self.products[1].pk, "product_name": "Pen 1",
+            "price": "3.50", "quantity": 3, "subtotal": "10.50",
+        }])
+        self.assertEqual(self.client.get("/api/cart/", {"fields": "product_id"}).data["items"], [
+            {"product_id": self.products[1].pk},
+        ])
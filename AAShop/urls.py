@@ -1,7 +1,8 @@
 from django.urls import path, include
 from django.http import HttpResponse
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, ProductViewSet, OrderViewSet, UserViewSet, initiate_payment, verify_payment, register_user, add_to_cart, view_cart, update_cart_item, remove_cart_item, payment_success
+from . import async_views
+from .views import CategoryViewSet, ProductViewSet, OrderViewSet, UserViewSet, initiate_payment, verify_payment, register_user, add_to_cart, view_cart, cart_summary, update_cart_item, remove_cart_item, bulk_update_cart, payment_success, create_order_from_cart, checkout, payment_status, chapa_webhook, sales_analytics
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -23,9 +24,15 @@ urlpatterns = [
     # User registration endpoint
     path("api/register/", register_user, name="register"),
     path("cart/", view_cart, name="view_cart"),
+    path("cart/summary/", cart_summary, name="cart_summary"),
     path("cart/add/", add_to_cart, name="add_to_cart"),
     path("cart/update/<int:item_id>/", update_cart_item, name="update_cart_item"),
     path("cart/remove/<int:item_id>/", remove_cart_item, name="remove_cart_item"),
+    path("cart/bulk/", bulk_update_cart, name="bulk_update_cart"),
+
+    # Order endpoints
+    path("cart/order/", create_order_from_cart, name="create_order_from_cart"),
+    path("checkout/", checkout, name="checkout"),
 
     # JWT Auth endpoints
     path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
@@ -34,5 +41,18 @@ urlpatterns = [
     # Payment endpoints
     path("payments/initiate/", initiate_payment, name="initiate_payment"),
     path("payments/verify/<str:tx_ref>/", verify_payment, name="verify_payment"),
+    path("payments/status/<str:tx_ref>/", payment_status, name="payment_status"),
+    path("payments/webhook/", chapa_webhook, name="chapa_webhook"),
     path("payment/success/", payment_success, name="payment_success"),
+
+    # Reporting
+    path("analytics/", sales_analytics, name="sales_analytics"),
+
+    # Async variants for ASGI (uvicorn) deployments
+    path("async/cart/", async_views.view_cart, name="async_view_cart"),
+    path("async/cart/summary/", async_views.cart_summary, name="async_cart_summary"),
+    path("async/cart/add/", async_views.add_to_cart, name="async_add_to_cart"),
+    path("async/payments/initiate/", async_views.initiate_payment, name="async_initiate_payment"),
+    path("async/payments/verify/<str:tx_ref>/", async_views.verify_payment, name="async_verify_payment"),
+    path("async/payments/webhook/", async_views.chapa_webhook, name="async_chapa_webhook"),
 ]
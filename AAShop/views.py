@@ -1,61 +1,147 @@
 from rest_framework import viewsets, status
-from .models import Category, Product, Order, User, Payment, CartItem, Cart, OrderItem
-from .serializers import CategorySerializer, ProductSerializer, OrderSerializer, UserSerializer, PaymentSerializer, PaymentInitiateRequestSerializer, RegisterSerializer, CartItemSerializer, CartSerializer
-import requests, uuid
+from .models import Category, Product, Order, User, Payment, OrderItem
+from .serializers import CategorySerializer, ProductSerializer, OrderSerializer, UserSerializer, PaymentSerializer, PaymentInitiateRequestSerializer, RegisterSerializer, CartItemSerializer, CartSerializer, CartSummarySerializer, CartBulkSerializer, SalesQuerySerializer, SalesReportSerializer
+from .pagination import ProductCursorPagination, SearchResultsPagination
+from .filters import ProductFilter
+from .search import search_products
+from .cache import CachedCatalogMixin
+from .fieldsets import FieldsetListMixin
+from . import analytics, carts, exports, fieldsets, metrics, routers
+from .services import place_order, apply_payment_outcomes, fail_payment, EmptyCartError, InsufficientStockError
+import uuid
 
 from django.conf import settings
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.decorators import api_view, permission_classes, action
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from .tasks import send_payment_confirmation_email
+from .tasks import initialize_chapa_payment, process_webhook_events
+from . import webhooks
+from .chapa import ChapaError, customer_details, get_client, initialize_payment
 from django.shortcuts import render
+from django.http import HttpResponse, StreamingHttpResponse
 
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CachedCatalogMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    cache_namespaces = ("category",)
 
 def payment_success(request):
     return render(request, "payment_success.html")
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
-    serializer_class = ProductSerializer
+def fieldset_parameters(fieldset):
+    return [
+        openapi.Parameter("fields", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          description=f"Comma-separated flat fields: {', '.join(fieldset.fields)}"),
+        openapi.Parameter("view", openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=["compact"],
+                          description=f"compact: flat {', '.join(fieldset.compact)}"),
+    ]
+
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4")
 
-class OrderViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CachedCatalogMixin, FieldsetListMixin, viewsets.ModelViewSet):
+    # ProductSerializer nests the category, so join it in the same query.
+    queryset = Product.objects.select_related("category")
+    serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ProductFilter
+    cache_namespaces = ("product", "category")
+    live_stock = True
+    fieldset = fieldsets.PRODUCTS
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter("q", openapi.IN_QUERY, description="Search terms", type=openapi.TYPE_STRING, required=True),
+            *fieldset_parameters(fieldsets.PRODUCTS),
+        ],
+        responses={200: ProductSerializer(many=True), 400: "Missing search terms"}
+    )
+    @action(detail=False, methods=["get"], pagination_class=SearchResultsPagination)
+    def search(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response({"error": "Missing search terms"}, status=400)
+
+        queryset = search_products(self.filter_queryset(self.get_queryset()), query)
+        names = self.fieldset.requested(request.query_params)
+        if names is not None:
+            return self.flat_list(queryset, names)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+class OrderViewSet(FieldsetListMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    fieldset = fieldsets.ORDERS
+    expanded_fields = ("items",)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == "list":
+            # Order history can lag a little, except right after checkout
+            queryset = queryset.using(routers.read_alias())
+        return queryset
+
+    def expand_rows(self, rows, ids, names, using):
+        # One query for the lines of every order on the page
+        lines = fieldsets.ORDER_LINES
+        queryset = OrderItem.objects.using(using).filter(order_id__in=ids).order_by("pk")
+        items = {order_id: [] for order_id in ids}
+        for line in lines.rows(queryset, lines.compact, extra=["order_id"]):
+            items[line.pop("order_id")].append(line)
+        for row, order_id in zip(rows, ids):
+            row["items"] = items[order_id]
 
     def perform_create(self, serializer):
-        user = self.request.user
-        cart = Cart.objects.filter(user=user).first()
-
-        if not cart or not cart.items.exists():
+        try:
+            serializer.instance = place_order(self.request.user)
+        except EmptyCartError:
             raise ValidationError({"error": "Cart is empty"})
+        except InsufficientStockError as exc:
+            raise ValidationError({"error": "Insufficient stock", "products": exc.product_ids})
 
-        # Create the order
-        order = serializer.save(user=user, status="PENDING", total_price=0)
-
-        total_price = 0
-        for item in cart.items.all():
-            subtotal = item.product.price * item.quantity
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                price=item.product.price
+    @swagger_auto_schema(
+        operation_description=(
+            "Stream the order lines of matching orders for finance: CSV with one row per line, "
+            "or NDJSON with one order per line and its items nested."
+        ),
+        manual_parameters=[
+            openapi.Parameter("type", openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=list(exports.FORMATS), default="csv"),
+            openapi.Parameter("start", openapi.IN_QUERY, description="ISO date or datetime", type=openapi.TYPE_STRING),
+            openapi.Parameter("end", openapi.IN_QUERY, description="ISO date (inclusive) or datetime", type=openapi.TYPE_STRING),
+            openapi.Parameter("status", openapi.IN_QUERY, description="Comma-separated order statuses", type=openapi.TYPE_STRING),
+        ],
+        responses={200: "CSV or NDJSON stream", 400: "Bad filters"}
+    )
+    @action(detail=False, methods=["get"], permission_classes=[IsAdminUser])
+    def export(self, request):
+        export_format = request.query_params.get("type", "csv")
+        if export_format not in exports.FORMATS:
+            return Response({"error": f"type must be one of {', '.join(exports.FORMATS)}"}, status=400)
+        try:
+            filters = exports.parse_filters(
+                request.query_params.get("start"),
+                request.query_params.get("end"),
+                request.query_params.get("status"),
             )
-            total_price += subtotal
+        except exports.ExportFilterError as exc:
+            return Response({"error": str(exc)}, status=400)
 
-        # Update total price
-        order.total_price = total_price
-        order.save()
-
-        # Clear the cart
-        cart.items.all().delete()   
+        response = StreamingHttpResponse(
+            exports.export(export_format, **filters), content_type=exports.FORMATS[export_format]
+        )
+        response["Content-Disposition"] = f'attachment; filename="orders.{export_format}"'
+        return response
 
         
 class UserViewSet(viewsets.ModelViewSet):
@@ -76,50 +162,44 @@ def initiate_payment(request):
     if not order:
         return Response({"error": "No pending order found"}, status=400)
 
-    # 2. Generate transaction reference
-    tx_ref = str(uuid.uuid4())
-
-    # 3. Build payload for Chapa (includes user details, but not saved in Payment)
-    payload = {
-        "amount": str(order.total_price),
-        "currency": "ETB",
-        "email": request.user.email,
-        "first_name": request.user.first_name,
-        "last_name": request.user.last_name,
-        "tx_ref": tx_ref,
-        "callback_url": "http://127.0.0.1:8000/api/payments/verify/",
-        "return_url": "http://127.0.0.1:8000/payment/success/",
-    }
-
-    headers = {
-        "Authorization": f"Bearer {settings.CHAPA_SECRET_KEY}",
-        "Content-Type": "application/json",
-    }
-
-    # 4. Call Chapa initialize API
-    response = requests.post(
-        f"{settings.CHAPA_BASE_URL}/transaction/initialize",
-        json=payload,
-        headers=headers,
-    )
-    chapa_data = response.json()
-
-    # 5. Save only Payment fields that exist
+    # 2. Record the payment under a fresh transaction reference
     payment = Payment.objects.create(
         order=order,
-        tx_ref=tx_ref,
+        tx_ref=str(uuid.uuid4()),
         amount=order.total_price,
         currency="ETB",
         status="pending",
     )
 
-    # 6. Return combined response
+    # 3. Initialize it with Chapa (inline, or in a Celery task)
+    chapa_data, status_code = start_chapa_payment(payment, request.user)
+
+    # 4. Return combined response
     return Response(
         {"chapa_response": chapa_data, "payment": PaymentSerializer(payment).data},
-        status=status.HTTP_201_CREATED
+        status=status_code
     )
 
 
+def start_chapa_payment(payment, user):
+    """Initialize ``payment`` with Chapa and return (chapa_response, status code).
+
+    With CHAPA_ASYNC_INIT the gateway call is handed to a Celery task and the
+    client polls payments/status/<tx_ref>/ for the checkout_url instead.
+    """
+    customer = customer_details(user)
+    if settings.CHAPA_ASYNC_INIT:
+        initialize_chapa_payment.delay(payment.id, customer)
+        return None, status.HTTP_202_ACCEPTED
+
+    try:
+        return initialize_payment(payment, customer), status.HTTP_201_CREATED
+    except ChapaError:
+        # The order will not be paid for; its stock goes back
+        fail_payment(payment)
+        return {"status": "failed", "message": "Payment gateway unavailable"}, status.HTTP_502_BAD_GATEWAY
+
+
 @swagger_auto_schema(
     method="get",
     manual_parameters=[
@@ -136,72 +216,64 @@ def initiate_payment(request):
 @api_view(["GET"]) 
 @permission_classes([IsAuthenticated])
 def verify_payment(request, tx_ref):
-    headers = {"Authorization": f"Bearer {settings.CHAPA_SECRET_KEY}"}
-
-    response = requests.get(
-        f"{settings.CHAPA_BASE_URL}/transaction/verify/{tx_ref}",
-        headers=headers,
-    )
-    data = response.json()
-
     try:
         payment = Payment.objects.get(tx_ref=tx_ref)
-        chapa_status = data.get("data", {}).get("status", "").lower()
+    except Payment.DoesNotExist:
+        return Response({"error": "Payment not found"}, status=404)
 
-        if chapa_status == "success":
-            payment.status = "completed"
-            payment.transaction_id = data["data"].get("reference")
+    try:
+        data = get_client().verify(tx_ref)
+    except ChapaError:
+        return Response({"error": "Payment gateway unavailable"}, status=status.HTTP_502_BAD_GATEWAY)
 
-            from .tasks import send_payment_confirmation_email
-            send_payment_confirmation_email.delay(
-                request.user.email, payment.order.id, str(payment.amount), payment.status
-            )
+    settle_verified(tx_ref, data)
+    payment.refresh_from_db()
 
-        elif chapa_status == "failed":
-            payment.status = "failed"
+    return Response({
+        "chapa_response": with_customer(data, request.user),
+        "payment": PaymentSerializer(payment).data
+    })
 
-        else:
-            
-            payment.status = "pending"
 
-        payment.save()
+def settle_verified(tx_ref, data):
+    """Apply what Chapa's verify answer says about ``tx_ref``, if it is final."""
+    chapa_status = (data.get("data") or {}).get("status", "").lower()
 
-    except Payment.DoesNotExist:
-        return Response({"error": "Payment not found"}, status=404)
+    # The same transition the webhook worker makes: whichever gets there
+    # first moves the payment (and its order), the other changes nothing.
+    if chapa_status == "success":
+        apply_payment_outcomes({tx_ref: ("completed", data["data"].get("reference"))})
+    elif chapa_status == "failed":
+        apply_payment_outcomes({tx_ref: ("failed", None)})
 
-    user = request.user
+
+def with_customer(data, user):
+    """Fill the customer's details into a Chapa verify response."""
     if "data" in data:
         data["data"]["first_name"] = user.first_name or ""
         data["data"]["last_name"] = user.last_name or ""
         data["data"]["email"] = user.email
         data["data"]["phone_number"] = getattr(user, "phone_number", "") or ""
-
-    return Response({
-        "chapa_response": data,
-        "payment": PaymentSerializer(payment).data
-    })
+    return data
 
 
 @api_view(["POST"])
 @permission_classes([]) 
 def chapa_webhook(request):
+    # Store the delivery and answer at once; process_webhook_events applies
+    # it. Anything but a 2xx makes Chapa redeliver.
+    if not webhooks.signature_is_valid(request.body, request.headers):
+        return Response({"error": "Invalid signature"}, status=401)
     data = request.data
-    tx_ref = data.get("tx_ref")
-    status = data.get("status")
+    if not isinstance(data, dict) or not data.get("tx_ref"):
+        return Response({"error": "Missing tx_ref"}, status=400)
 
-    try:
-        payment = Payment.objects.get(tx_ref=tx_ref)
-        if status == "success":
-            payment.status = "completed"
-            payment.transaction_id = data.get("reference")
-            payment.save()
-            send_payment_confirmation_email.delay(
-                payment.order.user.email, payment.order.id, str(payment.amount), payment.status
-            )
-    except Payment.DoesNotExist:
-        pass
+    webhooks.record_event(data)
+    # At most one scheduled drain per second however hard Chapa retries
+    if cache.add("webhooks:drain-scheduled", 1, timeout=1):
+        process_webhook_events.apply_async(countdown=1)
 
-    return Response({"message": "Webhook processed"}, status=200)
+    return Response({"message": "Webhook received"}, status=200)
 
 
 @swagger_auto_schema(
@@ -225,21 +297,35 @@ def register_user(request):
 
 
 def get_user_cart(user):
-    cart, created = Cart.objects.get_or_create(user=user)
-    return cart
+    return carts.get_backend().get_cart(user)
 
 @swagger_auto_schema(
     method="get",
-    responses={200: CartSerializer}
+    manual_parameters=fieldset_parameters(fieldsets.CART_LINES),
+    responses={200: CartSerializer, 400: "Unknown fields"}
 )
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def view_cart(request):
+    names = fieldsets.CART_LINES.requested(request.query_params)
     cart = get_user_cart(request.user)
+    if names is not None:
+        return Response(fieldsets.flat_cart(cart, names))
     serializer = CartSerializer(cart)
     return Response(serializer.data)
 
+@swagger_auto_schema(
+    method="get",
+    operation_description="Item count and total of the cart, for the header badge.",
+    responses={200: CartSummarySerializer}
+)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def cart_summary(request):
+    summary = carts.get_backend().summary(request.user)
+    return Response(CartSummarySerializer(summary).data)
+
 @swagger_auto_schema(
     method="post",
     request_body=CartItemSerializer,
@@ -249,24 +335,37 @@ def view_cart(request):
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def add_to_cart(request):
-    cart = get_user_cart(request.user)
     serializer = CartItemSerializer(data=request.data)
     if serializer.is_valid():
         product = serializer.validated_data["product"]
-        quantity = serializer.validated_data["quantity"]
+        quantity = serializer.validated_data.get("quantity", 1)
 
-        item, created = CartItem.objects.get_or_create(cart=cart, product=product)
-        if not created:
-            item.quantity += quantity
-        else:
-            item.quantity = quantity
-        item.save()
+        item = carts.get_backend().add(request.user, product, quantity)
 
         return Response(CartItemSerializer(item).data, status=status.HTTP_201_CREATED)
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@swagger_auto_schema(
+    method="post",
+    operation_description=(
+        "Apply many cart changes at once. Each operation adds to (\"add\", the default), "
+        "sets (\"set\") or removes (\"remove\") the line of a product; quantity 0 removes it too."
+    ),
+    request_body=CartBulkSerializer,
+    responses={200: CartSerializer, 400: "Bad Request"}
+)
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def bulk_update_cart(request):
+    serializer = CartBulkSerializer(data=request.data)
+    if serializer.is_valid():
+        cart = carts.get_backend().apply(request.user, serializer.validated_data["operations"])
+        return Response(CartSerializer(cart).data)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 @swagger_auto_schema(
     method="patch",
     request_body=CartItemSerializer,
@@ -275,15 +374,17 @@ def add_to_cart(request):
 @api_view(["PATCH"])
 @permission_classes([IsAuthenticated])
 def update_cart_item(request, item_id):
-    try:
-        item = CartItem.objects.get(id=item_id, cart__user=request.user)
-    except CartItem.DoesNotExist:
+    backend = carts.get_backend()
+    item = backend.get_item(request.user, item_id)
+    if item is None:
         return Response({"error": "Item not found"}, status=404)
 
     serializer = CartItemSerializer(item, data=request.data, partial=True)
     if serializer.is_valid():
-        serializer.save()
-        return Response(serializer.data)
+        item = backend.update(request.user, item, serializer.validated_data)
+        if item is None:
+            return Response({"error": "Item not found"}, status=404)
+        return Response(CartItemSerializer(item).data)
     return Response(serializer.errors, status=400)
 
 @swagger_auto_schema(
@@ -293,12 +394,9 @@ def update_cart_item(request, item_id):
 @api_view(["DELETE"])
 @permission_classes([IsAuthenticated])
 def remove_cart_item(request, item_id):
-    try:
-        item = CartItem.objects.get(id=item_id, cart__user=request.user)
-        item.delete()
+    if carts.get_backend().remove(request.user, item_id):
         return Response({"message": "Item removed"})
-    except CartItem.DoesNotExist:
-        return Response({"error": "Item not found"}, status=404)
+    return Response({"error": "Item not found"}, status=404)
     
 
 @swagger_auto_schema(
@@ -309,36 +407,13 @@ def remove_cart_item(request, item_id):
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])  
 def create_order_from_cart(request):
-    # 1. Get the user’s cart
-    cart = Cart.objects.filter(user=request.user).first()
-    if not cart or not cart.items.exists():
+    try:
+        order = place_order(request.user)
+    except EmptyCartError:
         return Response({"error": "Cart is empty"}, status=400)
+    except InsufficientStockError as exc:
+        return Response({"error": "Insufficient stock", "products": exc.product_ids}, status=400)
 
-    # 2. Create the order
-    order = Order.objects.create(
-        user=request.user,
-        total_price=sum(item.subtotal for item in cart.items.all())
-    )
-
-    # 3. Move cart items into order
-    for item in cart.items.all():
-        subtotal = item.product.price * item.quantity
-        OrderItem.objects.create(
-            order=order,
-            product=item.product,
-            quantity=item.quantity,
-            price=item.product.price 
-        )
-        total_price += subtotal
-
-    # 4. Update total
-    order.total_price = total_price
-    order.save()
-
-    #Clear the cart
-    cart.items.all().delete()
-
-    #Return response
     serializer = OrderSerializer(order)
     return Response(serializer.data, status=201)
 
@@ -395,67 +470,72 @@ def create_order_from_cart(request):
 @permission_classes([IsAuthenticated])
 def checkout(request):
     user = request.user
-    cart = user.cart  # since you use get_or_create, you can also call get_user_cart(user)
-
-    if not cart.items.exists():
-        return Response({"error": "Your cart is empty."}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Step 1: Create Order
-    order = Order.objects.create(user=user, status="pending", total_price=0)
+    # Steps 1-3: Create the order from the cart, clear it and record the payment
+    with transaction.atomic():
+        try:
+            order = place_order(user)
+        except EmptyCartError:
+            return Response({"error": "Your cart is empty."}, status=status.HTTP_400_BAD_REQUEST)
+        except InsufficientStockError as exc:
+            return Response(
+                {"error": "Insufficient stock", "products": exc.product_ids},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-    total_price = 0
-    for item in cart.items.all():
-        subtotal = item.product.price * item.quantity
-        OrderItem.objects.create(
+        total_price = order.total_price
+        tx_ref = str(uuid.uuid4())
+        payment = Payment.objects.create(
             order=order,
-            product=item.product,
-            quantity=item.quantity
+            tx_ref=tx_ref,
+            amount=total_price,
+            currency="ETB",
+            status="pending",
         )
-        total_price += subtotal
-
-    order.total_price = total_price
-    order.save()
 
-    # Step 2: Clear cart
-    cart.items.all().delete()
-
-    # Step 3: Create Payment record
-    tx_ref = str(uuid.uuid4())
-    payment = Payment.objects.create(
-        order=order,
-        tx_ref=tx_ref,
-        amount=total_price,
-        currency="ETB",
-        status="pending",
-    )
-
-    # Step 4: Call Chapa initialize API
-    payload = {
-        "amount": str(total_price),
-        "currency": "ETB",
-        "email": user.email,
-        "first_name": user.username,
-        "last_name": "Customer",
-        "tx_ref": tx_ref,
-        "callback_url": "http://127.0.0.1:8000/api/payments/verify/",
-        "return_url": "http://127.0.0.1:8000/payment/success/",
-    }
-
-    headers = {
-        "Authorization": f"Bearer {settings.CHAPA_SECRET_KEY}",
-        "Content-Type": "application/json",
-    }
-
-    response = requests.post(f"{settings.CHAPA_BASE_URL}/transaction/initialize",
-                             json=payload, headers=headers)
-    chapa_data = response.json()
+    # Step 4: Initialize the payment with Chapa
+    chapa_data, status_code = start_chapa_payment(payment, user)
+    if payment.status == "failed":
+        order.refresh_from_db(fields=["status"])
 
     return Response({
         "order": OrderSerializer(order).data,
         "payment": PaymentSerializer(payment).data,
         "chapa_response": chapa_data
-    }, status=status.HTTP_201_CREATED)
+    }, status=status_code)
+
+
+@swagger_auto_schema(
+    method="get",
+    responses={200: PaymentSerializer, 404: "Payment not found"}
+)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def payment_status(request, tx_ref):
+    try:
+        payment = Payment.objects.get(tx_ref=tx_ref, order__user=request.user)
+    except Payment.DoesNotExist:
+        return Response({"error": "Payment not found"}, status=404)
+    return Response(PaymentSerializer(payment).data)
 
 
 def payment_success(request):
-    return render(request, "payment_success.html")
\ No newline at end of file
+    return render(request, "payment_success.html")
+
+
+@swagger_auto_schema(
+    method="get",
+    operation_description=(
+        "Paid sales from the daily rollups: a daily series (group_by=day, optionally for one "
+        "category or product) or the top categories or products by revenue over the period."
+    ),
+    query_serializer=SalesQuerySerializer,
+    responses={200: SalesReportSerializer, 400: "Bad Request"}
+)
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def sales_analytics(request):
+    query = SalesQuerySerializer(data=request.query_params)
+    if not query.is_valid():
+        return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+    return Response(SalesReportSerializer(analytics.report(**query.validated_data)).data)
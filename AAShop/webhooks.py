@@ -0,0 +1,100 @@
+"""Chapa webhook ingestion.
+
+The webhook view only appends the delivery to WebhookEvent; a Celery task
+applies batches of events to payments and orders. Chapa retries a delivery
+until it gets a 2xx, so both steps are idempotent: a redelivered event hits
+the (tx_ref, event_id) unique constraint, and transitions only ever move a
+payment out of "pending", so replaying events changes nothing.
+"""
+import hashlib
+import hmac
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Now
+
+from . import metrics
+from .models import WebhookEvent
+from .services import apply_payment_outcomes
+
+SIGNATURE_HEADERS = ("Chapa-Signature", "X-Chapa-Signature")
+
+
+def sign(body, secret=None):
+    """The signature Chapa sends with ``body``: its HMAC-SHA256 under the webhook secret."""
+    secret = settings.CHAPA_WEBHOOK_SECRET if secret is None else secret
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def signature_is_valid(body, headers):
+    """Check the HMAC-SHA256 of the raw body against Chapa's signature headers.
+
+    Without a CHAPA_WEBHOOK_SECRET configured, deliveries are only accepted
+    with DEBUG on: anyone could otherwise mark an order paid.
+    """
+    if not settings.CHAPA_WEBHOOK_SECRET:
+        return settings.DEBUG
+    expected = sign(body)
+    return any(hmac.compare_digest(expected, headers.get(name, "")) for name in SIGNATURE_HEADERS)
+
+
+def event_id_for(payload):
+    if payload.get("event_id"):
+        return str(payload["event_id"])[:100]
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _event(payload):
+    return WebhookEvent(
+        tx_ref=str(payload["tx_ref"])[:100],
+        event_id=event_id_for(payload),
+        status=str(payload.get("status") or "").lower()[:20],
+        reference=str(payload.get("reference") or "")[:200],
+        payload=payload,
+    )
+
+
+def record_event(payload):
+    """Store a delivery; a duplicate of a stored event is silently dropped."""
+    WebhookEvent.objects.bulk_create([_event(payload)], ignore_conflicts=True)
+
+
+async def arecord_event(payload):
+    """record_event() for async views."""
+    await WebhookEvent.objects.abulk_create([_event(payload)], ignore_conflicts=True)
+
+
+def process_events(batch_size=500):
+    """Apply the oldest ``batch_size`` unprocessed events; return how many were handled.
+
+    Events are claimed with SKIP LOCKED so several workers can drain the
+    table side by side. Per tx_ref a "success" wins over a "failed" in the
+    same batch, whatever order they arrived in.
+    """
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .order_by("id")
+            .values_list("pk", "tx_ref", "status", "reference")[:batch_size]
+        )
+        if not events:
+            return 0
+
+        outcomes = {}
+        for _, tx_ref, status, reference in events:
+            if status == "success":
+                outcomes[tx_ref] = ("completed", reference or None)
+            elif status == "failed":
+                outcomes.setdefault(tx_ref, ("failed", None))
+
+        completed, failed = apply_payment_outcomes(outcomes)
+        WebhookEvent.objects.filter(pk__in=[pk for pk, *_ in events]).update(processed_at=Now())
+
+    metrics.increment("webhook_events_processed_total", len(events))
+    metrics.increment("webhook_payment_transitions_total", len(completed), status="completed")
+    metrics.increment("webhook_payment_transitions_total", len(failed), status="failed")
+    return len(events)
+